@@ -0,0 +1,358 @@
+""" Benchmark and accuracy suite for the multilateration implementations.
+
+Times every solver across grid sizes, receiver counts, range noise levels and
+drone geometries, using the same range emulation as the Rxs. For each case it
+reports latency percentiles, throughput and position error, and writes the
+results as JSON so they can be compared against a baseline to catch
+regressions:
+
+    python benchmark_multilateration.py -o results.json
+    python benchmark_multilateration.py --baseline results.json
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+import multilateration
+import multilaterationv2
+import rx
+import solver_registry
+from gps import GPSCoord
+from grid_engine import GridEngine
+from lookup_table import (MAX_FORMATION_RXS, RangeLookupTable,
+                          formation_template)
+
+# Benchmark axes.
+GRID_SIZES = [100, 250, 500]
+RECEIVER_COUNTS = [3, 4, 6, 8]
+NOISE_LEVELS = [0.0, 0.1, 0.5]
+GEOMETRIES = ["main", "square", "ring", "collinear"]
+
+# Number of solves per case.
+NUM_TRIALS = 200
+
+# Legacy pure Python implementations are slow, so only run a few trials.
+NUM_LEGACY_TRIALS = 3
+
+# The emulated target moves in a random walk around the Tx, with steps of up to
+# STEP_SIZE metres every TRIAL_PERIOD_S seconds, staying within TARGET_EXTENT
+# metres of the Tx in x and y.
+STEP_SIZE = 0.5
+TRIAL_PERIOD_S = 0.1
+TARGET_EXTENT = 20
+
+# Radius in metres of the ring geometry, equal to the distance of each Rx from
+# the centre of the formation.
+RING_RADIUS = 5 * math.sqrt(2)
+
+# Spacing in metres between Rxs in the collinear geometry.
+COLLINEAR_SPACING = 5
+
+# Relative increase in latency or error over the baseline treated as a
+# regression, and the absolute error increase (m) below which it's ignored.
+LATENCY_TOLERANCE = 0.5
+ERROR_TOLERANCE = 0.5
+MIN_ERROR_INCREASE = 0.05
+
+
+def main_geometry(num_rxs):
+    """ The layout used by multilaterationv2.main(), which has 3 Rxs. """
+    if num_rxs != 3:
+        return None
+    tx_coords = GPSCoord(-43.52051, 172.58310)
+    rx_coords = [
+        GPSCoord(-43.52046, 172.58305),
+        GPSCoord(-43.52046, 172.58315),
+        GPSCoord(-43.52056, 172.58305)
+    ]
+    return tx_coords, rx_coords
+
+
+def square_geometry(num_rxs):
+    """ The Rx start positions from rx.py, around the Tx start position. """
+    if num_rxs > len(rx.RX_START_COORDS):
+        return None
+    return rx.TX_START_COORDS, rx.RX_START_COORDS[:num_rxs]
+
+
+def ring_geometry(num_rxs):
+    """ Rxs evenly spaced on a circle around the Tx. """
+    tx_coords = rx.TX_START_COORDS
+    rx_coords = []
+    for i in range(num_rxs):
+        angle = 2 * math.pi * (i + 0.5) / num_rxs
+        rx_coords.append(
+            tx_coords.add_x_offset(RING_RADIUS * math.cos(angle)).add_y_offset(
+                RING_RADIUS * math.sin(angle)))
+    return tx_coords, rx_coords
+
+
+def collinear_geometry(num_rxs):
+    """ Degenerate layout with the Tx and all Rxs on an east-west line. """
+    tx_coords = rx.TX_START_COORDS
+    rx_coords = [
+        tx_coords.add_x_offset(COLLINEAR_SPACING * (i + 1) *
+                               (1 if i % 2 == 0 else -1))
+        for i in range(num_rxs)
+    ]
+    return tx_coords, rx_coords
+
+
+GEOMETRY_FUNCTIONS = {
+    "main": main_geometry,
+    "square": square_geometry,
+    "ring": ring_geometry,
+    "collinear": collinear_geometry
+}
+
+
+class RegistrySolver:
+    """ Adapts a solver from solver_registry, with no latency budget. """
+    def __init__(self, solver):
+        self.solver = solver
+
+    def solve(self, tx_coords, rx_coords, ranges, previous_target, timestamp):
+        return self.solver.solve(tx_coords, rx_coords, ranges, previous_target,
+                                 timestamp, math.inf)
+
+
+class GridEngineSolver:
+    """ A GridEngine of the given size, centred on the Tx. """
+    def __init__(self, size):
+        self.engine = GridEngine(size, size)
+        self.centre = (size / 2, size / 2)
+
+    def solve(self, tx_coords, rx_coords, ranges, previous_target, timestamp):
+        receivers = multilaterationv2.toCartesian(rx_coords, tx_coords,
+                                                  self.centre)
+        result, residual = self.engine.search(self.centre, receivers, ranges)
+        return multilaterationv2.cartesianToLatLong(result, self.centre,
+                                                    tx_coords)
+
+
+class LegacySolver:
+    """ The original pure Python brute force search from multilateration.py.
+    """
+    def solve(self, tx_coords, rx_coords, ranges, previous_target, timestamp):
+        return multilateration.estimate_target_position(
+            tx_coords, rx_coords, ranges, len(rx_coords))
+
+
+# Lookup tables by number of Rxs, built when first needed.
+lookup_tables = {}
+
+
+def solver_names(legacy):
+    """ Returns the names of every implementation to benchmark. """
+    names = list(solver_registry.SOLVERS)
+    names += ["grid_engine_{}".format(size) for size in GRID_SIZES]
+    if legacy:
+        names.append("legacy_brute_force")
+    return names
+
+
+def create_solver(name, num_rxs):
+    """ Returns a new instance of the named implementation for the given number
+    of Rxs, so stateful solvers (e.g. trackers) start each case from scratch,
+    or None if it doesn't support that many Rxs.
+    """
+    if name.startswith("grid_engine_"):
+        return GridEngineSolver(int(name[len("grid_engine_"):]))
+    elif name == "legacy_brute_force":
+        return LegacySolver()
+
+    lookup_table = None
+    if name == "lookup":
+        # The table is built for the formation, which has a fixed number of
+        # Rxs.
+        if num_rxs > MAX_FORMATION_RXS:
+            return None
+        if num_rxs not in lookup_tables:
+            lookup_tables[num_rxs] = RangeLookupTable.build(
+                formation_template(num_rxs))
+        lookup_table = lookup_tables[num_rxs]
+    return RegistrySolver(
+        solver_registry.create_solver(name, rx.TX_START_COORDS, lookup_table))
+
+
+def target_path(num_trials, seed):
+    """ Returns a random walk of (x, y) target offsets from the Tx. """
+    rng = random.Random(seed)
+    x = rng.uniform(-TARGET_EXTENT / 2, TARGET_EXTENT / 2)
+    y = rng.uniform(-TARGET_EXTENT / 2, TARGET_EXTENT / 2)
+    path = []
+    for i in range(num_trials):
+        x = min(max(x + rng.uniform(-STEP_SIZE, STEP_SIZE), -TARGET_EXTENT),
+                TARGET_EXTENT)
+        y = min(max(y + rng.uniform(-STEP_SIZE, STEP_SIZE), -TARGET_EXTENT),
+                TARGET_EXTENT)
+        path.append((x, y))
+    return path
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run_case(solver, tx_coords, rx_coords, noise, num_trials, seed):
+    """ Runs a solver along a target path, returning the latencies in seconds
+    and the position errors in metres of each solve. """
+    rng = random.Random(seed)
+    latencies = []
+    errors = []
+    previous_target = None
+    for i, (x, y) in enumerate(target_path(num_trials, seed)):
+        target_coords = tx_coords.add_x_offset(x).add_y_offset(y)
+        ranges = [
+            rx.emulate_range(coords, tx_coords, target_coords) +
+            rng.gauss(0, noise) for coords in rx_coords
+        ]
+
+        start_time = time.perf_counter()
+        estimate = solver.solve(tx_coords, rx_coords, ranges, previous_target,
+                                i * TRIAL_PERIOD_S)
+        latencies.append(time.perf_counter() - start_time)
+
+        errors.append(estimate.distance(target_coords))
+        previous_target = estimate
+    return latencies, errors
+
+
+def summarise(latencies, errors):
+    return {
+        "trials": len(latencies),
+        "latency_p50_ms": 1000 * percentile(latencies, 50),
+        "latency_p95_ms": 1000 * percentile(latencies, 95),
+        "latency_p99_ms": 1000 * percentile(latencies, 99),
+        "throughput_hz": len(latencies) / sum(latencies),
+        "error_mean_m": sum(errors) / len(errors),
+        "error_p95_m": percentile(errors, 95),
+        "error_max_m": max(errors)
+    }
+
+
+def run_benchmarks(geometries, receiver_counts, noise_levels, num_trials,
+                   only, legacy, seed):
+    """ Runs every case, printing a line for each, and returns a list of
+    result dictionaries. """
+    results = []
+    for geometry in geometries:
+        for num_rxs in receiver_counts:
+            layout = GEOMETRY_FUNCTIONS[geometry](num_rxs)
+            if layout is None:
+                continue
+            tx_coords, rx_coords = layout
+
+            for name in solver_names(legacy):
+                if only and name not in only:
+                    continue
+                if create_solver(name, num_rxs) is None:
+                    continue
+                trials = num_trials
+                if name == "legacy_brute_force":
+                    trials = min(num_trials, NUM_LEGACY_TRIALS)
+
+                for noise in noise_levels:
+                    latencies, errors = run_case(create_solver(name, num_rxs),
+                                                 tx_coords, rx_coords, noise,
+                                                 trials, seed)
+                    result = {
+                        "solver": name,
+                        "geometry": geometry,
+                        "num_rxs": num_rxs,
+                        "noise_m": noise
+                    }
+                    result.update(summarise(latencies, errors))
+                    results.append(result)
+                    print("{solver:20} {geometry:10} {num_rxs} Rxs  noise "
+                          "{noise_m:.2f} m  p50 {latency_p50_ms:8.3f} ms  p95 "
+                          "{latency_p95_ms:8.3f} ms  {throughput_hz:9.0f} Hz  "
+                          "error mean {error_mean_m:7.3f} m  max "
+                          "{error_max_m:7.3f} m".format(**result))
+    return results
+
+
+def case_key(result):
+    return (result["solver"], result["geometry"], result["num_rxs"],
+            result["noise_m"])
+
+
+def find_regressions(results, baseline):
+    """ Returns a list of messages describing cases which are slower or less
+    accurate than the same case in the baseline results. """
+    baseline_cases = dict((case_key(result), result) for result in baseline)
+    regressions = []
+    for result in results:
+        old = baseline_cases.get(case_key(result))
+        if old is None:
+            continue
+        if (result["latency_p95_ms"] >
+                old["latency_p95_ms"] * (1 + LATENCY_TOLERANCE)):
+            regressions.append("{}: p95 latency {:.3f} ms -> {:.3f} ms".format(
+                case_key(result), old["latency_p95_ms"],
+                result["latency_p95_ms"]))
+        increase = result["error_mean_m"] - old["error_mean_m"]
+        if (increase > MIN_ERROR_INCREASE and
+                result["error_mean_m"] > old["error_mean_m"] *
+            (1 + ERROR_TOLERANCE)):
+            regressions.append("{}: mean error {:.3f} m -> {:.3f} m".format(
+                case_key(result), old["error_mean_m"], result["error_mean_m"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o',
+                        '--output',
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='compare against results in this JSON file, '
+                        'exiting with status 1 if any case regressed')
+    parser.add_argument('-n',
+                        '--trials',
+                        type=int,
+                        default=NUM_TRIALS,
+                        help='number of solves per case')
+    parser.add_argument('--solvers',
+                        help='comma separated solvers to run (default: all)')
+    parser.add_argument('--geometries',
+                        default=",".join(GEOMETRIES),
+                        help='comma separated geometries to run')
+    parser.add_argument('--rxs',
+                        default=",".join(str(n) for n in RECEIVER_COUNTS),
+                        help='comma separated receiver counts to run')
+    parser.add_argument('--noise',
+                        default=",".join(str(n) for n in NOISE_LEVELS),
+                        help='comma separated range noise levels (m) to run')
+    parser.add_argument('--legacy',
+                        action='store_true',
+                        help='also run the slow pure Python brute force')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    only = args.solvers.split(",") if args.solvers else None
+    results = run_benchmarks(args.geometries.split(","),
+                             [int(n) for n in args.rxs.split(",")],
+                             [float(n) for n in args.noise.split(",")],
+                             args.trials, only, args.legacy, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file))
+        for regression in regressions:
+            print("REGRESSION: {}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
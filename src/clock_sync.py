@@ -0,0 +1,141 @@
+""" Estimation of the offset and drift of each Rx's clock relative to the Tx.
+
+Works like NTP: the Tx sends a request at t1 (Tx clock), the Rx receives it at
+t2 and replies at t3 (Rx clock), and the Tx receives the reply at t4. Assuming
+the network delay is the same in both directions, the Rx clock is ahead of the
+Tx clock by
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+
+with a round trip delay of (t4 - t1) - (t3 - t2). Queueing delays are rarely
+symmetric, so only the samples with the lowest round trip delays in a recent
+window are used, and a line fitted through them gives the offset at any time
+along with the drift.
+"""
+import collections
+import math
+
+import numpy as np
+
+from packets import SyncRequest
+
+# How often the Tx sends a sync request.
+SYNC_PERIOD_S = 0.5
+
+# Number of recent samples kept for each Rx.
+SYNC_WINDOW = 64
+
+# Fraction of the samples in the window, with the lowest round trip delays,
+# used to estimate the offset.
+BEST_FRACTION = 0.5
+
+# Minimum time span in seconds of the samples used to estimate the drift.
+# Until the samples span this long, the drift is assumed to be zero.
+MIN_DRIFT_SPAN_S = 10.0
+
+
+class ClockEstimator:
+    """ Estimates the offset and drift of one Rx's clock from sync samples. """
+    def __init__(self, window=SYNC_WINDOW):
+        # Samples of (time on the Tx clock, offset, round trip delay).
+        self.samples = collections.deque(maxlen=window)
+
+        # The offset in seconds at reference_time (on the Tx clock), and the
+        # drift in seconds per second, or None before the first sample.
+        self.offset = None
+        self.reference_time = None
+        self.drift = 0.0
+
+    def add_sample(self, request_time, receive_time, reply_time,
+                   response_time):
+        """ Adds a sample from a request sent at request_time and a reply
+        received at response_time (Tx clock), which the Rx received at
+        receive_time and replied to at reply_time (Rx clock). """
+        delay = ((response_time - request_time) -
+                 (reply_time - receive_time))
+        offset = ((receive_time - request_time) +
+                  (reply_time - response_time)) / 2
+        self.samples.append(
+            ((request_time + response_time) / 2, offset, delay))
+        self.fit()
+
+    def fit(self):
+        samples = np.array(self.samples)
+        keep = max(1, int(len(samples) * BEST_FRACTION))
+        best = samples[np.argsort(samples[:, 2])[:keep]]
+
+        times = best[:, 0]
+        if len(best) >= 2 and np.ptp(times) >= MIN_DRIFT_SPAN_S:
+            self.reference_time = float(np.mean(times))
+            drift, offset = np.polyfit(times - self.reference_time, best[:, 1],
+                                       1)
+            self.drift = float(drift)
+            self.offset = float(offset)
+        else:
+            # Use the sample with the lowest delay.
+            self.reference_time = float(best[0, 0])
+            self.offset = float(best[0, 1])
+            self.drift = 0.0
+
+    def offset_at(self, tx_time):
+        """ Returns the estimated offset of the Rx clock at tx_time. """
+        return self.offset + self.drift * (tx_time - self.reference_time)
+
+    def best_delay(self):
+        """ Returns the lowest round trip delay in the window. """
+        return min(sample[2] for sample in self.samples)
+
+
+class ClockSync:
+    """ Sends sync requests and keeps a ClockEstimator for each Rx, so Rx
+    timestamps can be converted to the Tx clock. """
+    def __init__(self, period_s=SYNC_PERIOD_S):
+        self.period_s = period_s
+        self.estimators = {}
+        self.last_request_time = -math.inf
+
+    def request(self, now):
+        """ Returns a SyncRequest to send if one is due at time now (on the Tx
+        clock), or None otherwise. """
+        if now - self.last_request_time < self.period_s:
+            return None
+        self.last_request_time = now
+        return SyncRequest(now)
+
+    def next_request_time(self):
+        """ Returns the time the next sync request is due. """
+        return self.last_request_time + self.period_s
+
+    def handle_reply(self, reply, response_time):
+        """ Adds the sample from a SyncReply received at response_time. """
+        estimator = self.estimators.get(reply.rx_id)
+        if estimator is None:
+            estimator = self.estimators[reply.rx_id] = ClockEstimator()
+        estimator.add_sample(reply.request_time, reply.receive_time,
+                             reply.reply_time, response_time)
+
+    def has_estimate(self, rx_id):
+        """ Returns True once there's an estimate for the given Rx. """
+        return rx_id in self.estimators
+
+    def to_tx_time(self, rx_id, rx_time):
+        """ Converts a time on the clock of the given Rx to the Tx clock. The
+        time is returned unchanged until there's an estimate for that Rx. """
+        estimator = self.estimators.get(rx_id)
+        if estimator is None:
+            return rx_time
+        # offset_at takes a Tx time, so solve
+        # rx_time = tx_time + offset_at(tx_time) for tx_time.
+        return ((rx_time - estimator.offset +
+                 estimator.drift * estimator.reference_time) /
+                (1 + estimator.drift))
+
+    def summary(self):
+        """ Returns a summary of the estimate for each Rx. """
+        if not self.estimators:
+            return "no samples"
+        return ", ".join(
+            "Rx {}: offset {:.3f} ms, drift {:.2f} ppm, delay {:.3f} ms".format(
+                rx_id, 1000 * estimator.offset, 1e6 * estimator.drift,
+                1000 * estimator.best_delay())
+            for rx_id, estimator in sorted(self.estimators.items()))
@@ -0,0 +1,59 @@
+# Smallest determinant, relative to the squared baseline and range lengths,
+# treated as a solvable system. Anything smaller means the receiver geometry is
+# degenerate (e.g. all drones collinear). Being relative, the same test works
+# whatever the scale of the formation or its orientation.
+MIN_RELATIVE_DETERMINANT = 1e-10
+
+
+def spherical_interpolation(tx, receivers, ranges):
+    """ Estimates the (x, y) target position from any number (at least 3) of
+    bistatic range readings, without iteration.
+
+    With the Tx at the origin, and d the unknown Tx to target distance, each
+    reading gives |p - rx_i| = range_i - d. Squaring and substituting
+    d^2 = |p|^2 leaves an equation that is linear in (x, y, d):
+        2 rx_i.p - 2 range_i d = |rx_i|^2 - range_i^2
+    These are solved in the least squares sense using the 3x3 normal
+    equations, so the cost is linear in the number of receivers.
+
+    Returns None if the geometry is degenerate.
+    """
+    # Accumulate the normal equations A^T A and A^T b directly, rather than
+    # building A, to keep the cost to a single pass over the receivers.
+    m00 = m01 = m02 = m11 = m12 = m22 = 0.0
+    v0 = v1 = v2 = 0.0
+    for receiver, range_reading in zip(receivers, ranges):
+        a0 = 2 * (receiver[0] - tx[0])
+        a1 = 2 * (receiver[1] - tx[1])
+        a2 = -2 * range_reading
+        b = 0.25 * (a0 * a0 + a1 * a1) - range_reading * range_reading
+
+        m00 += a0 * a0
+        m01 += a0 * a1
+        m02 += a0 * a2
+        m11 += a1 * a1
+        m12 += a1 * a2
+        m22 += a2 * a2
+        v0 += a0 * b
+        v1 += a1 * b
+        v2 += a2 * b
+
+    # Solve the symmetric 3x3 system with Cramer's rule.
+    c00 = m11 * m22 - m12 * m12
+    c01 = m02 * m12 - m01 * m22
+    c02 = m01 * m12 - m02 * m11
+    determinant = m00 * c00 + m01 * c01 + m02 * c02
+
+    # Normalise by the squared mean baseline length in the x-y block and by
+    # the range column, which bound the determinant whatever the orientation.
+    # The ratio is 0 for collinear receivers and of order 1 for a well spread
+    # formation.
+    scale = (0.5 * (m00 + m11))**2 * m22
+    if abs(determinant) <= MIN_RELATIVE_DETERMINANT * scale:
+        return None
+
+    c11 = m00 * m22 - m02 * m02
+    c12 = m01 * m02 - m00 * m12
+    x = (c00 * v0 + c01 * v1 + c02 * v2) / determinant
+    y = (c01 * v0 + c11 * v1 + c12 * v2) / determinant
+    return (tx[0] + x, tx[1] + y)
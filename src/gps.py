@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 # Earth's radius in metres.
 EARTH_RADIUS = 6371000
 
@@ -8,6 +10,8 @@ class GPSCoord:
     """ Represents a GPS coordinate with latitude and longitude in
     decimal degrees (DD) format.
     """
+    __slots__ = ("lat", "long")
+
     def __init__(self, latitude, longitude):
         self.lat = latitude
         self.long = longitude
@@ -35,6 +39,26 @@ class GPSCoord:
 
         return degrees
 
+    @staticmethod
+    def dd_to_nmea(degrees, is_latitude):
+        """ Takes a latitude or longitude in DD and converts it to a string in
+        NMEA format, e.g. "17234.98533E". """
+        if is_latitude:
+            direction = "N" if degrees >= 0 else "S"
+            width = 2
+        else:
+            direction = "E" if degrees >= 0 else "W"
+            width = 3
+        degrees = abs(degrees)
+        whole_degrees = int(degrees)
+        # Round to the precision written, carrying into the degrees if needed.
+        minutes = round((degrees - whole_degrees) * 60, 5)
+        if minutes >= 60:
+            whole_degrees += 1
+            minutes -= 60
+        return "{:0{}d}{:08.5f}{}".format(whole_degrees, width, minutes,
+                                          direction)
+
     def distance(self, other):
         """ Calculates the distance in meters between two GPS coordinates using
         the equirectangular approximation. """
@@ -73,3 +97,162 @@ class GPSCoord:
         delta_lat_rad = y / EARTH_RADIUS
         new_lat = self.lat + math.degrees(delta_lat_rad)
         return GPSCoord(new_lat, self.long)
+
+
+class GPSCoordArray:
+    """ A batch of GPS coordinates stored as NumPy float64 arrays of latitudes
+    and longitudes in DD, with vectorised versions of the GPSCoord methods.
+
+    Methods taking another coordinate accept either a GPSCoord or a
+    GPSCoordArray of the same length (or any shape NumPy can broadcast), so
+    operations over a whole swarm or trajectory are single array operations.
+    """
+    __slots__ = ("lat", "long")
+
+    def __init__(self, latitudes, longitudes):
+        self.lat = np.asarray(latitudes, dtype=np.float64)
+        self.long = np.asarray(longitudes, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, index):
+        """ Returns a GPSCoord for an integer index, or a GPSCoordArray for a
+        slice, mask or index array. """
+        if np.ndim(self.lat[index]) == 0:
+            return GPSCoord(float(self.lat[index]), float(self.long[index]))
+        return GPSCoordArray(self.lat[index], self.long[index])
+
+    def __iter__(self):
+        for lat, long in zip(self.lat.tolist(), self.long.tolist()):
+            yield GPSCoord(lat, long)
+
+    def __str__(self):
+        return "[{}]".format(", ".join(str(coord) for coord in self))
+
+    @staticmethod
+    def from_coords(coords):
+        """ Creates a GPSCoordArray from a list of GPSCoords. """
+        return GPSCoordArray([coord.lat for coord in coords],
+                             [coord.long for coord in coords])
+
+    def to_coords(self):
+        """ Returns the coordinates as a list of GPSCoords. """
+        return list(self)
+
+    @staticmethod
+    def from_nmea(nmea_lats, nmea_longs):
+        return GPSCoordArray(GPSCoordArray.nmea_to_dd(nmea_lats),
+                             GPSCoordArray.nmea_to_dd(nmea_longs))
+
+    @staticmethod
+    def nmea_to_dd(coords):
+        """ Takes a list of latitudes or longitudes as strings in NMEA format,
+        e.g. "17234.98533E", and converts them to an array in DD. """
+        values = np.array([float(coord[:-1]) for coord in coords])
+        negative = np.array([coord[-1] in ("S", "W") for coord in coords],
+                            dtype=bool)
+        degrees = np.floor(values / 100)
+        degrees += (values - 100 * degrees) / 60
+        degrees[negative] *= -1
+        return degrees
+
+    def to_nmea(self):
+        """ Returns lists of the latitudes and longitudes as strings in NMEA
+        format. """
+        return ([GPSCoord.dd_to_nmea(lat, True) for lat in self.lat.tolist()],
+                [GPSCoord.dd_to_nmea(long, False)
+                 for long in self.long.tolist()])
+
+    def distance(self, other):
+        """ Calculates the distances in meters to other using the
+        equirectangular approximation. """
+        return np.hypot(self.x_distance(other), self.y_distance(other))
+
+    def x_distance(self, other):
+        """ Calculates the x components of the distances in meters to other
+        using the equirectangular approximation. """
+        lat_1 = np.radians(self.lat)
+        lat_2 = np.radians(other.lat)
+        long_1 = np.radians(self.long)
+        long_2 = np.radians(other.long)
+        x = (long_2 - long_1) * np.cos((lat_1 + lat_2) / 2)
+        return x * EARTH_RADIUS
+
+    def y_distance(self, other):
+        """ Calculates the y components of the distances in meters to other
+        using the equirectangular approximation. """
+        return (np.radians(other.lat) - np.radians(self.lat)) * EARTH_RADIUS
+
+    def add_x_offset(self, x):
+        """ Returns a new GPSCoordArray with the given offsets x in meters added
+        to the longitudes. """
+        delta_long_rad = x / EARTH_RADIUS / np.cos(np.radians(self.lat))
+        return GPSCoordArray(self.lat, self.long + np.degrees(delta_long_rad))
+
+    def add_y_offset(self, y):
+        """ Returns a new GPSCoordArray with the given offsets y in meters added
+        to the latitudes. """
+        delta_lat_rad = y / EARTH_RADIUS
+        return GPSCoordArray(self.lat + np.degrees(delta_lat_rad), self.long)
+
+
+class LocalFrame:
+    """ A local tangent plane anchored at a reference GPSCoord, in which
+    positions are given as (x, y) offsets in meters east and north of the
+    origin.
+
+    Uses the same equirectangular approximation as GPSCoord, but with the
+    projection constants computed once for the origin's latitude rather than
+    on every call. GPSCoord.x_distance scales by the cosine of the mean
+    latitude of the two points instead, so x offsets differ from it by about
+    1 mm at 100 m north and east of the origin, growing with the square of the
+    distance to about 2 cm at 500 m. Positions within a frame are consistent
+    with each other either way. Conversions also accept NumPy arrays of
+    latitudes and longitudes (or x and y offsets).
+    """
+    def __init__(self, origin):
+        self.origin = origin
+        # Meters per degree of latitude and of longitude at the origin.
+        self.lat_scale = math.radians(1) * EARTH_RADIUS
+        self.long_scale = self.lat_scale * math.cos(math.radians(origin.lat))
+
+    def latlong_to_local(self, lat, long):
+        """ Converts a latitude and longitude in DD to (x, y) in meters. """
+        return ((long - self.origin.long) * self.long_scale,
+                (lat - self.origin.lat) * self.lat_scale)
+
+    def local_to_latlong(self, x, y):
+        """ Converts (x, y) in meters to a latitude and longitude in DD. """
+        return (self.origin.lat + y / self.lat_scale,
+                self.origin.long + x / self.long_scale)
+
+    def to_local(self, coord):
+        """ Returns the (x, y) position in meters of a GPSCoord. """
+        return self.latlong_to_local(coord.lat, coord.long)
+
+    def from_local(self, x, y):
+        """ Returns the GPSCoord at (x, y) meters from the origin. """
+        return GPSCoord(*self.local_to_latlong(x, y))
+
+    def to_local_many(self, coords):
+        """ Returns a list of (x, y) positions in meters for a list of
+        GPSCoords. """
+        lat_0 = self.origin.lat
+        long_0 = self.origin.long
+        lat_scale = self.lat_scale
+        long_scale = self.long_scale
+        return [((coord.long - long_0) * long_scale,
+                 (coord.lat - lat_0) * lat_scale) for coord in coords]
+
+    def from_local_many(self, positions):
+        """ Returns a list of GPSCoords for a list of (x, y) positions in
+        meters. """
+        lat_0 = self.origin.lat
+        long_0 = self.origin.long
+        lat_scale = self.lat_scale
+        long_scale = self.long_scale
+        return [
+            GPSCoord(lat_0 + y / lat_scale, long_0 + x / long_scale)
+            for x, y in positions
+        ]
@@ -0,0 +1,191 @@
+import math
+
+import numpy as np
+
+from least_squares import levenberg_marquardt
+
+
+class GridEngine:
+    """ Evaluates the bistatic range residual over a fixed rectangular grid of
+    candidate target positions using NumPy broadcasting.
+
+    Grid coordinates are in metres, with x increasing east and y increasing
+    north, starting from (0, 0) in the south west corner. The candidate
+    positions and all the working arrays are allocated once when the engine is
+    created, and are reused by every search.
+
+    Single precision is used by default since it halves the memory traffic,
+    and still resolves ranges of a few kilometres to well under a millimetre.
+    """
+    def __init__(self, x_range, y_range, resolution=1.0, dtype=np.float32):
+        self.x_range = x_range
+        self.y_range = y_range
+        self.resolution = resolution
+
+        # Candidate coordinates along each axis. The full grid is never stored,
+        # instead the x and y terms are broadcast against each other.
+        self.xs = np.arange(0, x_range, resolution, dtype=dtype)
+        self.ys = np.arange(0, y_range, resolution, dtype=dtype)
+        self.shape = (len(self.ys), len(self.xs))
+
+        # Working arrays, reused between calls to avoid reallocating.
+        self._dx2 = np.empty(len(self.xs), dtype=dtype)
+        self._dy2 = np.empty(len(self.ys), dtype=dtype)
+        self._path = np.empty(self.shape, dtype=dtype)
+        self._residual = np.empty(self.shape, dtype=dtype)
+
+        # Distance from every cell to the Tx, cached since the Tx is usually at
+        # the same grid position (the centre) for every search.
+        self._tx = None
+        self._tx_dist = np.empty(self.shape, dtype=dtype)
+
+    def _distances(self, point, out):
+        """ Writes the distance from every grid cell to point into out. """
+        np.subtract(self.xs, point[0], out=self._dx2)
+        np.square(self._dx2, out=self._dx2)
+        np.subtract(self.ys, point[1], out=self._dy2)
+        np.square(self._dy2, out=self._dy2)
+        np.add(self._dy2[:, np.newaxis], self._dx2[np.newaxis, :], out=out)
+        np.sqrt(out, out=out)
+        return out
+
+    def residual_surface(self, tx, receivers, ranges):
+        """ Returns the mean squared difference between the measured ranges and
+        the bistatic range (Tx to cell to Rx) at every grid cell, as an array
+        indexed by [y index, x index]. Any number of receivers can be given.
+
+        The returned array is owned by the engine and is overwritten by the
+        next search, so copy it if it needs to be kept.
+        """
+        if self._tx is None or tuple(tx) != self._tx:
+            self._distances(tx, self._tx_dist)
+            self._tx = (tx[0], tx[1])
+
+        residual = self._residual
+        residual.fill(0)
+        path = self._path
+        for receiver, range_reading in zip(receivers, ranges):
+            self._distances(receiver, path)
+            path += self._tx_dist
+            path -= range_reading
+            np.square(path, out=path)
+            residual += path
+
+        residual /= len(ranges)
+        return residual
+
+    def search(self, tx, receivers, ranges):
+        """ Returns the (x, y) grid position with the smallest range residual,
+        and the mean squared residual at that position.
+        """
+        residual = self.residual_surface(tx, receivers, ranges)
+        index = np.argmin(residual)
+        row, col = np.unravel_index(index, self.shape)
+        return ((float(self.xs[col]), float(self.ys[row])),
+                float(residual[row, col]))
+
+
+def range_residuals(points, tx, receivers, ranges):
+    """ Returns the mean squared range residual at each of the given candidate
+    (x, y) points, which should be an array-like with shape (M, 2).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    receivers = np.asarray(receivers, dtype=np.float64).reshape(-1, 2)
+    ranges = np.asarray(ranges, dtype=np.float64)
+
+    tx_dist = np.hypot(points[:, 0] - tx[0], points[:, 1] - tx[1])
+    rx_dist = np.hypot(points[:, 0, np.newaxis] - receivers[:, 0],
+                       points[:, 1, np.newaxis] - receivers[:, 1])
+    error = rx_dist + tx_dist[:, np.newaxis] - ranges
+    return np.mean(error * error, axis=1)
+
+
+def distinct_best(points, residuals, count, radius):
+    """ Returns the indices of up to count of the points with the smallest
+    residuals, skipping any point within radius of one already chosen, so the
+    points chosen come from separate basins rather than one long valley.
+    """
+    # Rather than checking each point against those already chosen, take the
+    # best point left and drop every point near it in one pass, so there are
+    # at most count passes, each over fewer points.
+    order = np.argsort(residuals, kind="stable")
+    xs = points[order, 0]
+    ys = points[order, 1]
+    chosen = []
+    while len(order) and len(chosen) < count:
+        chosen.append(order[0])
+        keep = (xs - xs[0])**2 + (ys - ys[0])**2 >= radius**2
+        order = order[keep]
+        xs = xs[keep]
+        ys = ys[keep]
+    return np.array(chosen, dtype=np.intp)
+
+
+def hierarchical_search(tx,
+                        receivers,
+                        ranges,
+                        centre,
+                        size,
+                        resolution=0.05,
+                        levels=None,
+                        beam=8,
+                        coarse_cells=32,
+                        prefer=None):
+    """ Coarse-to-fine search for the position with the smallest range
+    residual, within a square of side size (metres) centred on centre.
+
+    A coarse grid of coarse_cells x coarse_cells points is evaluated first.
+    The best beam points at least two grid spacings apart are kept, and a
+    finer grid is evaluated around each of them, repeating until the grid
+    spacing reaches resolution. The number of refinement levels defaults to
+    shrinking the spacing by about 4 times per level, so the total cost grows
+    with the log of the resolution rather than its square. The best point is
+    then polished with the Levenberg-Marquardt solver.
+
+    Some layouts (e.g. the Tx and every Rx on one line) have two positions
+    which fit the ranges equally well. If prefer is given, the candidate
+    closest to it is chosen from those whose residual is within resolution of
+    the best.
+
+    Returns the best (x, y) position found and its mean squared residual.
+    """
+    spacing = size / coarse_cells
+    offsets = (np.arange(coarse_cells) + 0.5) * spacing - size / 2
+    grid_x, grid_y = np.meshgrid(centre[0] + offsets, centre[1] + offsets)
+    points = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+    residuals = range_residuals(points, tx, receivers, ranges)
+
+    if levels is None:
+        levels = max(0, math.ceil(math.log(spacing / resolution, 4)))
+    factor = (spacing / resolution)**(1 / levels) if levels > 0 else 1
+
+    for level in range(levels):
+        # Keep the best few points from the previous level, from separate
+        # basins.
+        points = points[distinct_best(points, residuals, beam, 2 * spacing)]
+
+        # Cover the neighbourhood of each point (one old spacing either side)
+        # with a grid at the new, finer spacing.
+        spacing /= factor
+        steps = math.ceil(factor)
+        offsets = np.arange(-steps, steps + 1) * spacing
+        offset_x, offset_y = np.meshgrid(offsets, offsets)
+        neighbourhood = np.column_stack((offset_x.ravel(), offset_y.ravel()))
+        points = (points[:, np.newaxis, :] +
+                  neighbourhood[np.newaxis, :, :]).reshape(-1, 2)
+        residuals = range_residuals(points, tx, receivers, ranges)
+
+    index = np.argmin(residuals)
+    if prefer is not None:
+        candidates = distinct_best(points, residuals, beam, 2 * spacing)
+        tied = candidates[residuals[candidates] <=
+                          residuals[index] + resolution**2]
+        index = tied[np.argmin(
+            np.hypot(*(points[tied] - np.asarray(prefer, dtype=np.float64)).T))]
+
+    # The grid point is only within a spacing of the minimum, so finish with a
+    # few iterations of the solver. It never accepts a step which increases
+    # the residual.
+    position, residual, converged = levenberg_marquardt(
+        tx, receivers, ranges, points[index])
+    return (position[0], position[1]), residual
@@ -0,0 +1,102 @@
+import math
+import time
+
+# Smallest distance used when normalising the Jacobian, to avoid dividing by
+# zero when the estimate lands exactly on a drone.
+MIN_DISTANCE = 1e-9
+
+
+def range_errors(position, tx, receivers, ranges):
+    """ Returns the bistatic range errors (Tx to position to Rx, minus the
+    measured range) for each receiver, along with the Jacobian of each error
+    with respect to the x and y coordinates of the position.
+    """
+    x, y = position
+    tx_dx = x - tx[0]
+    tx_dy = y - tx[1]
+    tx_dist = max(math.hypot(tx_dx, tx_dy), MIN_DISTANCE)
+
+    errors = []
+    jacobian = []
+    for receiver, range_reading in zip(receivers, ranges):
+        rx_dx = x - receiver[0]
+        rx_dy = y - receiver[1]
+        rx_dist = max(math.hypot(rx_dx, rx_dy), MIN_DISTANCE)
+        errors.append(tx_dist + rx_dist - range_reading)
+        jacobian.append((tx_dx / tx_dist + rx_dx / rx_dist,
+                         tx_dy / tx_dist + rx_dy / rx_dist))
+    return errors, jacobian
+
+
+def levenberg_marquardt(tx,
+                        receivers,
+                        ranges,
+                        initial_position,
+                        max_iterations=20,
+                        max_time_s=0.005,
+                        tolerance=1e-4,
+                        max_residual=1.0):
+    """ Solves the bistatic range equations for the (x, y) target position
+    using the Levenberg-Marquardt method with an analytic Jacobian, starting
+    from initial_position.
+
+    The solver stops after max_iterations, or once max_time_s has elapsed, so
+    its latency is bounded. It is considered to have converged if the step size
+    falls below tolerance (metres) and the mean squared range error is at most
+    max_residual.
+
+    Returns the final position, its mean squared range error, and whether the
+    solver converged.
+    """
+    deadline = time.perf_counter() + max_time_s
+    position = (float(initial_position[0]), float(initial_position[1]))
+    errors, jacobian = range_errors(position, tx, receivers, ranges)
+    cost = sum(error * error for error in errors)
+    damping = 1e-3
+
+    for iteration in range(max_iterations):
+        # Normal equations J^T J and J^T e, solved directly since they're 2x2.
+        a = sum(j[0] * j[0] for j in jacobian)
+        b = sum(j[0] * j[1] for j in jacobian)
+        d = sum(j[1] * j[1] for j in jacobian)
+        g_x = sum(j[0] * e for j, e in zip(jacobian, errors))
+        g_y = sum(j[1] * e for j, e in zip(jacobian, errors))
+
+        step = None
+        while step is None:
+            a_damped = a * (1 + damping)
+            d_damped = d * (1 + damping)
+            determinant = a_damped * d_damped - b * b
+            if determinant <= 0:
+                damping *= 10
+                if damping > 1e12:
+                    break
+                continue
+
+            step = ((-d_damped * g_x + b * g_y) / determinant,
+                    (b * g_x - a_damped * g_y) / determinant)
+            candidate = (position[0] + step[0], position[1] + step[1])
+            new_errors, new_jacobian = range_errors(candidate, tx, receivers,
+                                                    ranges)
+            new_cost = sum(error * error for error in new_errors)
+
+            if new_cost < cost:
+                position, errors, jacobian = candidate, new_errors, new_jacobian
+                cost = new_cost
+                damping = max(damping / 10, 1e-12)
+            else:
+                damping *= 10
+                if damping > 1e12:
+                    break
+                # Only retry with more damping if the step is still significant.
+                if math.hypot(*step) >= tolerance:
+                    step = None
+
+        residual = cost / len(ranges)
+        if step is None or math.hypot(*step) < tolerance:
+            return position, residual, residual <= max_residual
+
+        if time.perf_counter() >= deadline:
+            break
+
+    return position, cost / len(ranges), False
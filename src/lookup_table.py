@@ -0,0 +1,131 @@
+""" Precomputed inverse of the bistatic range equations for a fixed formation.
+
+When the drones are in formation, the Rx positions relative to the Tx are
+(almost) constant, so the range readings depend only on the target position
+relative to the Tx. The table stores the range vector for a regular grid of
+target positions, and multilateration becomes a nearest neighbour lookup in
+range space, followed by a local refinement.
+
+Build the table offline with:
+    python lookup_table.py [-o formation_lut] [--extent 50] [--spacing 0.5]
+"""
+import argparse
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from swarming_logic import FORMATION_OFFSETS
+
+# Default path prefix for the saved table files.
+DEFAULT_PATH = "formation_lut"
+
+# Maximum distance in metres between an Rx and its template position for the
+# table to be used.
+TEMPLATE_TOLERANCE = 1.0
+
+# Number of Rxs with a position in the formation (drone 0 is the Tx).
+MAX_FORMATION_RXS = len(FORMATION_OFFSETS) - 1
+
+
+def formation_template(num_rxs):
+    """ Returns the position of each Rx relative to the Tx when the drones are
+    in formation, ordered by Rx ID. """
+    if num_rxs > MAX_FORMATION_RXS:
+        raise ValueError("The formation only has positions for {} Rxs."
+                         .format(MAX_FORMATION_RXS))
+    tx_x, tx_y = FORMATION_OFFSETS[0]
+    return [(FORMATION_OFFSETS[rx_id][0] - tx_x,
+             FORMATION_OFFSETS[rx_id][1] - tx_y)
+            for rx_id in range(1, num_rxs + 1)]
+
+
+class RangeLookupTable:
+    """ Maps range vectors to target positions (in metres relative to the Tx)
+    for a given formation template. The position and range arrays may be
+    memory-mapped, so the table can be shared between processes.
+    """
+    def __init__(self, receivers, positions, ranges):
+        self.receivers = np.asarray(receivers, dtype=np.float64)
+        self.positions = positions
+        self.ranges = ranges
+        self.tree = cKDTree(ranges)
+
+    @staticmethod
+    def build(receivers, extent=50, spacing=0.5):
+        """ Builds a table covering target positions up to extent metres from
+        the Tx in x and y, at the given spacing. """
+        offsets = np.arange(-extent, extent + spacing / 2, spacing)
+        grid_x, grid_y = np.meshgrid(offsets, offsets)
+        positions = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+
+        receivers = np.asarray(receivers, dtype=np.float64)
+        tx_dist = np.hypot(positions[:, 0], positions[:, 1])
+        rx_dist = np.hypot(positions[:, 0, np.newaxis] - receivers[:, 0],
+                           positions[:, 1, np.newaxis] - receivers[:, 1])
+        ranges = rx_dist + tx_dist[:, np.newaxis]
+        return RangeLookupTable(receivers, positions, ranges)
+
+    def save(self, path=DEFAULT_PATH):
+        np.save(path + ".receivers.npy", self.receivers)
+        np.save(path + ".positions.npy", self.positions)
+        np.save(path + ".ranges.npy", self.ranges)
+
+    @staticmethod
+    def load(path=DEFAULT_PATH):
+        """ Loads a saved table, memory-mapping the position and range arrays.
+        """
+        return RangeLookupTable(np.load(path + ".receivers.npy"),
+                                np.load(path + ".positions.npy", mmap_mode="r"),
+                                np.load(path + ".ranges.npy", mmap_mode="r"))
+
+    def matches(self, receivers, tolerance=TEMPLATE_TOLERANCE):
+        """ Returns True if the given Rx positions (relative to the Tx) are all
+        within tolerance metres of the positions the table was built for. """
+        receivers = np.asarray(receivers, dtype=np.float64)
+        if receivers.shape != self.receivers.shape:
+            return False
+        errors = np.hypot(*(receivers - self.receivers).T)
+        return bool(np.all(errors <= tolerance))
+
+    def lookup(self, ranges):
+        """ Returns the tabulated target position (relative to the Tx) whose
+        range vector is closest to the given ranges, and the distance between
+        the two range vectors. """
+        distance, index = self.tree.query(ranges)
+        position = self.positions[index]
+        return (float(position[0]), float(position[1])), float(distance)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o',
+                        '--output',
+                        default=DEFAULT_PATH,
+                        help='path prefix for the saved table files')
+    parser.add_argument('-n',
+                        '--num-rxs',
+                        type=int,
+                        default=4,
+                        help='number of Rxs in the formation')
+    parser.add_argument('--extent',
+                        type=float,
+                        default=50,
+                        help='maximum target offset from the Tx in metres')
+    parser.add_argument('--spacing',
+                        type=float,
+                        default=0.5,
+                        help='spacing between table entries in metres')
+    args = parser.parse_args()
+    if args.num_rxs > MAX_FORMATION_RXS:
+        parser.error("the formation only has positions for {} Rxs".format(
+            MAX_FORMATION_RXS))
+
+    table = RangeLookupTable.build(formation_template(args.num_rxs),
+                                   args.extent, args.spacing)
+    table.save(args.output)
+    print("Saved {} entries to {}.*.npy".format(len(table.positions),
+                                                args.output))
+
+
+if __name__ == "__main__":
+    main()
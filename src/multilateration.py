@@ -1,8 +1,7 @@
 import math
-from scipy import optimize
-import time
 
 from gps import GPSCoord
+from least_squares import levenberg_marquardt
 
 #current problems: bad formatting converting lat/long to xy
 #inaccurate method, won't work if they're too far away
@@ -57,13 +56,13 @@ def bruteForce(grid, Tx, receiverArray, rangeArray, numDrones):
         currentRange = [None] * numDrones
         L = [None] * numDrones
         LSum = 0
-        for i in range(0, numDrones-1):
+        for i in range(0, numDrones):
             currentRange[i] = findNorm(Tx, entry) + findNorm(receiverArray[i], entry)
             L[i] = (currentRange[i] - rangeArray[i])**2
             LSum = LSum + L[i]
             
         Ltotal = LSum / numDrones
-        LArray.append(L)
+        LArray.append(Ltotal)
 
     target = grid[LArray.index(min(LArray))]
     return target
@@ -98,7 +97,7 @@ def estimate_target_position(TxCoord, RxCoordArray, rangeArray, numDrones):
     
     #Map from GPS to grid locations
     Rx = [None] * numDrones
-    for i in range(0, numDrones-1):
+    for i in range(0, numDrones):
         Rx[i] = (calcX(RxCoordArray[i], TxCoord, Tx), calcY(RxCoordArray[i], TxCoord, Tx))
     
     #Perform Calculations
@@ -110,14 +109,11 @@ def estimate_target_position(TxCoord, RxCoordArray, rangeArray, numDrones):
     #print(end - start)    
     return result
 
-def root_estimate():
-    start = time.time()
-    
-    #scipy.optimise.root(fun, args = [500,500], x0 = [250,250], method = 'hybr', tol = 1)
-    
-    end = time.time()
-    print(end - start)       
-    return
+def root_estimate(Tx, receiverArray, rangeArray, x0):
+    #iterative least squares solution of the range equations, starting from x0
+    #returns the target and whether the solver converged
+    target, residual, converged = levenberg_marquardt(Tx, receiverArray, rangeArray, x0)
+    return target, converged
 
 def main():
     #Determine size of grid (metres), create grid (using smaller grid here for ease of testing)
@@ -1,13 +1,32 @@
 import math
-from scipy import optimize
-import time
 
-from gps import GPSCoord
+from closed_form import spherical_interpolation
+from gps import GPSCoord, LocalFrame
+from grid_engine import GridEngine, hierarchical_search
+from least_squares import levenberg_marquardt
 
 #current problems: bad formatting converting lat/long to xy
 #inaccurate method, won't work if they're too far away
 #using 100000 to convert lat/long to xyz, if units are different won't work
 
+#Size of the search grid used by estimate_target_position (metres)
+X_RANGE = 100
+Y_RANGE = 100
+
+#Grid engine shared between calls, so the grid is only allocated once
+GRID_ENGINE = GridEngine(X_RANGE, Y_RANGE)
+
+#Default settings for the coarse-to-fine search
+FINE_RESOLUTION = 0.05
+BEAM_WIDTH = 8
+
+#Mean squared range error above which a search result is treated as a miss
+MAX_RESIDUAL = 1.0
+
+#Limits on the iterative solver, so its latency is bounded
+MAX_ITERATIONS = 20
+MAX_SOLVE_TIME_S = 0.005
+
 def createGrid(xRange, yRange):
     #Create a grid
 
@@ -69,6 +88,19 @@ def bruteForce(grid, Tx, Rx1, Rx2, Rx3, r1, r2, r3):
     target = grid[LArray.index(min(LArray))]
     return target
 
+def gridSearch(engine, Tx, receiverArray, rangeArray):
+    #vectorised equivalent of bruteForce, using every receiver given
+    target, residual = engine.search(Tx, receiverArray, rangeArray)
+    return target
+
+def hierarchicalSearch(Tx, receiverArray, rangeArray, size, resolution=FINE_RESOLUTION, levels=None, beam=BEAM_WIDTH, prefer=None):
+    #coarse-to-fine alternative to bruteForce, searches a size x size square
+    #centred on the transmitter down to the given resolution. prefer picks
+    #between equally good solutions, e.g. either side of a line of drones
+    target, residual = hierarchical_search(Tx, receiverArray, rangeArray, Tx, size,
+                                           resolution, levels, beam, prefer=prefer)
+    return target
+
 def calcX(RxiCoord, TxCoord, Tx):
     #converts gps coords to cartesian X coord
     x = TxCoord.x_distance(RxiCoord)
@@ -81,66 +113,201 @@ def calcY(RxiCoord, TxCoord, Tx):
     yGrid = Tx[1] + y
     return round(yGrid)
 
-def cartesianToLatLong(target, Tx, TxCoord):
-    #converts cartesian coords to GPS coords
-    x = target[0] - Tx[0]
-    y = target[1] - Tx[1]
-    return TxCoord.add_x_offset(x).add_y_offset(y)
+def calcXY(RxiCoord, TxCoord, Tx, frame=None):
+    #converts gps coords to cartesian coords, without rounding to the grid
+    return toCartesian([RxiCoord], TxCoord, Tx, frame)[0]
+
+def toCartesian(CoordArray, TxCoord, Tx, frame=None):
+    #converts a list of gps coords to cartesian coords in one pass, with the
+    #transmitter at Tx. frame is the LocalFrame for the session (see
+    #solver_registry.create_solver), so its constants are only computed once,
+    #otherwise a frame is made at the transmitter
+    if frame is None:
+        frame = LocalFrame(TxCoord)
+    TxLocal = frame.to_local(TxCoord)
+    x0 = Tx[0] - TxLocal[0]
+    y0 = Tx[1] - TxLocal[1]
+    return [(x0 + x, y0 + y) for x, y in frame.to_local_many(CoordArray)]
+
+def cartesianToLatLong(target, Tx, TxCoord, frame=None):
+    #converts cartesian coords to GPS coords, the inverse of toCartesian
+    if frame is None:
+        frame = LocalFrame(TxCoord)
+    TxLocal = frame.to_local(TxCoord)
+    return frame.from_local(target[0] - Tx[0] + TxLocal[0],
+                            target[1] - Tx[1] + TxLocal[1])
     
 def estimate_target_position(tx, rx1, rx2, rx3, r4, range1, range2, range3, range4):
+    return estimate_target_position_grid(tx, [rx1, rx2, rx3, r4],
+                                         [range1, range2, range3, range4])
+
+def estimate_target_position_grid(TxCoord, RxCoordArray, rangeArray, frame=None):
 
     #start = time.time()
-    #Determine size of grid (metres), create grid
-    xRange = 100
-    yRange = 100
-    grid = createGrid(xRange, yRange)
+    #Grid (metres) is preallocated once in GRID_ENGINE
+    engine = GRID_ENGINE
     
     #Transmitter drone always centre of grid
-    Tx = (xRange/2, yRange/2)
-    
-     #Set conditions for localisation testing
-    TxCoord = tx
-
-    Rx1Coord = rx1
-    Rx2Coord = rx2
-    Rx3Coord = rx3
+    Tx = (X_RANGE/2, Y_RANGE/2)
 
-    #targetCoord = GPSCoord(-43.52059, 172.58315)
-
-    
     #Map from GPS to grid locations
-    Rx1 = (calcX(Rx1Coord, TxCoord, Tx), calcY(Rx1Coord, TxCoord, Tx))
-    Rx2 = (calcX(Rx2Coord, TxCoord, Tx), calcY(Rx2Coord, TxCoord, Tx))
-    Rx3 = (calcX(Rx3Coord, TxCoord, Tx), calcY(Rx3Coord, TxCoord, Tx))
-    
-    #calculate true ranges, in practical test this will be given as the output of the SDR
-    r1 = range1
-    r2 = range2
-    r3 = range3
+    receiverArray = [(round(x), round(y)) for x, y in toCartesian(RxCoordArray, TxCoord, Tx, frame)]
 
     #Perform Calculations
-    result = bruteForce(grid, Tx, Rx1, Rx2, Rx3, r1, r2, r3)
+    result = gridSearch(engine, Tx, receiverArray, rangeArray)
 
     #convert back to GPS coord
-    result = cartesianToLatLong(result, Tx, TxCoord)
+    result = cartesianToLatLong(result, Tx, TxCoord, frame)
     #end = time.time()
     #print(end - start)    
     return result
 
-def root_estimate():
-    start = time.time()
-    
-    #scipy.optimise.root(fun, args = [500,500], x0 = [250,250], method = 'hybr', tol = 1)
-    
-    end = time.time()
-    print(end - start)       
-    return
+def estimate_target_position_hierarchical(TxCoord, RxCoordArray, rangeArray, previousCoord=None, resolution=FINE_RESOLUTION, levels=None, beam=BEAM_WIDTH, frame=None):
+    #Same search area as estimate_target_position, but refined to sub-metre resolution.
+    #If there are two equally good solutions, picks the one nearest previousCoord
+    Tx = (X_RANGE/2, Y_RANGE/2)
+
+    #Map from GPS to exact (unrounded) cartesian locations
+    receiverArray = toCartesian(RxCoordArray, TxCoord, Tx, frame)
+    prefer = None if previousCoord is None else calcXY(previousCoord, TxCoord, Tx, frame)
+
+    result = hierarchicalSearch(Tx, receiverArray, rangeArray, X_RANGE,
+                                resolution, levels, beam, prefer)
+
+    #convert back to GPS coord
+    return cartesianToLatLong(result, Tx, TxCoord, frame)
+
+def estimate_target_position_lookup(TxCoord, RxCoordArray, rangeArray, table, previousCoord=None, frame=None):
+    #Nearest neighbour lookup in a precomputed RangeLookupTable, refined with the
+    #iterative solver. Only valid while the drones are in the formation the table
+    #was built for, otherwise falls back to the general solver, warm started from
+    #the nearest table entry if there was one, or else previousCoord
+    seedCoord = previousCoord
+    Tx = (X_RANGE/2, Y_RANGE/2)
+    receiverArray = toCartesian(RxCoordArray, TxCoord, Tx, frame)
+    relativeArray = [(Rx[0] - Tx[0], Rx[1] - Tx[1]) for Rx in receiverArray]
+
+    if table.matches(relativeArray):
+        offset, distance = table.lookup(rangeArray)
+        x0 = (Tx[0] + offset[0], Tx[1] + offset[1])
+        result, converged = root_estimate(Tx, receiverArray, rangeArray, x0)
+        if converged:
+            return cartesianToLatLong(result, Tx, TxCoord, frame)
+        seedCoord = cartesianToLatLong(x0, Tx, TxCoord, frame)
+
+    return estimate_target_position_lsq(TxCoord, RxCoordArray, rangeArray, seedCoord, frame=frame)
+
+def estimate_target_position_tracked(TxCoord, RxCoordArray, rangeArray, tracker, frame, timestamp):
+    #Starts from the position predicted by a KalmanTracker, whose positions are
+    #in metres in the LocalFrame frame. Inside the window around the prediction
+    #the target is in a single basin, so the prediction is polished with the
+    #iterative solver, and the window is only searched if that fails. Searches
+    #the full grid if there's no track yet, or the target wasn't found in the
+    #window. Outliers rejected by the tracker are replaced with the prediction
+    Tx = (X_RANGE/2, Y_RANGE/2)
+    receiverArray = toCartesian(RxCoordArray, TxCoord, Tx, frame)
+
+    #Offset from the tracker frame to the grid frame
+    TxLocal = frame.to_local(TxCoord)
+    offset = (Tx[0] - TxLocal[0], Tx[1] - TxLocal[1])
+
+    centre = None
+    residual = None
+    if tracker.initialised():
+        predicted, window = tracker.predict(timestamp)
+        centre = (predicted[0] + offset[0], predicted[1] + offset[1])
+        result, residual, converged = levenberg_marquardt(Tx, receiverArray, rangeArray, centre,
+                                                          MAX_ITERATIONS, MAX_SOLVE_TIME_S)
+        if max(abs(result[0] - centre[0]), abs(result[1] - centre[1])) > window / 2:
+            residual = None
+        if residual is None or residual > MAX_RESIDUAL:
+            result, residual = hierarchical_search(Tx, receiverArray, rangeArray, centre, window,
+                                                   FINE_RESOLUTION, None, BEAM_WIDTH, 16)
+
+    if residual is None or residual > MAX_RESIDUAL:
+        result, residual = hierarchical_search(Tx, receiverArray, rangeArray, Tx, X_RANGE,
+                                               FINE_RESOLUTION, None, BEAM_WIDTH)
+
+    if not tracker.update((result[0] - offset[0], result[1] - offset[1]), timestamp) and centre is not None:
+        result = centre
+
+    return cartesianToLatLong(result, Tx, TxCoord, frame)
+
+def estimate_target_position_particle(TxCoord, RxCoordArray, rangeArray, particleFilter, frame, timestamp):
+    #Updates a ParticleFilter, whose positions are in metres in the LocalFrame frame,
+    #with the new readings. Returns the estimate and the spread of the particles (metres)
+    origin = (0, 0)
+    points = toCartesian([TxCoord] + RxCoordArray, frame.origin, origin, frame)
+    Tx, receiverArray = points[0], points[1:]
+
+    if particleFilter.initialised():
+        particleFilter.predict(timestamp)
+    else:
+        #Scatter the particles around a one-off estimate
+        x0 = linearEstimate(Tx, receiverArray, rangeArray)
+        if x0 is None:
+            x0, residual = hierarchical_search(Tx, receiverArray, rangeArray, Tx, X_RANGE)
+        particleFilter.initialise(x0, timestamp)
+
+    particleFilter.update(Tx, receiverArray, rangeArray)
+    result, spread = particleFilter.estimate()
+    return cartesianToLatLong(result, origin, frame.origin, frame), spread
+
+def root_estimate(Tx, receiverArray, rangeArray, x0, max_iterations=MAX_ITERATIONS, max_time_s=MAX_SOLVE_TIME_S):
+    #iterative least squares solution of the range equations, starting from x0
+    #returns the target and whether the solver converged
+    target, residual, converged = levenberg_marquardt(Tx, receiverArray, rangeArray, x0,
+                                                      max_iterations, max_time_s)
+    return target, converged
+
+def linearEstimate(Tx, receiverArray, rangeArray):
+    #closed form estimate using every receiver, None if the geometry is degenerate
+    return spherical_interpolation(Tx, receiverArray, rangeArray)
+
+def estimate_target_position_linear(TxCoord, RxCoordArray, rangeArray, frame=None):
+    #Closed form estimate for any number (at least 3) of receivers
+    Tx = (X_RANGE/2, Y_RANGE/2)
+    receiverArray = toCartesian(RxCoordArray, TxCoord, Tx, frame)
+
+    result = linearEstimate(Tx, receiverArray, rangeArray)
+    if result is None:
+        return estimate_target_position_hierarchical(TxCoord, RxCoordArray, rangeArray, frame=frame)
+    return cartesianToLatLong(result, Tx, TxCoord, frame)
+
+def estimate_target_position_lsq(TxCoord, RxCoordArray, rangeArray, previousCoord=None, max_time_s=MAX_SOLVE_TIME_S, frame=None):
+    #Warm start from the previous target estimate if there is one, otherwise
+    #seed from the closed form estimate. Falls back to the grid search if the
+    #solver can't be seeded or doesn't converge
+    Tx = (X_RANGE/2, Y_RANGE/2)
+    receiverArray = toCartesian(RxCoordArray, TxCoord, Tx, frame)
+
+    if previousCoord is not None:
+        x0 = calcXY(previousCoord, TxCoord, Tx, frame)
+    else:
+        x0 = linearEstimate(Tx, receiverArray, rangeArray)
+
+    if x0 is not None:
+        result, converged = root_estimate(Tx, receiverArray, rangeArray, x0,
+                                          max_time_s=max_time_s)
+        if converged:
+            return cartesianToLatLong(result, Tx, TxCoord, frame)
+
+    return estimate_target_position_hierarchical(TxCoord, RxCoordArray, rangeArray, previousCoord, frame=frame)
+
+def range_residual(targetCoord, TxCoord, RxCoordArray, rangeArray):
+    #mean squared difference between the measured ranges and the ranges implied
+    #by a target estimate, using the same distance approximation as the Rxs
+    txDistance = TxCoord.distance(targetCoord)
+    errors = [txDistance + RxCoord.distance(targetCoord) - r
+              for RxCoord, r in zip(RxCoordArray, rangeArray)]
+    return sum(error * error for error in errors) / len(errors)
 
 def main():
     #Determine size of grid (metres), create grid (using smaller grid here for ease of testing)
     xRange = 500
     yRange = 500
     grid = createGrid(xRange, yRange)
+    engine = GridEngine(xRange, yRange)
 
     #Transmitter drone always centre of grid
     Tx = (xRange/2, yRange/2)
@@ -167,7 +334,7 @@ def main():
     r2 = findNorm(Tx, target) + findNorm(Rx2, target)
     r3 = findNorm(Tx, target) + findNorm(Rx3, target)
     
-    result = bruteForce(grid, Tx, Rx1, Rx2, Rx3, r1, r2, r3)
+    result = gridSearch(engine, Tx, [Rx1, Rx2, Rx3], [r1, r2, r3])
 
     #convert back to GPS coord
     result = cartesianToLatLong(result, Tx, TxCoord)
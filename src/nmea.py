@@ -0,0 +1,221 @@
+""" Streaming NMEA 0183 parser.
+
+NMEAParser accepts raw bytes in chunks of any size (e.g. straight from a serial
+port or a log file), frames complete sentences across chunk boundaries,
+validates their checksums, and decodes GGA, RMC and VTG sentences from any
+talker (GP, GN, GL, ...) into typed records. parse_log() parses a whole log
+file into NumPy arrays.
+"""
+import collections
+
+import numpy as np
+
+# Decoded sentences. Times are seconds since midnight UTC, latitudes and
+# longitudes are in DD, and fields missing from the sentence (e.g. before the
+# receiver has a fix) are None.
+GGARecord = collections.namedtuple("GGARecord", [
+    "time", "lat", "long", "fix_quality", "num_satellites", "hdop", "altitude"
+])
+RMCRecord = collections.namedtuple(
+    "RMCRecord",
+    ["time", "valid", "lat", "long", "speed_knots", "course", "date"])
+VTGRecord = collections.namedtuple(
+    "VTGRecord",
+    ["course_true", "course_magnetic", "speed_knots", "speed_kmh"])
+
+# Maximum length of a sentence. Anything longer without a line ending is
+# treated as noise and discarded.
+MAX_SENTENCE_LENGTH = 256
+
+
+def checksum(body):
+    """ Returns the NMEA checksum (XOR of every byte) of the bytes between the
+    '$' and the '*' of a sentence. """
+    # Treat the body as one big integer and repeatedly fold the top half onto
+    # the bottom half, which takes log2(n) integer operations rather than n.
+    value = int.from_bytes(body, "little")
+    width = len(body)
+    while width > 1:
+        half = (width + 1) // 2
+        value = (value ^ (value >> (8 * half))) & ((1 << (8 * half)) - 1)
+        width = half
+    return value
+
+
+def _float(field):
+    return float(field) if field else None
+
+
+def _int(field):
+    return int(field) if field else None
+
+
+def _time(field):
+    """ Converts an NMEA time field "hhmmss.ss" to seconds since midnight. """
+    if not field:
+        return None
+    return (int(field[0:2]) * 3600 + int(field[2:4]) * 60 + float(field[4:]))
+
+
+def _coordinate(value, direction):
+    """ Converts an NMEA latitude or longitude field, e.g. "17234.98533" and
+    "E", to DD. Equivalent to GPSCoord.nmea_to_dd, without the string slicing.
+    """
+    if not value:
+        return None
+    value = float(value)
+    degrees = int(value / 100)
+    degrees += (value - 100 * degrees) / 60
+    return -degrees if direction in ("S", "W") else degrees
+
+
+def _parse_gga(fields):
+    return GGARecord(_time(fields[1]), _coordinate(fields[2], fields[3]),
+                     _coordinate(fields[4], fields[5]), _int(fields[6]),
+                     _int(fields[7]), _float(fields[8]), _float(fields[9]))
+
+
+def _parse_rmc(fields):
+    return RMCRecord(_time(fields[1]), fields[2] == "A",
+                     _coordinate(fields[3], fields[4]),
+                     _coordinate(fields[5], fields[6]), _float(fields[7]),
+                     _float(fields[8]), fields[9] or None)
+
+
+def _parse_vtg(fields):
+    return VTGRecord(_float(fields[1]), _float(fields[3]), _float(fields[5]),
+                     _float(fields[7]))
+
+
+# Record type, decoder and minimum number of fields for each sentence type.
+PARSERS = {
+    "GGA": (GGARecord, _parse_gga, 10),
+    "RMC": (RMCRecord, _parse_rmc, 10),
+    "VTG": (VTGRecord, _parse_vtg, 8)
+}
+
+
+class NMEAParser:
+    """ Frames and decodes NMEA sentences from a stream of bytes.
+
+    Counts the sentences decoded, and those rejected for a bad checksum, a
+    malformed body or an unsupported type, so link quality can be monitored.
+    """
+    def __init__(self, require_checksum=True, types=None):
+        # Sentences without a checksum are rejected unless this is False.
+        self.require_checksum = require_checksum
+
+        # Sentence types to decode (e.g. {"GGA"}), defaulting to all supported
+        # types. Other sentences are skipped before their checksum is checked.
+        self.types = set(PARSERS) if types is None else set(types)
+
+        self.buffer = bytearray()
+
+        self.decoded = 0
+        self.checksum_errors = 0
+        self.malformed = 0
+        self.unsupported = 0
+
+    def feed(self, data):
+        """ Adds a chunk of bytes to the stream, returning a list of records
+        for every complete, valid and supported sentence it finishes. """
+        self.buffer += data
+        end = self.buffer.rfind(b"\n")
+        if end < 0:
+            if len(self.buffer) > MAX_SENTENCE_LENGTH:
+                self.buffer.clear()
+            return []
+
+        lines = self.buffer[:end].split(b"\n")
+        del self.buffer[:end + 1]
+
+        records = []
+        for line in lines:
+            record = self.parse_sentence(line)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def parse_sentence(self, line):
+        """ Validates and decodes a single sentence (as bytes, with or without
+        the line ending). Returns None if it's invalid or unsupported. """
+        start = line.find(b"$")
+        if start < 0:
+            return None
+        line = line[start + 1:].rstrip(b"\r\n ")
+
+        # The address is a 2 character talker ID followed by the sentence type.
+        sentence_type = line[2:line.find(b",")].decode("ascii", "replace")
+        if sentence_type not in self.types:
+            self.unsupported += 1
+            return None
+
+        star = line.rfind(b"*")
+        if star >= 0:
+            try:
+                expected = int(line[star + 1:star + 3], 16)
+            except ValueError:
+                self.malformed += 1
+                return None
+            body = line[:star]
+            if checksum(body) != expected:
+                self.checksum_errors += 1
+                return None
+        elif self.require_checksum:
+            self.checksum_errors += 1
+            return None
+        else:
+            body = line
+
+        try:
+            fields = body.decode("ascii").split(",")
+        except UnicodeDecodeError:
+            self.malformed += 1
+            return None
+
+        record_type, parse, min_fields = PARSERS[sentence_type]
+        if len(fields) < min_fields:
+            self.malformed += 1
+            return None
+
+        try:
+            record = parse(fields)
+        except ValueError:
+            self.malformed += 1
+            return None
+        self.decoded += 1
+        return record
+
+
+def records_to_arrays(records, record_type=GGARecord):
+    """ Converts the records of the given type to a dictionary of NumPy arrays,
+    one per field, with missing numeric values as NaN. Non-numeric fields
+    (e.g. the RMC date) are returned as object arrays. """
+    selected = [record for record in records if type(record) is record_type]
+    arrays = {}
+    for index, field in enumerate(record_type._fields):
+        values = [record[index] for record in selected]
+        if any(isinstance(value, str) for value in values):
+            arrays[field] = np.array(values, dtype=object)
+        else:
+            arrays[field] = np.array(
+                [np.nan if value is None else value for value in values],
+                dtype=np.float64)
+    return arrays
+
+
+def parse_log(path, sentence_type="GGA", chunk_size=1 << 20):
+    """ Parses a whole NMEA log file, returning a dictionary of NumPy arrays
+    (see records_to_arrays) for the sentences of the given type, along with
+    the parser so its error counts can be checked. """
+    parser = NMEAParser(types=[sentence_type])
+    records = []
+    with open(path, "rb") as log:
+        while True:
+            chunk = log.read(chunk_size)
+            if not chunk:
+                break
+            records.extend(parser.feed(chunk))
+    # Parse a final sentence with no line ending.
+    records.extend(parser.feed(b"\n"))
+    return records_to_arrays(records, PARSERS[sentence_type][0]), parser
@@ -1,17 +1,177 @@
+""" Wire format for the messages sent between the Tx and the Rxs.
+
+Every message is a frame starting with a header giving the format version,
+the packet type, flags and the number of records, followed by that many
+fixed size records, all in network byte order:
+
+    header      version u8, packet type u8, flags u8, count u16
+    RX_UPDATE   rx_id u8, seq_no u32, timestamp f8, lat f8, long f8, range f8
+                [target lat f8, target long f8 if FLAG_TARGET is set]
+    TX_UPDATE   target lat f8, target long f8, tx lat f8, tx long f8
+    SYNC_REQUEST    request time f8
+    SYNC_REPLY      rx_id u8, request time f8, receive time f8, reply time f8
+    KEYFRAME_REQUEST    rx_id u8
+
+An RX_UPDATE frame can hold a batch of readings. decode_rx_array() returns
+them as a NumPy structured array viewing the message buffer, so a batch is
+decoded without creating any per-reading objects.
+
+For low bandwidth links there's also a compact encoding (RX_UPDATE_COMPACT and
+TX_UPDATE_COMPACT) of fixed-point deltas from periodic keyframes, produced by
+CompactRxEncoder and CompactTxEncoder. RxUpdateDecoder and TxUpdateDecoder
+decode either encoding. A decoder which drops a delta because it missed its
+keyframe asks for a new one with a KEYFRAME_REQUEST.
+
+SYNC_REQUEST and SYNC_REPLY frames carry the timestamps of the exchange used to
+estimate the offset of each Rx's clock (see clock_sync.py).
+"""
 import struct
 
+import numpy as np
+
 from gps import GPSCoord
 
+PACKET_VERSION = 1
+
+# Packet types.
+RX_UPDATE = 1
+TX_UPDATE = 2
+
+# Set if the RxUpdate records include the actual target coordinates, which are
+# only needed for plotting.
+FLAG_TARGET = 0x01
+
+# Maximum number of records in a frame.
+MAX_BATCH_SIZE = 0xffff
+
+HEADER = struct.Struct("!BBBH")
+RX_RECORD = struct.Struct("!BIdddd")
+RX_TARGET_RECORD = struct.Struct("!BIdddddd")
+TX_RECORD = struct.Struct("!dddd")
+
+# NumPy equivalents of the RxUpdate records, for decoding batches.
+RX_DTYPE = np.dtype([("rx_id", "u1"), ("seq_no", ">u4"),
+                     ("timestamp", ">f8"), ("lat", ">f8"), ("long", ">f8"),
+                     ("range", ">f8")])
+RX_TARGET_DTYPE = np.dtype(RX_DTYPE.descr + [("target_lat", ">f8"),
+                                             ("target_long", ">f8")])
+
+
+class PacketError(Exception):
+    pass
+
+
+def decode_header(buffer, packet_type):
+    """ Checks the header of a frame of the given packet type, and returns its
+    flags and record count. """
+    if len(buffer) < HEADER.size:
+        raise PacketError("Frame too short for a header ({} bytes).".format(
+            len(buffer)))
+    version, frame_type, flags, count = HEADER.unpack_from(buffer)
+    if version != PACKET_VERSION:
+        raise PacketError("Unsupported packet version {}.".format(version))
+    if frame_type != packet_type:
+        raise PacketError("Expected packet type {}, got {}.".format(
+            packet_type, frame_type))
+    return flags, count
+
+
+def check_length(buffer, count, record):
+    expected = HEADER.size + count * record.size
+    if len(buffer) != expected:
+        raise PacketError("Frame of {} records should be {} bytes, got {}."
+                          .format(count, expected, len(buffer)))
+
+
+def encode_rx_updates(updates, include_target=True):
+    """ Encodes a batch of RxUpdates as a single frame. The target coordinates
+    are only included if include_target is True and every update has them. """
+    if len(updates) > MAX_BATCH_SIZE:
+        raise PacketError("Too many updates for one frame ({}).".format(
+            len(updates)))
+    include_target = include_target and all(
+        update.target_coords is not None for update in updates)
+    record = RX_TARGET_RECORD if include_target else RX_RECORD
+    flags = FLAG_TARGET if include_target else 0
+
+    buffer = bytearray(HEADER.size + len(updates) * record.size)
+    HEADER.pack_into(buffer, 0, PACKET_VERSION, RX_UPDATE, flags,
+                     len(updates))
+    offset = HEADER.size
+    for update in updates:
+        if include_target:
+            record.pack_into(buffer, offset, update.rx_id, update.seq_no,
+                             update.timestamp, update.rx_coords.lat,
+                             update.rx_coords.long, update.range,
+                             update.target_coords.lat,
+                             update.target_coords.long)
+        else:
+            record.pack_into(buffer, offset, update.rx_id, update.seq_no,
+                             update.timestamp, update.rx_coords.lat,
+                             update.rx_coords.long, update.range)
+        offset += record.size
+    return bytes(buffer)
+
+
+def encode_rx_array(readings):
+    """ Encodes a structured array of readings (with dtype RX_DTYPE or
+    RX_TARGET_DTYPE, or the same fields in any byte order) as a single frame.
+    """
+    include_target = "target_lat" in readings.dtype.names
+    dtype = RX_TARGET_DTYPE if include_target else RX_DTYPE
+    if len(readings) > MAX_BATCH_SIZE:
+        raise PacketError("Too many readings for one frame ({}).".format(
+            len(readings)))
+    header = HEADER.pack(PACKET_VERSION, RX_UPDATE,
+                         FLAG_TARGET if include_target else 0, len(readings))
+    return header + readings.astype(dtype, copy=False).tobytes()
+
+
+def decode_rx_array(buffer):
+    """ Decodes an RX_UPDATE frame from any bytes-like object into a read-only
+    NumPy structured array (with dtype RX_DTYPE, or RX_TARGET_DTYPE if the
+    frame includes target coordinates) which views the buffer without copying
+    it. """
+    buffer = memoryview(buffer)
+    flags, count = decode_header(buffer, RX_UPDATE)
+    include_target = bool(flags & FLAG_TARGET)
+    check_length(buffer, count,
+                 RX_TARGET_RECORD if include_target else RX_RECORD)
+    return np.frombuffer(buffer,
+                         dtype=RX_TARGET_DTYPE if include_target else RX_DTYPE,
+                         count=count,
+                         offset=HEADER.size)
+
+
+def decode_rx_updates(buffer):
+    """ Decodes an RX_UPDATE frame from any bytes-like object into a list of
+    RxUpdates. """
+    buffer = memoryview(buffer)
+    flags, count = decode_header(buffer, RX_UPDATE)
+    include_target = bool(flags & FLAG_TARGET)
+    record = RX_TARGET_RECORD if include_target else RX_RECORD
+    check_length(buffer, count, record)
+
+    updates = []
+    for fields in record.iter_unpack(buffer[HEADER.size:]):
+        target_coords = (GPSCoord(fields[6], fields[7])
+                         if include_target else None)
+        updates.append(
+            RxUpdate(fields[0], fields[2], fields[1],
+                     GPSCoord(fields[3], fields[4]), fields[5], target_coords))
+    return updates
+
 
 class RxUpdate:
     def __init__(self, rx_id, timestamp, seq_no, rx_coords, range_reading,
-                 target_coords):
+                 target_coords=None):
         self.rx_id = rx_id
         self.timestamp = timestamp
         self.seq_no = seq_no
         self.rx_coords = rx_coords
         self.range = range_reading
-        # TODO: Only used for plotting, remove when no longer needed.
+        # TODO: Only used for plotting, remove when no longer needed. None if
+        # it wasn't sent.
         self.target_coords = target_coords
 
     def __str__(self):
@@ -21,16 +181,14 @@ class RxUpdate:
 
     @staticmethod
     def from_bytes(b):
-        (rx_id, timestamp, seq_no, lat, lon, range_reading, target_lat,
-         target_long) = struct.unpack("!ididdddd", b)
-        return RxUpdate(rx_id, timestamp, seq_no, GPSCoord(lat, lon),
-                        range_reading, GPSCoord(target_lat, target_long))
+        updates = decode_rx_updates(b)
+        if len(updates) != 1:
+            raise PacketError("Expected a single update, got {}.".format(
+                len(updates)))
+        return updates[0]
 
-    def to_bytes(self):
-        return struct.pack("!ididdddd", self.rx_id, self.timestamp,
-                           self.seq_no, self.rx_coords.lat,
-                           self.rx_coords.long, self.range,
-                           self.target_coords.lat, self.target_coords.long)
+    def to_bytes(self, include_target=True):
+        return encode_rx_updates([self], include_target)
 
 
 class TxUpdate:
@@ -46,11 +204,366 @@ class TxUpdate:
 
     @staticmethod
     def from_bytes(b):
-        target_lat, target_long, tx_lat, tx_long = struct.unpack("!dddd", b)
+        flags, count = decode_header(b, TX_UPDATE)
+        check_length(b, count, TX_RECORD)
+        if count != 1:
+            raise PacketError("Expected a single update, got {}.".format(count))
+        target_lat, target_long, tx_lat, tx_long = TX_RECORD.unpack_from(
+            b, HEADER.size)
         return TxUpdate(GPSCoord(target_lat, target_long),
                         GPSCoord(tx_lat, tx_long))
 
     def to_bytes(self):
-        return struct.pack("!dddd", self.target_coords.lat,
-                           self.target_coords.long, self.tx_coords.lat,
-                           self.tx_coords.long)
+        buffer = bytearray(HEADER.size + TX_RECORD.size)
+        HEADER.pack_into(buffer, 0, PACKET_VERSION, TX_UPDATE, 0, 1)
+        TX_RECORD.pack_into(buffer, HEADER.size, self.target_coords.lat,
+                            self.target_coords.long, self.tx_coords.lat,
+                            self.tx_coords.long)
+        return bytes(buffer)
+
+
+# Compact encoding for constrained radio links. Coordinates are sent as integer
+# micro-degrees and ranges as integer millimetres. Every KEYFRAME_INTERVAL
+# frames (or whenever a delta doesn't fit) a keyframe carries the full values;
+# the frames in between carry small deltas from the values in the most recent
+# keyframe, along with that keyframe's ID. Rather than waiting for keyframes to
+# be acknowledged, a decoder drops any delta whose keyframe it hasn't received
+# (e.g. a PUB message lost by a slow subscriber), and asks the encoder for a new
+# keyframe over the socket in the other direction. The request can be lost too,
+# so the periodic keyframes still bound how long the stream stays broken.
+RX_UPDATE_COMPACT = 3
+TX_UPDATE_COMPACT = 4
+
+# Set if a compact frame is a keyframe.
+FLAG_KEYFRAME = 0x02
+
+# Number of frames between keyframes, including the keyframe.
+KEYFRAME_INTERVAL = 10
+
+MICRODEGREES = 1e6
+MILLIMETRES = 1e3
+MICROSECONDS = 1e6
+
+# Keyframe ID, rx_id, seq_no, timestamp, lat, long and range, with the target
+# lat and long in RX_TARGET_KEYFRAME.
+RX_KEYFRAME = struct.Struct("!BBIdiiI")
+RX_TARGET_KEYFRAME = struct.Struct("!BBIdiiIii")
+
+# Keyframe ID, rx_id, and deltas of seq_no, timestamp (us), lat, long and
+# range, with the target lat and long deltas in RX_TARGET_DELTA.
+RX_DELTA = struct.Struct("!BBBihhh")
+RX_TARGET_DELTA = struct.Struct("!BBBihhhhh")
+
+# Keyframe ID, target lat and long, Tx lat and long, as values or deltas.
+TX_KEYFRAME = struct.Struct("!Biiii")
+TX_DELTA = struct.Struct("!Bhhhh")
+
+INT16_MIN = -0x8000
+INT16_MAX = 0x7fff
+INT32_MIN = -0x80000000
+INT32_MAX = 0x7fffffff
+
+
+def packet_type(buffer):
+    """ Returns the packet type of a frame, without checking the rest of it. """
+    if len(buffer) < HEADER.size:
+        raise PacketError("Frame too short for a header ({} bytes).".format(
+            len(buffer)))
+    return buffer[1]
+
+
+def to_microdegrees(degrees):
+    return int(round(degrees * MICRODEGREES))
+
+
+def fits_int16(values):
+    return all(INT16_MIN <= value <= INT16_MAX for value in values)
+
+
+class CompactRxEncoder:
+    """ Encodes the RxUpdates from a single Rx in the compact format. """
+    def __init__(self,
+                 include_target=True,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        self.include_target = include_target
+        self.keyframe_interval = keyframe_interval
+
+        # ID of the most recent keyframe, the number of frames since it was
+        # sent, and the quantised values it contained.
+        self.keyframe_id = -1
+        self.frames_since_keyframe = 0
+        self.keyframe = None
+
+    def request_keyframe(self):
+        """ Makes the next frame a keyframe, e.g. when the decoder missed the
+        last one. """
+        self.keyframe = None
+
+    def encode(self, update):
+        include_target = (self.include_target
+                          and update.target_coords is not None)
+        # Quantised seq_no, timestamp (us), lat, long and range, followed by
+        # the target lat and long if included.
+        values = [
+            update.seq_no,
+            int(round(update.timestamp * MICROSECONDS)),
+            to_microdegrees(update.rx_coords.lat),
+            to_microdegrees(update.rx_coords.long),
+            int(round(update.range * MILLIMETRES))
+        ]
+        if include_target:
+            values += [
+                to_microdegrees(update.target_coords.lat),
+                to_microdegrees(update.target_coords.long)
+            ]
+
+        if (self.keyframe is not None
+                and len(values) == len(self.keyframe)
+                and self.frames_since_keyframe < self.keyframe_interval):
+            deltas = [value - key for value, key in zip(values, self.keyframe)]
+            if (0 <= deltas[0] <= 0xff and INT32_MIN <= deltas[1] <= INT32_MAX
+                    and fits_int16(deltas[2:])):
+                self.frames_since_keyframe += 1
+                record = RX_TARGET_DELTA if include_target else RX_DELTA
+                flags = FLAG_TARGET if include_target else 0
+                return (HEADER.pack(PACKET_VERSION, RX_UPDATE_COMPACT, flags,
+                                    1) +
+                        record.pack(self.keyframe_id, update.rx_id, *deltas))
+
+        self.keyframe_id = (self.keyframe_id + 1) % 0x100
+        self.frames_since_keyframe = 1
+        self.keyframe = values
+        record = RX_TARGET_KEYFRAME if include_target else RX_KEYFRAME
+        flags = FLAG_KEYFRAME | (FLAG_TARGET if include_target else 0)
+        return (HEADER.pack(PACKET_VERSION, RX_UPDATE_COMPACT, flags, 1) +
+                record.pack(self.keyframe_id, update.rx_id, update.seq_no,
+                            update.timestamp, *values[2:]))
+
+
+class RxUpdateDecoder:
+    """ Decodes RX_UPDATE frames and compact frames from any number of Rxs into
+    RxUpdates, keeping the most recent keyframe from each Rx. """
+    def __init__(self):
+        # The ID and values of the most recent keyframe from each Rx, with the
+        # timestamp as a float.
+        self.keyframes = {}
+
+        # Number of deltas dropped because their keyframe was missing.
+        self.missing_keyframes = 0
+
+        # IDs of the Rxs whose keyframe is missing, and those of them which a
+        # keyframe hasn't been requested from yet.
+        self.missing = set()
+        self.requests = []
+
+    def take_keyframe_requests(self):
+        """ Returns the IDs of the Rxs to ask for a new keyframe, each only
+        once until it sends one. """
+        requests = self.requests
+        self.requests = []
+        return requests
+
+    def decode(self, buffer):
+        """ Returns a list of the RxUpdates in a frame, which is empty if it's
+        a delta from a missing keyframe. """
+        buffer = memoryview(buffer)
+        if packet_type(buffer) == RX_UPDATE:
+            return decode_rx_updates(buffer)
+
+        flags, count = decode_header(buffer, RX_UPDATE_COMPACT)
+        include_target = bool(flags & FLAG_TARGET)
+        if flags & FLAG_KEYFRAME:
+            record = RX_TARGET_KEYFRAME if include_target else RX_KEYFRAME
+            check_length(buffer, count, record)
+            fields = record.unpack_from(buffer, HEADER.size)
+            keyframe_id, rx_id, seq_no, timestamp = fields[:4]
+            values = fields[4:]
+            self.keyframes[rx_id] = (keyframe_id, seq_no, timestamp, values)
+            self.missing.discard(rx_id)
+        else:
+            record = RX_TARGET_DELTA if include_target else RX_DELTA
+            check_length(buffer, count, record)
+            fields = record.unpack_from(buffer, HEADER.size)
+            keyframe_id, rx_id, seq_delta, time_delta = fields[:4]
+            keyframe = self.keyframes.get(rx_id)
+            if keyframe is None or keyframe[0] != keyframe_id or len(
+                    keyframe[3]) != len(fields) - 4:
+                self.missing_keyframes += 1
+                if rx_id not in self.missing:
+                    self.missing.add(rx_id)
+                    self.requests.append(rx_id)
+                return []
+            seq_no = keyframe[1] + seq_delta
+            timestamp = keyframe[2] + time_delta / MICROSECONDS
+            values = [
+                key + delta for key, delta in zip(keyframe[3], fields[4:])
+            ]
+
+        target_coords = None
+        if include_target:
+            target_coords = GPSCoord(values[3] / MICRODEGREES,
+                                     values[4] / MICRODEGREES)
+        return [
+            RxUpdate(rx_id, timestamp, seq_no,
+                     GPSCoord(values[0] / MICRODEGREES,
+                              values[1] / MICRODEGREES),
+                     values[2] / MILLIMETRES, target_coords)
+        ]
+
+
+class CompactTxEncoder:
+    """ Encodes TxUpdates in the compact format. """
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_id = -1
+        self.frames_since_keyframe = 0
+        self.keyframe = None
+
+    def request_keyframe(self):
+        """ Makes the next frame a keyframe, e.g. when a decoder missed the
+        last one. """
+        self.keyframe = None
+
+    def encode(self, update):
+        values = [
+            to_microdegrees(update.target_coords.lat),
+            to_microdegrees(update.target_coords.long),
+            to_microdegrees(update.tx_coords.lat),
+            to_microdegrees(update.tx_coords.long)
+        ]
+        if (self.keyframe is not None
+                and self.frames_since_keyframe < self.keyframe_interval):
+            deltas = [value - key for value, key in zip(values, self.keyframe)]
+            if fits_int16(deltas):
+                self.frames_since_keyframe += 1
+                return (HEADER.pack(PACKET_VERSION, TX_UPDATE_COMPACT, 0, 1) +
+                        TX_DELTA.pack(self.keyframe_id, *deltas))
+
+        self.keyframe_id = (self.keyframe_id + 1) % 0x100
+        self.frames_since_keyframe = 1
+        self.keyframe = values
+        return (HEADER.pack(PACKET_VERSION, TX_UPDATE_COMPACT, FLAG_KEYFRAME,
+                            1) + TX_KEYFRAME.pack(self.keyframe_id, *values))
+
+
+class TxUpdateDecoder:
+    """ Decodes TX_UPDATE frames and compact frames into TxUpdates, keeping
+    the most recent keyframe. """
+    def __init__(self):
+        self.keyframe_id = None
+        self.keyframe = None
+        self.missing_keyframes = 0
+
+        # Whether the keyframe is missing, and whether a new one needs to be
+        # requested.
+        self.missing = False
+        self.request = False
+
+    def take_keyframe_request(self):
+        """ Returns True if a new keyframe should be requested, only once until
+        one arrives. """
+        request = self.request
+        self.request = False
+        return request
+
+    def decode(self, buffer):
+        """ Returns the TxUpdate in a frame, or None if it's a delta from a
+        missing keyframe. """
+        buffer = memoryview(buffer)
+        if packet_type(buffer) == TX_UPDATE:
+            return TxUpdate.from_bytes(buffer)
+
+        flags, count = decode_header(buffer, TX_UPDATE_COMPACT)
+        if flags & FLAG_KEYFRAME:
+            check_length(buffer, count, TX_KEYFRAME)
+            fields = TX_KEYFRAME.unpack_from(buffer, HEADER.size)
+            self.keyframe_id = fields[0]
+            self.keyframe = values = fields[1:]
+            self.missing = False
+        else:
+            check_length(buffer, count, TX_DELTA)
+            fields = TX_DELTA.unpack_from(buffer, HEADER.size)
+            if self.keyframe is None or fields[0] != self.keyframe_id:
+                self.missing_keyframes += 1
+                if not self.missing:
+                    self.missing = True
+                    self.request = True
+                return None
+            values = [key + delta for key, delta in zip(self.keyframe,
+                                                         fields[1:])]
+
+        return TxUpdate(
+            GPSCoord(values[0] / MICRODEGREES, values[1] / MICRODEGREES),
+            GPSCoord(values[2] / MICRODEGREES, values[3] / MICRODEGREES))
+
+
+# Clock synchronisation. The Tx broadcasts a SYNC_REQUEST stamped with its send
+# time, and each Rx replies with a SYNC_REPLY holding that time along with its
+# own receive and reply times, from which the Tx estimates the offset of each
+# Rx's clock (see clock_sync.py).
+SYNC_REQUEST = 5
+SYNC_REPLY = 6
+
+SYNC_REQUEST_RECORD = struct.Struct("!d")
+SYNC_REPLY_RECORD = struct.Struct("!Bddd")
+
+
+class SyncRequest:
+    def __init__(self, request_time):
+        # Time the request was sent, on the Tx clock.
+        self.request_time = request_time
+
+    @staticmethod
+    def from_bytes(b):
+        flags, count = decode_header(b, SYNC_REQUEST)
+        check_length(b, count, SYNC_REQUEST_RECORD)
+        return SyncRequest(*SYNC_REQUEST_RECORD.unpack_from(b, HEADER.size))
+
+    def to_bytes(self):
+        return (HEADER.pack(PACKET_VERSION, SYNC_REQUEST, 0, 1) +
+                SYNC_REQUEST_RECORD.pack(self.request_time))
+
+
+class SyncReply:
+    def __init__(self, rx_id, request_time, receive_time, reply_time):
+        self.rx_id = rx_id
+        # Time the request was sent, on the Tx clock.
+        self.request_time = request_time
+        # Times the request was received and the reply sent, on the Rx clock.
+        self.receive_time = receive_time
+        self.reply_time = reply_time
+
+    @staticmethod
+    def from_bytes(b):
+        flags, count = decode_header(b, SYNC_REPLY)
+        check_length(b, count, SYNC_REPLY_RECORD)
+        return SyncReply(*SYNC_REPLY_RECORD.unpack_from(b, HEADER.size))
+
+    def to_bytes(self):
+        return (HEADER.pack(PACKET_VERSION, SYNC_REPLY, 0, 1) +
+                SYNC_REPLY_RECORD.pack(self.rx_id, self.request_time,
+                                       self.receive_time, self.reply_time))
+
+
+# Keyframe requests for the compact encoding. An Rx sends one with its own ID
+# when it drops a TX_UPDATE_COMPACT delta, and the Tx broadcasts one with the ID
+# of an Rx whose RX_UPDATE_COMPACT delta it dropped.
+KEYFRAME_REQUEST = 7
+
+KEYFRAME_REQUEST_RECORD = struct.Struct("!B")
+
+
+class KeyframeRequest:
+    def __init__(self, rx_id):
+        self.rx_id = rx_id
+
+    @staticmethod
+    def from_bytes(b):
+        flags, count = decode_header(b, KEYFRAME_REQUEST)
+        check_length(b, count, KEYFRAME_REQUEST_RECORD)
+        return KeyframeRequest(
+            *KEYFRAME_REQUEST_RECORD.unpack_from(b, HEADER.size))
+
+    def to_bytes(self):
+        return (HEADER.pack(PACKET_VERSION, KEYFRAME_REQUEST, 0, 1) +
+                KEYFRAME_REQUEST_RECORD.pack(self.rx_id))
@@ -0,0 +1,119 @@
+import numpy as np
+
+# Default number of particles.
+NUM_PARTICLES = 10000
+
+# Standard deviation of the target's acceleration in m/s^2, used to diffuse the
+# particles in the motion model. Insect flight is erratic, so this is large.
+ACCELERATION_STD = 10.0
+
+# Standard deviation of the range readings in metres.
+RANGE_STD = 0.5
+
+# Standard deviation in metres and m/s of the particles around the initial
+# position estimate.
+INITIAL_POSITION_STD = 2.0
+INITIAL_VELOCITY_STD = 2.0
+
+# Fraction of the number of particles below which the effective sample size
+# triggers resampling.
+RESAMPLE_THRESHOLD = 0.5
+
+
+class ParticleFilter:
+    """ Tracks the target with a cloud of weighted particles, each with state
+    [x, y, vx, vy] in metres relative to a fixed origin. All particles are
+    stored in NumPy arrays, so each step is a handful of array operations
+    regardless of the number of particles.
+
+    Each update moves the particles with a constant velocity model plus random
+    acceleration, weights them by the likelihood of the bistatic range readings
+    from every Rx, and resamples (systematically) when the weights become too
+    uneven.
+    """
+    def __init__(self,
+                 num_particles=NUM_PARTICLES,
+                 acceleration_std=ACCELERATION_STD,
+                 range_std=RANGE_STD,
+                 seed=None):
+        self.num_particles = num_particles
+        self.acceleration_std = acceleration_std
+        self.range_std = range_std
+        self.rng = np.random.default_rng(seed)
+
+        # Particle states and normalised weights, None until initialised.
+        self.particles = None
+        self.weights = None
+        self.last_time = None
+
+    def initialised(self):
+        return self.particles is not None
+
+    def initialise(self, position, timestamp):
+        """ Scatters the particles around an initial (x, y) position estimate.
+        """
+        n = self.num_particles
+        self.particles = np.empty((n, 4))
+        self.particles[:, 0] = self.rng.normal(position[0],
+                                               INITIAL_POSITION_STD, n)
+        self.particles[:, 1] = self.rng.normal(position[1],
+                                               INITIAL_POSITION_STD, n)
+        self.particles[:, 2:] = self.rng.normal(0, INITIAL_VELOCITY_STD,
+                                                (n, 2))
+        self.weights = np.full(n, 1 / n)
+        self.last_time = timestamp
+
+    def predict(self, timestamp):
+        """ Moves the particles forward to timestamp. """
+        dt = max(0.0, timestamp - self.last_time)
+        n = self.num_particles
+        acceleration = self.rng.normal(0, self.acceleration_std, (n, 2))
+        self.particles[:, :2] += (self.particles[:, 2:] * dt +
+                                  acceleration * (0.5 * dt * dt))
+        self.particles[:, 2:] += acceleration * dt
+        self.last_time = timestamp
+
+    def update(self, tx, receivers, ranges):
+        """ Reweights the particles by the likelihood of the range readings,
+        given the Tx and Rx positions in the same frame as the particles. """
+        x = self.particles[:, 0]
+        y = self.particles[:, 1]
+        receivers = np.asarray(receivers, dtype=np.float64).reshape(-1, 2)
+        ranges = np.asarray(ranges, dtype=np.float64)
+
+        tx_dist = np.hypot(x - tx[0], y - tx[1])
+        rx_dist = np.hypot(x[:, np.newaxis] - receivers[:, 0],
+                           y[:, np.newaxis] - receivers[:, 1])
+        error = rx_dist + tx_dist[:, np.newaxis] - ranges
+        log_likelihood = np.sum(error * error, axis=1)
+        log_likelihood *= -0.5 / self.range_std**2
+
+        # Work with log weights, shifted by the maximum, to avoid underflow.
+        log_weights = np.log(self.weights) + log_likelihood
+        log_weights -= np.max(log_weights)
+        weights = np.exp(log_weights)
+        self.weights = weights / np.sum(weights)
+
+        effective_size = 1 / np.sum(self.weights * self.weights)
+        if effective_size < RESAMPLE_THRESHOLD * self.num_particles:
+            self.resample()
+
+    def resample(self):
+        """ Systematic resampling, which draws a single random offset and takes
+        evenly spaced samples from the cumulative weights. """
+        n = self.num_particles
+        positions = (self.rng.random() + np.arange(n)) / n
+        cumulative = np.cumsum(self.weights)
+        cumulative[-1] = 1.0
+        indices = np.searchsorted(cumulative, positions)
+        self.particles = self.particles[indices]
+        self.weights.fill(1 / n)
+
+    def estimate(self):
+        """ Returns the weighted mean (x, y) position of the particles, and
+        their spread: the RMS distance in metres of the particles from the mean.
+        """
+        mean = self.weights @ self.particles[:, :2]
+        offsets = self.particles[:, :2] - mean
+        spread = np.sqrt(self.weights @ np.sum(offsets * offsets, axis=1))
+        return (float(mean[0]), float(mean[1])), float(spread)
@@ -1,29 +1,16 @@
 import serial
-from gps import GPSCoord
-
-
-GPGGA = '$GPGGA'
+from nmea import NMEAParser
 
 
 def main():
 
 	ser = serial.Serial('../../../../../../../dev/tty.usbserial', 4800, timeout=5)
-	line = ser.readline()	# Read remaining junk line so that next line is clean
+	parser = NMEAParser()
 
 	while True:
-		try:
-			line = ser.readline().decode('utf-8')
-			splitline = line.split(",")
-
-			if splitline[0] == GPGGA:
-				latitude_nmea = splitline[2] + splitline[3]
-				longitude_nmea = splitline[4] + splitline[5]
-				# coord = GPSCoord.from_nmea(latitude_nmea, longitude_nmea)
-
-				# print(coord)
-				print(line)
-		except UnicodeDecodeError:
-			print("Failed to decode")
-			continue
+		# Partial sentences are kept by the parser until the rest arrives, and
+		# sentences with bad checksums or undecodable bytes are dropped.
+		for record in parser.feed(ser.read(ser.in_waiting or 1)):
+			print(record)
 
 main()
\ No newline at end of file
@@ -3,9 +3,14 @@ import time
 import sys
 import argparse
 
-from gps import GPSCoord
-from packets import RxUpdate, TxUpdate
+from gps import GPSCoord, LocalFrame
+from packets import (KEYFRAME_REQUEST, SYNC_REQUEST, CompactRxEncoder,
+                     KeyframeRequest, PacketError, RxUpdate, SyncReply,
+                     SyncRequest, TxUpdateDecoder, encode_rx_updates,
+                     packet_type)
+from schedule import PeriodicSchedule
 import swarming_logic
+from trajectory import Trajectory, convert_text_trajectory, is_stale
 
 TX_IP_ADDRESS = "localhost"
 
@@ -16,6 +21,10 @@ TX_SEND_PORT = 5556
 
 TARGET_POSITION_FILENAME = "target_positions_gps.txt"
 
+# Binary version of the target path, which the Rxs replay. Created from
+# TARGET_POSITION_FILENAME if it doesn't exist.
+TARGET_TRAJECTORY_FILENAME = "target_positions_gps.traj"
+
 # Tx starting position. This value must match the one in tx.py
 TX_START_COORDS = GPSCoord(-43.520508, 172.583089)
 
@@ -38,20 +47,45 @@ UPDATE_PERIOD_S = 1
 # Timeout period for receiving updates from the Tx.
 TIMEOUT_S = 3
 
-# How often the main loop runs. This determines the timing accuracy in sending
-# updates.
-LOOP_PERIOD_MS = 1
+# Number of readings sent to the Tx in each message. Batching reduces the
+# per-message overhead at high update rates, at the cost of latency.
+BATCH_SIZE = 1
+
+# Whether to send the actual target coordinates with each reading, which the Tx
+# only needs for plotting.
+SEND_TARGET_COORDS = True
+
+# Whether to send readings in the compact delta encoding (see packets.py) for
+# low bandwidth links, in which case each reading is sent as soon as it's taken
+# rather than in batches. The Tx decodes either encoding.
+COMPACT_ENCODING = False
+
+# Remaining wait in seconds below which the main loop sleeps until the next
+# deadline instead of polling, since the poll timeout has 1 ms resolution.
+MIN_POLL_WAIT_S = 0.001
 
 
 class TimeoutException(Exception):
     pass
 
 
+def emulate_range(rx_coords, tx_coords, target_coords):
+    """ Returns the emulated range reading in meters for an Rx at rx_coords, as
+    the distance from the Rx to the target, plus the distance from the target
+    to the Tx.
+    """
+    return (rx_coords.distance(target_coords) +
+            target_coords.distance(tx_coords))
+
+
 class ReceiverUAV:
-    def __init__(self, context, rx_id):
+    def __init__(self, context, rx_id, update_period_s=UPDATE_PERIOD_S):
         # ID of this Rx, in the range 1 to NUM_RXS.
         self.rx_id = rx_id
 
+        # How often to send updates to the Tx.
+        self.update_period_s = update_period_s
+
         # Create a PUSH socket to send updates to the Tx.
         self.sender = context.socket(zmq.PUSH)
         self.sender.setsockopt(zmq.LINGER, 0)  # Exit despite unsent updates.
@@ -75,48 +109,129 @@ class ReceiverUAV:
         # necessary once real ranges are received from the radar.
         self.tx_coords = TX_START_COORDS
 
-        # File containing the coordinates of the emulated target path.
-        self.target_pos_file = open(TARGET_POSITION_FILENAME)
+        # Local frame at the Tx start position, used by the swarming logic for
+        # the whole session.
+        self.frame = LocalFrame(TX_START_COORDS)
+
+        # Memory-mapped coordinates of the emulated target path, shared with the
+        # other Rxs, and the index of the next one to read. It's rebuilt if the
+        # text path has been edited since it was converted.
+        if is_stale(TARGET_POSITION_FILENAME, TARGET_TRAJECTORY_FILENAME):
+            convert_text_trajectory(TARGET_POSITION_FILENAME,
+                                    TARGET_TRAJECTORY_FILENAME)
+        self.target_trajectory = Trajectory(TARGET_TRAJECTORY_FILENAME)
+        self.target_index = 0
 
         # A sequence number for the readings taken. Sent to the Tx, which uses
         # it to group readings from all the Rxs which have the same number.
         self.reading_number = 0
 
+        # Readings waiting to be sent in the next batch.
+        self.pending_updates = []
+
+        # Encoder for compact readings if enabled, and the decoder for updates
+        # from the Tx, which keeps the keyframe of the compact encoding.
+        self.encoder = (CompactRxEncoder(SEND_TARGET_COORDS)
+                        if COMPACT_ENCODING else None)
+        self.decoder = TxUpdateDecoder()
+
         # Poller required to set a timeout on receiving from the receiver socket.
         self.poller = zmq.Poller()
         self.poller.register(self.receiver, zmq.POLLIN)
 
+        # Number of updates from the Tx superseded by a newer one before they
+        # were acted on.
+        self.superseded_updates = 0
+
     def read_coordinate(self):
-        """ Reads the coordinates from the next line of the given file, and returns
-        it as a GPSCoord. Each line of the file contains time, latitude and
-        longitude in NMEA format.
+        """ Reads the next coordinates of the emulated target path, and returns
+        them as a GPSCoord.
         """
-        time, latitude, longitude = self.target_pos_file.readline().split(",")
-        return GPSCoord.from_nmea(latitude.strip(), longitude.strip())
+        target_coords = self.target_trajectory[self.target_index]
+        self.target_index += 1
+        return target_coords
 
     def calculate_range(self, target_coords):
         """ Calculates the range reading in meters as the distance from the Rx to
         the target, plus the distance from the target to the Tx.
         """
-        return (self.rx_coords.distance(target_coords) +
-                target_coords.distance(self.tx_coords))
-
-    def receive_update(self):
-        """ Receive an update from the Tx, and return the new desired location of
+        return emulate_range(self.rx_coords, self.tx_coords, target_coords)
+
+    def receive_messages(self):
+        """ Receive every message waiting from the Tx, replying to any sync
+        requests. Returns the number of updates received, and the newest one
+        which could be decoded, or None. The newest update supersedes the
+        others, so an Rx which falls behind acts on the current setpoint
+        rather than working through a backlog of outdated ones.
+        """
+        received = 0
+        superseded = 0
+        newest = None
+        while True:
+            try:
+                message = self.receiver.recv(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            receive_time = time.time()
+            try:
+                if packet_type(message) == SYNC_REQUEST:
+                    self.reply_to_sync(message, receive_time)
+                    continue
+                if packet_type(message) == KEYFRAME_REQUEST:
+                    self.handle_keyframe_request(message)
+                    continue
+                # Decode every update, so the decoder sees every keyframe of
+                # the compact encoding.
+                update = self.decoder.decode(message)
+            except PacketError as e:
+                print("ERROR: dropped bad message: {}".format(e))
+                continue
+            received += 1
+            if update is None:
+                print("Dropped update with missing keyframe")
+                if self.decoder.take_keyframe_request():
+                    self.sender.send(KeyframeRequest(self.rx_id).to_bytes())
+                continue
+            if newest is not None:
+                superseded += 1
+            newest = update
+
+        if superseded:
+            self.superseded_updates += superseded
+            print("Skipped {} outdated updates ({} so far)".format(
+                superseded, self.superseded_updates))
+        return received, newest
+
+    def receive_update(self, update):
+        """ Handle an update from the Tx, and return the new desired location of
         this Rx, and the current position of the Tx.
         """
-        # Called when socket is ready for reading, so non-blocking recv can be used.
-        update = TxUpdate.from_bytes(self.receiver.recv(flags=zmq.NOBLOCK))
         print("Received update: {}".format(update))
 
         # Calculate the desired location for this Rx based on the swarming logic.
         desired_location = swarming_logic.update_loc(update.target_coords,
-                                                     self.rx_id, self.rx_coords)
+                                                     self.rx_id, self.rx_coords,
+                                                     self.frame)
         print("Rx {} desired location: {}".format(self.rx_id,
                                                   desired_location))
 
         return desired_location, update.tx_coords
 
+    def reply_to_sync(self, message, receive_time):
+        """ Reply to a sync request from the Tx received at receive_time, so
+        the Tx can estimate the offset of this Rx's clock. """
+        request = SyncRequest.from_bytes(message)
+        reply = SyncReply(self.rx_id, request.request_time, receive_time,
+                          time.time())
+        self.sender.send(reply.to_bytes())
+
+    def handle_keyframe_request(self, message):
+        """ Makes the next compact update a keyframe if the Tx asked this Rx
+        for one. """
+        request = KeyframeRequest.from_bytes(message)
+        if request.rx_id == self.rx_id and self.encoder is not None:
+            self.encoder.request_keyframe()
+
     def send_update(self):
         """ Send an update to the Tx containing the Rx position and range. """
         # Get the next target position from the file.
@@ -132,38 +247,67 @@ class ReceiverUAV:
                           self.rx_coords, range_reading, target_coords)
         self.reading_number += 1
 
-        self.sender.send(update.to_bytes())
+        if self.encoder is not None:
+            self.sender.send(self.encoder.encode(update))
+            print("Sending update: {}".format(update))
+            return
+
+        self.pending_updates.append(update)
+        if len(self.pending_updates) >= BATCH_SIZE:
+            self.sender.send(
+                encode_rx_updates(self.pending_updates, SEND_TARGET_COORDS))
+            self.pending_updates = []
         print("Sending update: {}".format(update))
 
     def run(self):
-        """ The Rx main loop, runs with frequency determined by LOOP_PERIOD_MS.
-        Receives updates from the Tx whenever they arrive, and sends updates
-        to the Tx every UPDATE_PERIOD_S.
+        """ The Rx main loop. Sleeps until the next update is due to be sent,
+        the timeout expires, or an update arrives from the Tx, whichever is
+        first. Receives updates from the Tx whenever they arrive, and sends
+        updates to the Tx every update_period_s.
         """
-        # Last time an update from the Tx was received, to check for timeout.
-        last_update_received_time = time.time()
+        send_schedule = PeriodicSchedule(self.update_period_s)
+        missed = 0
 
-        # Last time an update was sent to the Tx, to check if its time to send another.
-        last_update_sent_time = time.time()
+        # Time by which the next update from the Tx must be received.
+        timeout_time = time.monotonic() + TIMEOUT_S
 
         while True:
-            sockets = dict(self.poller.poll(timeout=LOOP_PERIOD_MS))
-            if self.receiver in sockets:
-                # Update Rx and Tx positions based on received update.
-                self.rx_coords, self.tx_coords = self.receive_update()
-                last_update_received_time = time.time()
-                print()
-            else:
-                # Didn't receive an update from the Tx, check if timeout occurred.
-                if time.time() >= last_update_received_time + TIMEOUT_S:
-                    raise TimeoutException(
-                        "Timeout occurred. No updates from Tx in {} s.".format(
-                            TIMEOUT_S))
+            now = time.monotonic()
 
             # Check if it's time to send an update
-            if time.time() >= last_update_sent_time + UPDATE_PERIOD_S:
+            if now >= send_schedule.next_time:
                 self.send_update()
-                last_update_sent_time = time.time()
+                send_schedule.advance(now)
+                # Only warn when more updates have been missed.
+                if send_schedule.missed > missed:
+                    missed = send_schedule.missed
+                    print("WARNING: {} updates missed so far".format(missed))
+                continue
+
+            # Didn't receive an update from the Tx, check if timeout occurred.
+            if now >= timeout_time:
+                raise TimeoutException(
+                    "Timeout occurred. No updates from Tx in {} s.".format(
+                        TIMEOUT_S))
+
+            wait_time = min(send_schedule.next_time, timeout_time) - now
+            if wait_time < MIN_POLL_WAIT_S:
+                time.sleep(wait_time)
+                continue
+
+            sockets = dict(self.poller.poll(timeout=int(1000 * wait_time)))
+            if self.receiver in sockets:
+                received, update = self.receive_messages()
+                if received == 0:
+                    continue
+                timeout_time = time.monotonic() + TIMEOUT_S
+
+                # Update Rx and Tx positions based on the newest update. If it
+                # couldn't be decoded (a compact update whose keyframe was
+                # missed), keep going to the same place until the next keyframe.
+                if update is not None:
+                    self.rx_coords, self.tx_coords = self.receive_update(update)
+                print()
 
 
 def wait_for_tx(context, rx_id):
@@ -183,14 +327,21 @@ def wait_for_tx(context, rx_id):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('rx_id', type=int, choices=range(1, NUM_RXS + 1))
-    rx_id = parser.parse_args().rx_id
+    parser.add_argument('-r',
+                        '--rate',
+                        type=float,
+                        default=1 / UPDATE_PERIOD_S,
+                        metavar='HZ',
+                        help='rate at which to send updates to the Tx')
+    args = parser.parse_args()
+    rx_id = args.rx_id
 
     context = zmq.Context()
 
     # Tell the Tx that this Rx is ready, and wait for it to respond.
     wait_for_tx(context, rx_id)
 
-    rx = ReceiverUAV(context, rx_id)
+    rx = ReceiverUAV(context, rx_id, 1 / args.rate)
     rx.run()
 
 
@@ -0,0 +1,75 @@
+""" Deadline scheduling for the fixed-rate loops of the Tx and Rxs. """
+import math
+import time
+
+
+class PeriodicSchedule:
+    """ Drift-free schedule of events every period_s seconds, on the monotonic
+    clock. Each event is scheduled a whole number of periods after the first,
+    rather than a period after the previous one actually happened, so lateness
+    doesn't accumulate. If aligned, events fall on whole multiples of the
+    period in wall-clock time, so processes with synchronised clocks (e.g. the
+    Rxs) have their events at the same instants.
+    """
+    def __init__(self, period_s, aligned=True):
+        self.period_s = period_s
+        now = time.monotonic()
+        if aligned:
+            wall_time = time.time()
+            first_time = math.ceil(wall_time / period_s) * period_s
+            self.next_time = now + (first_time - wall_time)
+        else:
+            self.next_time = now + period_s
+
+        # Number of events skipped because the schedule fell more than a
+        # period behind, and the largest lateness of an event in seconds.
+        self.missed = 0
+        self.max_lateness = 0.0
+
+    def advance(self, now):
+        """ Marks the current event as done at monotonic time now, and moves on
+        to the next event that's still in the future. """
+        self.max_lateness = max(self.max_lateness, now - self.next_time)
+        self.next_time += self.period_s
+        if now >= self.next_time:
+            missed = math.floor((now - self.next_time) / self.period_s) + 1
+            self.next_time += missed * self.period_s
+            self.missed += missed
+
+
+class TickStats:
+    """ Timing statistics for a fixed-rate loop. For each tick, records how
+    late it started (jitter), how much time was left before the next tick when
+    its work finished (slack), and whether the work overran into the next
+    tick. """
+    def __init__(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_slack = 0.0
+        self.min_slack = math.inf
+
+    def record(self, scheduled_time, start_time, end_time, next_time):
+        """ Records a tick scheduled for scheduled_time, whose work ran from
+        start_time to end_time, with the next tick due at next_time. """
+        jitter = start_time - scheduled_time
+        slack = next_time - end_time
+        self.ticks += 1
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_slack += slack
+        self.min_slack = min(self.min_slack, slack)
+        if slack < 0:
+            self.overruns += 1
+
+    def __str__(self):
+        if self.ticks == 0:
+            return "no ticks"
+        return ("{} ticks, {} overruns, jitter mean {:.2f} ms max {:.2f} ms, "
+                "slack mean {:.2f} ms min {:.2f} ms".format(
+                    self.ticks, self.overruns,
+                    1000 * self.total_jitter / self.ticks,
+                    1000 * self.max_jitter,
+                    1000 * self.total_slack / self.ticks,
+                    1000 * self.min_slack))
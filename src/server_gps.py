@@ -1,7 +1,7 @@
 import zmq
 import time
 import serial
-from gps import GPSCoord
+from nmea import NMEAParser
 
 
 # Must match the one in client_gps.py.
@@ -9,7 +9,6 @@ PORT = 5556
 
 WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
 MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-GPGGA = '$GPGGA'
 
 def init_socket():
     # Socket to send readings to the client.
@@ -23,7 +22,10 @@ def main():
     socket = init_socket()
 
     ser = serial.Serial('../../../../../../../dev/tty.usbserial', 4800, timeout=5)
-    line = ser.readline()   # Read remaining junk line so that next line is clean
+
+    # The parser frames sentences itself, so partial lines at startup are
+    # discarded rather than needing a junk readline.
+    parser = NMEAParser(types=["GGA"])
 
     while True:
 
@@ -31,20 +33,28 @@ def main():
         # time_sample = "Sat Aug  3 14:21:15 2019"
         # latitude = "4331.23049S"
         # longitude = "17234.98533E"
-        line = ser.readline().decode('utf-8')
-        splitline = line.split(",")
+        for record in parser.feed(ser.read(ser.in_waiting or 1)):
+            # Skip readings taken without a fix.
+            if not record.fix_quality or record.lat is None:
+                print("No GPS fix")
+                continue
+
+            # Skip readings with an empty time field, which some modules send
+            # while the clock is still being acquired.
+            if record.time is None:
+                print("No GPS time")
+                continue
 
-        if splitline[0] == GPGGA:
             date = time.localtime(time.time())
-            gps_time = "{}:{}:{}".format(splitline[1][:2], splitline[1][2:4], splitline[1][4:-4])
+            seconds = int(record.time)
+            gps_time = "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60,
+                seconds % 60)
             time_sample = "{} {}  {} {} {}".format(WEEKDAYS[date.tm_wday], MONTHS[date.tm_mon-1], 
                 date.tm_mday, gps_time, date.tm_year)
-            latitude_nmea = splitline[2] + splitline[3]
-            longitude_nmea = splitline[4] + splitline[5]
-            coord = GPSCoord.from_nmea(latitude_nmea, longitude_nmea)
 
-            print_message = "{},{:.5f},{:.5f}".format(time_sample, coord.lat, coord.long)
-            message = "{},{:.5f},{:.5f}".format(time_sample, coord.lat, coord.long)
+            print_message = "{},{:.5f},{:.5f},{},{}".format(time_sample, record.lat, record.long,
+                record.fix_quality, record.hdop)
+            message = "{},{:.5f},{:.5f}".format(time_sample, record.lat, record.long)
             storage = open("gps_storage.txt","w")
             storage.write(message + '\n')
             print("Sending: {}".format(print_message))
@@ -0,0 +1,250 @@
+""" Pool of worker processes for running multilateration on several groups of
+readings at once.
+
+Each worker has its own SolverChain. The inputs and outputs of each solve are
+passed through NumPy arrays in shared memory, divided into one slot per group
+in flight, so only the slot index and the name of the solver used are pickled.
+Results can complete out of order; ordered_results() returns them in the
+order the groups were submitted.
+
+Stateful solvers (tracked and particle) need to see every group in order, but
+each worker would only see the subset of groups it happens to be given, so
+they're rejected unless the pool has a single worker.
+"""
+import collections
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import solver_registry
+from gps import GPSCoord
+from lookup_table import RangeLookupTable
+
+# Maximum number of Rxs in a group.
+MAX_RXS = 8
+
+# Number of groups which can be in flight for each worker, so a worker can
+# start on its next group as soon as it finishes one.
+SLOTS_PER_WORKER = 2
+
+# Layout of each input slot: the Tx lat and long, the previous target lat and
+# long (NaN if there isn't one), the group time, 1 if the drones are in
+# formation, the number of Rxs, then the lat, long and range of each Rx.
+INPUT_HEADER = 7
+INPUT_SIZE = INPUT_HEADER + 3 * MAX_RXS
+
+# Layout of each output slot: the target lat and long, and the spread of the
+# estimate (NaN if the solver doesn't give one).
+OUTPUT_SIZE = 3
+
+# Per-process state of a worker, set by _init_worker.
+_worker = None
+
+
+def default_num_workers():
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+class _WorkerState:
+    def __init__(self, input_name, output_name, num_slots, solver_names,
+                 origin, budget_s, lookup_table_path, num_particles):
+        self.input_memory = shared_memory.SharedMemory(input_name)
+        self.output_memory = shared_memory.SharedMemory(output_name)
+        self.inputs = np.ndarray((num_slots, INPUT_SIZE),
+                                 dtype=np.float64,
+                                 buffer=self.input_memory.buf)
+        self.outputs = np.ndarray((num_slots, OUTPUT_SIZE),
+                                  dtype=np.float64,
+                                  buffer=self.output_memory.buf)
+
+        lookup_table = None
+        if lookup_table_path is not None:
+            lookup_table = RangeLookupTable.load(lookup_table_path)
+        self.chain = solver_registry.SolverChain([
+            solver_registry.create_solver(name, origin, lookup_table,
+                                          num_particles)
+            for name in solver_names
+        ], budget_s)
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _WorkerState(*args)
+
+
+def _solve(slot):
+    """ Solves the group in the given slot, writing the result to the output
+    slot, and returns the name of the solver used. Runs in a worker. """
+    data = _worker.inputs[slot]
+    num_rxs = int(data[6])
+    readings = data[INPUT_HEADER:INPUT_HEADER + 3 * num_rxs].reshape(-1, 3)
+
+    tx_coords = GPSCoord(data[0], data[1])
+    previous_target = None
+    if not math.isnan(data[2]):
+        previous_target = GPSCoord(data[2], data[3])
+    rx_positions = [GPSCoord(lat, long) for lat, long in readings[:, :2]]
+
+    target_coords = _worker.chain.solve(tx_coords, rx_positions,
+                                        readings[:, 2].tolist(),
+                                        previous_target, data[4],
+                                        bool(data[5]))
+    spread = _worker.chain.last_solver.spread
+    _worker.outputs[slot] = (target_coords.lat, target_coords.long,
+                             math.nan if spread is None else spread)
+    return _worker.chain.last_solver.name
+
+
+# The result of a solve: the estimated target position as a GPSCoord, the
+# spread of the estimate in metres (or None), and the name of the solver used.
+PoolResult = collections.namedtuple("PoolResult",
+                                    ["target_coords", "spread", "solver"])
+
+
+class SolverPool:
+    """ Runs the named solvers (a preferred solver followed by its fallbacks,
+    as for SolverChain) in a pool of worker processes. """
+    def __init__(self,
+                 solver_names,
+                 origin,
+                 budget_s=solver_registry.DEFAULT_BUDGET_S,
+                 num_workers=None,
+                 lookup_table_path=None,
+                 num_particles=solver_registry.NUM_PARTICLES):
+        if num_workers is None:
+            num_workers = default_num_workers()
+        stateful = [
+            name for name in solver_names
+            if solver_registry.SOLVERS[name].stateful
+        ]
+        if stateful and num_workers > 1:
+            raise ValueError(
+                "Stateful solvers ({}) can only run in a pool with 1 worker."
+                .format(", ".join(stateful)))
+        self.num_workers = num_workers
+        self.capacity = num_workers * SLOTS_PER_WORKER
+
+        self.input_memory = shared_memory.SharedMemory(
+            create=True, size=self.capacity * INPUT_SIZE * 8)
+        self.output_memory = shared_memory.SharedMemory(
+            create=True, size=self.capacity * OUTPUT_SIZE * 8)
+        self.inputs = np.ndarray((self.capacity, INPUT_SIZE),
+                                 dtype=np.float64,
+                                 buffer=self.input_memory.buf)
+        self.outputs = np.ndarray((self.capacity, OUTPUT_SIZE),
+                                  dtype=np.float64,
+                                  buffer=self.output_memory.buf)
+
+        # Slots which aren't in use, guarded by a lock since slots are freed
+        # by the executor's callback thread.
+        self.free_slots = list(range(self.capacity))
+        self.lock = threading.Lock()
+
+        # Futures of the groups in flight, by sequence number, in the order
+        # they were submitted.
+        self.pending = collections.OrderedDict()
+
+        # Number of results from each solver.
+        self.solver_counts = collections.Counter()
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.input_memory.name, self.output_memory.name,
+                      self.capacity, solver_names, origin, budget_s,
+                      lookup_table_path, num_particles))
+
+        # Start the workers now, so they're forked before the caller creates
+        # any threads (e.g. ZeroMQ's I/O threads).
+        self.executor.submit(int).result()
+
+    def full(self):
+        """ Returns True if every slot is in use, so submit would fail. """
+        with self.lock:
+            return not self.free_slots
+
+    def submit(self, seq_no, tx_coords, rx_positions, ranges, previous_target,
+               group_time, in_formation=True):
+        """ Starts solving a group, returning a concurrent.futures.Future of
+        its PoolResult. Raises a RuntimeError if every slot is in use. """
+        if len(rx_positions) > MAX_RXS:
+            raise ValueError("At most {} Rxs are supported.".format(MAX_RXS))
+        with self.lock:
+            if not self.free_slots:
+                raise RuntimeError("No free slots in the solver pool.")
+            slot = self.free_slots.pop()
+
+        data = self.inputs[slot]
+        data[0:2] = (tx_coords.lat, tx_coords.long)
+        if previous_target is None:
+            data[2:4] = math.nan
+        else:
+            data[2:4] = (previous_target.lat, previous_target.long)
+        data[4:7] = (group_time, in_formation, len(rx_positions))
+        readings = data[INPUT_HEADER:INPUT_HEADER +
+                        3 * len(rx_positions)].reshape(-1, 3)
+        readings[:, 0] = [coords.lat for coords in rx_positions]
+        readings[:, 1] = [coords.long for coords in rx_positions]
+        readings[:, 2] = ranges
+
+        result = concurrent.futures.Future()
+
+        def finished(future):
+            # Copy the result out, then free the slot before resolving the
+            # future, so a caller woken by it can submit straight away.
+            error = None
+            try:
+                solver = future.result()
+                lat, long, spread = self.outputs[slot].tolist()
+                self.solver_counts[solver] += 1
+            except Exception as e:
+                error = e
+            with self.lock:
+                self.free_slots.append(slot)
+
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(
+                    PoolResult(GPSCoord(lat, long),
+                               None if math.isnan(spread) else spread, solver))
+
+        self.executor.submit(_solve, slot).add_done_callback(finished)
+        self.pending[seq_no] = result
+        return result
+
+    def ordered_results(self, block=False):
+        """ Returns a list of (seq_no, PoolResult) for the groups at the front
+        of the submission order which have finished, so results are always
+        returned in order of sequence number. If block is True, waits for at
+        least one result if any groups are in flight. """
+        results = []
+        while self.pending:
+            seq_no, future = next(iter(self.pending.items()))
+            if not future.done() and not (block and not results):
+                break
+            results.append((seq_no, future.result()))
+            del self.pending[seq_no]
+        return results
+
+    def summary(self):
+        if not self.solver_counts:
+            return "{} workers, no results".format(self.num_workers)
+        return "{} workers, results by solver: {}".format(
+            self.num_workers, ", ".join("{} {}".format(name, count)
+                                        for name, count in
+                                        sorted(self.solver_counts.items())))
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.inputs = self.outputs = None
+        self.input_memory.close()
+        self.input_memory.unlink()
+        self.output_memory.close()
+        self.output_memory.unlink()
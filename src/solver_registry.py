@@ -0,0 +1,319 @@
+""" Pluggable multilateration solvers for the Tx.
+
+Every solver has the same interface, so the Tx can be configured with any of
+them by name (see SOLVERS). A SolverChain runs the preferred solver with a
+per-call latency budget, records latency and residual statistics for each
+solver, and switches to a cheaper solver when the preferred one keeps
+overrunning its budget or returns a bad residual.
+"""
+import abc
+import collections
+import time
+
+import multilaterationv2
+from gps import LocalFrame
+from particle_filter import NUM_PARTICLES, ParticleFilter
+from tracker import KalmanTracker
+
+# Default latency budget for a single multilateration, in seconds.
+DEFAULT_BUDGET_S = 0.05
+
+# Mean squared range error (m^2) above which a result is treated as bad.
+MAX_RESIDUAL = 1.0
+
+# Number of consecutive overruns after which a solver is demoted in favour of
+# the next cheaper solver.
+MAX_CONSECUTIVE_OVERRUNS = 3
+
+# Number of calls after a demotion before the demoted solver is retried, in
+# case it overran because of a transient load (e.g. a burst of groups).
+RETRY_AFTER_CALLS = 100
+
+# Number of recent latencies kept for each solver to compute percentiles.
+LATENCY_HISTORY = 1000
+
+
+class Solver(abc.ABC):
+    """ Base class for the multilateration solvers. """
+    name = None
+
+    # True if the solver is only valid while the drones are in formation.
+    requires_formation = False
+
+    # True if the solver keeps state between calls (e.g. a tracking filter),
+    # so it must see every group in order.
+    stateful = False
+
+    def __init__(self, frame=None):
+        # LocalFrame for converting positions to metres, shared by every solver
+        # for the session (see create_solver). If None, a frame is made at the
+        # Tx for each call.
+        self.frame = frame
+
+        # Spread of the most recent estimate in metres, if the solver gives one.
+        self.spread = None
+
+    @abc.abstractmethod
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        """ Returns the estimated target position as a GPSCoord.
+        previous_target is the previous estimate (or None), timestamp is the
+        time of the readings, and budget_s is the time available for the call,
+        which solvers with a bounded running time use to limit themselves.
+        """
+
+
+class GridSolver(Solver):
+    name = "grid"
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        return multilaterationv2.estimate_target_position_grid(
+            tx_coords, rx_positions, ranges, self.frame)
+
+
+class HierarchicalSolver(Solver):
+    name = "hierarchical"
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        return multilaterationv2.estimate_target_position_hierarchical(
+            tx_coords, rx_positions, ranges, previous_target, frame=self.frame)
+
+
+class LinearSolver(Solver):
+    name = "linear"
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        return multilaterationv2.estimate_target_position_linear(
+            tx_coords, rx_positions, ranges, self.frame)
+
+
+class LeastSquaresSolver(Solver):
+    name = "lsq"
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        # The iterations are capped at MAX_SOLVE_TIME_S even if the budget is
+        # longer, since they rarely improve the estimate after that.
+        return multilaterationv2.estimate_target_position_lsq(
+            tx_coords, rx_positions, ranges, previous_target,
+            min(budget_s, multilaterationv2.MAX_SOLVE_TIME_S), self.frame)
+
+
+class LookupSolver(Solver):
+    name = "lookup"
+    requires_formation = True
+
+    def __init__(self, lookup_table, frame=None):
+        super().__init__(frame)
+        self.lookup_table = lookup_table
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        return multilaterationv2.estimate_target_position_lookup(
+            tx_coords, rx_positions, ranges, self.lookup_table, previous_target,
+            self.frame)
+
+
+class TrackedSolver(Solver):
+    name = "tracked"
+    stateful = True
+
+    def __init__(self, tracker, frame):
+        super().__init__(frame)
+        self.tracker = tracker
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        return multilaterationv2.estimate_target_position_tracked(
+            tx_coords, rx_positions, ranges, self.tracker, self.frame,
+            timestamp)
+
+
+class ParticleSolver(Solver):
+    name = "particle"
+    stateful = True
+
+    def __init__(self, particle_filter, frame):
+        super().__init__(frame)
+        self.particle_filter = particle_filter
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              budget_s):
+        target_coords, self.spread = (
+            multilaterationv2.estimate_target_position_particle(
+                tx_coords, rx_positions, ranges, self.particle_filter,
+                self.frame, timestamp))
+        return target_coords
+
+
+# Solver classes by name, in order from most to least expensive. A solver's
+# default fallbacks are the cheaper stateless solvers after it in this order.
+SOLVERS = collections.OrderedDict(
+    (solver.name, solver)
+    for solver in (ParticleSolver, GridSolver, TrackedSolver,
+                   HierarchicalSolver, LookupSolver, LeastSquaresSolver,
+                   LinearSolver))
+
+
+def cheaper_solvers(name):
+    """ Returns the names of the stateless solvers cheaper than the named
+    solver. Stateful solvers are left out, since as a fallback they'd only see
+    the groups the solvers before them failed on. """
+    names = list(SOLVERS)
+    return [
+        other for other in names[names.index(name) + 1:]
+        if not SOLVERS[other].stateful
+    ]
+
+
+def create_solver(name, origin, lookup_table=None,
+                  num_particles=NUM_PARTICLES):
+    """ Creates the named solver. Every solver works in metres in a LocalFrame
+    at the origin GPSCoord (e.g. the Tx start position), which tracking
+    solvers keep their positions in. The lookup solver requires a
+    RangeLookupTable. """
+    frame = LocalFrame(origin)
+    if name == LookupSolver.name:
+        if lookup_table is None:
+            raise ValueError("The lookup solver requires a lookup table.")
+        return LookupSolver(lookup_table, frame)
+    elif name == TrackedSolver.name:
+        return TrackedSolver(KalmanTracker(), frame)
+    elif name == ParticleSolver.name:
+        return ParticleSolver(ParticleFilter(num_particles), frame)
+    else:
+        return SOLVERS[name](frame)
+
+
+class SolverStats:
+    """ Latency and residual statistics for a single solver. """
+    def __init__(self):
+        self.calls = 0
+        self.overruns = 0
+        self.bad_residuals = 0
+        self.total_residual = 0
+        self.latencies = collections.deque(maxlen=LATENCY_HISTORY)
+
+    def record(self, latency, residual, overran, bad_residual):
+        self.calls += 1
+        self.overruns += overran
+        self.bad_residuals += bad_residual
+        self.total_residual += residual
+        self.latencies.append(latency)
+
+    def latency_percentile(self, percentile):
+        """ Returns the given percentile of the recent latencies in seconds. """
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1,
+                    int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def __str__(self):
+        if self.calls == 0:
+            return "no calls"
+        return ("{} calls, latency p50 {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms, "
+                "{} overruns, {} bad residuals, mean residual {:.4f} m^2".format(
+                    self.calls, 1000 * self.latency_percentile(50),
+                    1000 * self.latency_percentile(95),
+                    1000 * max(self.latencies), self.overruns,
+                    self.bad_residuals, self.total_residual / self.calls))
+
+
+class SolverChain:
+    """ Runs a preferred solver, falling back to cheaper solvers in order.
+
+    Each call is given a latency budget of budget_s. A solver which overruns
+    its budget MAX_CONSECUTIVE_OVERRUNS times in a row is demoted, so later
+    calls start from the next solver. After RETRY_AFTER_CALLS calls it's
+    retried, and demoted again as soon as it overruns. If a solver returns a residual above
+    max_residual, the next solver is tried immediately for the same readings.
+
+    If the last solver requires the drones to be in formation, the least
+    squares solver is added after it, in the same LocalFrame as the first
+    solver, so there's always a solver to use when they're out of formation.
+    """
+    def __init__(self, solvers, budget_s=DEFAULT_BUDGET_S,
+                 max_residual=MAX_RESIDUAL):
+        solvers = list(solvers)
+        if not solvers or solvers[-1].requires_formation:
+            solvers.append(
+                LeastSquaresSolver(solvers[0].frame if solvers else None))
+        self.solvers = solvers
+        self.budget_s = budget_s
+        self.max_residual = max_residual
+
+        # Index of the solver each call starts from, and the number of calls
+        # since it was last changed.
+        self.active = 0
+        self.calls_since_change = 0
+        self.consecutive_overruns = [0] * len(solvers)
+        self.stats = collections.OrderedDict(
+            (solver.name, SolverStats()) for solver in solvers)
+
+        # The solver which produced the most recent estimate.
+        self.last_solver = None
+
+    def solve(self, tx_coords, rx_positions, ranges, previous_target, timestamp,
+              in_formation=True):
+        """ Returns the estimated target position as a GPSCoord. Solvers which
+        require the drones to be in formation are skipped if in_formation is
+        False. """
+        deadline = time.perf_counter() + self.budget_s
+        target_coords = None
+
+        # Retry the last solver demoted, which is demoted again as soon as it
+        # overruns.
+        self.calls_since_change += 1
+        if self.active > 0 and self.calls_since_change > RETRY_AFTER_CALLS:
+            self.active -= 1
+            self.calls_since_change = 0
+            self.consecutive_overruns[self.active] = (
+                MAX_CONSECUTIVE_OVERRUNS - 1)
+            print("Retrying solver '{}'".format(
+                self.solvers[self.active].name))
+
+        for index in range(self.active, len(self.solvers)):
+            solver = self.solvers[index]
+            if solver.requires_formation and not in_formation:
+                continue
+
+            start_time = time.perf_counter()
+            budget = max(0.0, deadline - start_time)
+            target_coords = solver.solve(tx_coords, rx_positions, ranges,
+                                         previous_target, timestamp, budget)
+            latency = time.perf_counter() - start_time
+            self.last_solver = solver
+
+            residual = multilaterationv2.range_residual(target_coords,
+                                                        tx_coords,
+                                                        rx_positions, ranges)
+            overran = latency > budget
+            bad_residual = residual > self.max_residual
+            self.stats[solver.name].record(latency, residual, overran,
+                                           bad_residual)
+
+            if overran:
+                self.consecutive_overruns[index] += 1
+                if (self.consecutive_overruns[index] >= MAX_CONSECUTIVE_OVERRUNS
+                        and index == self.active
+                        and index < len(self.solvers) - 1):
+                    self.active = index + 1
+                    self.calls_since_change = 0
+                    print("WARNING: solver '{}' overran its budget, switching "
+                          "to '{}'".format(solver.name,
+                                           self.solvers[self.active].name))
+            else:
+                self.consecutive_overruns[index] = 0
+
+            if not bad_residual:
+                break
+
+        return target_coords
+
+    def summary(self):
+        """ Returns a multi-line summary of the statistics for each solver. """
+        return "\n".join("{}: {}".format(name, stats)
+                         for name, stats in self.stats.items())
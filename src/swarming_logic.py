@@ -10,7 +10,20 @@
 
 import time
 import math
-from gps import GPSCoord
+
+import numpy as np
+
+from gps import GPSCoord, GPSCoordArray, LocalFrame
+
+# Offset (x, y) in metres of each drone from the centre of the formation,
+# indexed by drone number.
+FORMATION_OFFSETS = {
+    0: (0, 0),
+    1: (-5, 5),
+    2: (5, 5),
+    3: (-5, -5),
+    4: (5, -5)
+}
 
 
 def gps_buffer(buffer, gps, prev_avg):
@@ -47,55 +60,43 @@ def check_gps(gps, prev_gps, max_diff = 10):
     return gps_check
         
 
-def update_loc(target, drone_num, drone_pos):
+def update_loc(target, drone_num, drone_pos, frame=None):
     """ returns the desired GPSCoord offset of the drone for formation, 
     given the target GPSCoord, and drone_num. If target is -1, showing a
-    swarming error, returns the drones current location """
+    swarming error, returns the drones current location. frame is the
+    LocalFrame for the session, otherwise a frame is made at the target """
     if target.lat == -1 or target.long == -1:
         pos = drone_pos
     else:
-        if drone_num == 0:
-            pos = target.add_x_offset(0)
-            pos = pos.add_y_offset(0)
-        elif drone_num == 1:
-            pos = target.add_x_offset(-5)
-            pos = pos.add_y_offset(5)
-        elif drone_num == 2:
-            pos = target.add_x_offset(5)
-            pos = pos.add_y_offset(5)
-        elif drone_num == 3:
-            pos = target.add_x_offset(-5)
-            pos = pos.add_y_offset(-5)
-        elif drone_num == 4:
-            pos = target.add_x_offset(5)
-            pos = pos.add_y_offset(-5)
+        if frame is None:
+            frame = LocalFrame(target)
+        x, y = frame.to_local(target)
+        x_offset, y_offset = FORMATION_OFFSETS[drone_num]
+        pos = frame.from_local(x + x_offset, y + y_offset)
     return pos
 
 
-def centres_from_drones(drones):
+def centres_from_drones(drones, frame=None):
     """ returns a list of the expected GPSCoords centre of the formation, 
-    from the list of drone GPSCoords """
+    from the list of drone GPSCoords. frame is the LocalFrame for the session,
+    otherwise a frame is made at drone 0 """
+    if len(drones) == 0:
+        return []
+    # Work in a local frame so each drone only needs converting once.
+    if frame is None:
+        frame = LocalFrame(drones[0])
     centres = []
-    if 0 < len(drones):
-        centres.append(drones[0])
-    if 1 < len(drones):
-        centres.append(drones[1].add_x_offset(5))
-        centres[1] = centres[1].add_y_offset(-5)
-    if 2 < len(drones):
-        centres.append(drones[2].add_x_offset(-5))
-        centres[2] = centres[2].add_y_offset(-5)
-    if 3 < len(drones):
-        centres.append(drones[3].add_x_offset(5))
-        centres[3] = centres[3].add_y_offset(5)
-    if 4 < len(drones):
-        centres.append(drones[4].add_x_offset(-5))
-        centres[4] = centres[4].add_y_offset(5)
-    return centres
-
-
-def mean_centre(centres):
+    for drone_num, (x, y) in enumerate(frame.to_local_many(drones[:5])):
+        x_offset, y_offset = FORMATION_OFFSETS[drone_num]
+        centres.append((x - x_offset, y - y_offset))
+    return frame.from_local_many(centres)
+
+
+def mean_centre(centres, frame=None):
     """ Returns the mean average GPSCoord of the centres list, and returns the 
-    error; the grestest distance in m from the mean to a value in centres """
+    error; the grestest distance in m from the mean to a value in centres.
+    frame is the LocalFrame for the session, otherwise a frame is made at the
+    mean """
     lat_sum = 0
     long_sum = 0
     error = 0
@@ -108,9 +109,11 @@ def mean_centre(centres):
         mean_centre = GPSCoord(lat_sum / n, long_sum / n)
     
     # Find error in mean centre
-    for centre in centres:
-        if centre.distance(mean_centre) > error:
-            error = centre.distance(mean_centre)
+    if frame is None:
+        frame = LocalFrame(mean_centre)
+    mean_x, mean_y = frame.to_local(mean_centre)
+    for x, y in frame.to_local_many(centres):
+        error = max(error, math.hypot(x - mean_x, y - mean_y))
     
     return mean_centre, error
 
@@ -132,12 +135,13 @@ def critical_formation(drones):
     drones are in positions such that formation cannot be restored """
     formation = True
     
-    # All drones must have at least 3 m between each other   
+    # All drones must have at least 3 m between each other. The distances
+    # between every pair are computed at once, then each pair is checked once.
+    coords = GPSCoordArray.from_coords(drones)
+    distances = coords[:, np.newaxis].distance(coords)
     for i in range(len(drones) - 1):
-        drone1 = drones[i]
         for n in range(len(drones) - i - 1):
-            drone2 = drones[n + i + 1]
-            if drone1.distance(drone2) < 3:
+            if distances[i, n + i + 1] < 3:
                 print("ERROR: CRITICAL FORMATION")
                 formation = False
     
@@ -167,12 +171,13 @@ def critical_formation(drones):
     return formation
 
 
-def update_fsm(drone_positions, swarming_state):
+def update_fsm(drone_positions, swarming_state, frame=None):
     """ Update the swarming fsm for the drone formation given drone positions
-    and current state. Sates are 0 (normal), 1 (reset formation), 2 (stop) """
+    and current state. Sates are 0 (normal), 1 (reset formation), 2 (stop).
+    frame is the LocalFrame for the session, if there is one """
     # Estimate (mean) the centre of the formation   
-    centres = centres_from_drones(drone_positions)
-    est_centre, error = mean_centre(centres)        
+    centres = centres_from_drones(drone_positions, frame)
+    est_centre, error = mean_centre(centres, frame)        
     
     # Check the drone formation and update the fsm state accordingly
     if not(critical_formation(drone_positions)):
@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from clock_sync import MIN_DRIFT_SPAN_S, ClockEstimator, ClockSync
+from packets import SyncReply, SyncRequest
+
+
+class RxClock:
+    """ An Rx clock which is offset seconds ahead of the Tx clock at Tx time
+    0, and gains drift seconds per second. """
+    def __init__(self, offset, drift=0.0):
+        self.offset = offset
+        self.drift = drift
+
+    def time(self, tx_time):
+        return tx_time + self.offset + self.drift * tx_time
+
+
+def exchange(clock, tx_time, outbound, inbound, processing=0.001):
+    """ Returns a SyncReply and its response time for a request sent at
+    tx_time, taking outbound and inbound seconds in each direction. """
+    receive_time = clock.time(tx_time + outbound)
+    reply_time = clock.time(tx_time + outbound + processing)
+    response_time = tx_time + outbound + processing + inbound
+    return SyncReply(1, tx_time, receive_time, reply_time), response_time
+
+
+def test_symmetric_delay_gives_exact_offset():
+    clock = RxClock(offset=2.5)
+    sync = ClockSync()
+    assert not sync.has_estimate(1)
+    assert sync.to_tx_time(1, 100.0) == 100.0
+
+    sync.handle_reply(*exchange(clock, 10.0, 0.003, 0.003))
+    assert sync.has_estimate(1)
+    assert sync.estimators[1].offset == pytest.approx(2.5)
+    assert sync.estimators[1].best_delay() == pytest.approx(0.006)
+    assert sync.to_tx_time(1, clock.time(11.0)) == pytest.approx(11.0)
+
+
+def test_queueing_delays_are_filtered_out():
+    """ Samples delayed in one direction are biased, so only those with the
+    lowest round trip delays are used. """
+    clock = RxClock(offset=-0.75)
+    sync = ClockSync()
+    rng = random.Random(0)
+    for i in range(40):
+        outbound = 0.002
+        if i % 3:
+            outbound += rng.uniform(0.01, 0.05)
+        sync.handle_reply(*exchange(clock, 0.1 * i, outbound, 0.002))
+    assert sync.estimators[1].offset_at(4.0) == pytest.approx(-0.75,
+                                                              abs=1e-6)
+
+
+def test_drift_is_estimated_once_samples_span_long_enough():
+    clock = RxClock(offset=2.0, drift=100e-6)
+    estimator = ClockEstimator()
+    rng = random.Random(0)
+    for i in range(int(3 * MIN_DRIFT_SPAN_S / 0.5)):
+        delay = rng.uniform(0.001, 0.01)
+        reply, response_time = exchange(clock, 0.5 * i, delay, delay)
+        estimator.add_sample(reply.request_time, reply.receive_time,
+                             reply.reply_time, response_time)
+    assert estimator.drift == pytest.approx(100e-6, rel=1e-3)
+    assert estimator.offset_at(20.0) == pytest.approx(clock.time(20.0) - 20.0,
+                                                      abs=1e-6)
+
+    sync = ClockSync()
+    sync.estimators[1] = estimator
+    for tx_time in [20.0, 1000.0]:
+        assert sync.to_tx_time(1, clock.time(tx_time)) == pytest.approx(
+            tx_time, abs=1e-6)
+
+
+def test_requests_are_sent_every_period():
+    sync = ClockSync(period_s=0.5)
+    request = sync.request(10.0)
+    assert request.request_time == 10.0
+    assert sync.request(10.4) is None
+    assert sync.next_request_time() == 10.5
+    assert sync.request(10.5) is not None
+
+
+def test_sync_packets_round_trip():
+    request = SyncRequest.from_bytes(SyncRequest(12.5).to_bytes())
+    assert request.request_time == 12.5
+    reply = SyncReply.from_bytes(SyncReply(3, 12.5, 15.0, 15.001).to_bytes())
+    assert (reply.rx_id, reply.request_time, reply.receive_time,
+            reply.reply_time) == (3, 12.5, 15.0, 15.001)
@@ -0,0 +1,34 @@
+import math
+
+from closed_form import spherical_interpolation
+
+TARGET = (8.0, -5.0)
+
+
+def layout(scale, angle, offset):
+    """ Tx at the origin and 3 Rxs on a line through it, with the middle Rx
+    moved offset off the line, all scaled by scale and rotated by angle. """
+    cos, sin = math.cos(angle), math.sin(angle)
+    receivers = [(scale * (x * cos - y * sin), scale * (x * sin + y * cos))
+                 for x, y in [(5, 0), (-10, offset), (15, 0)]]
+    target = (scale * (TARGET[0] * cos - TARGET[1] * sin),
+              scale * (TARGET[0] * sin + TARGET[1] * cos))
+    ranges = [
+        math.hypot(*target) +
+        math.hypot(target[0] - receiver[0], target[1] - receiver[1])
+        for receiver in receivers
+    ]
+    return receivers, ranges, target
+
+
+def test_degenerate_geometry_is_relative():
+    """ Collinear receivers are rejected, and a spread out formation is solved,
+    whatever its scale or orientation. """
+    for scale in [1e-3, 1, 1e3]:
+        for angle in [0, 0.7]:
+            receivers, ranges, target = layout(scale, angle, 0)
+            assert spherical_interpolation((0, 0), receivers, ranges) is None
+
+            receivers, ranges, target = layout(scale, angle, 1)
+            x, y = spherical_interpolation((0, 0), receivers, ranges)
+            assert math.hypot(x - target[0], y - target[1]) < 1e-6 * scale
@@ -0,0 +1,57 @@
+import numpy as np
+
+import multilaterationv2
+import rx
+from grid_engine import distinct_best, hierarchical_search
+
+RESOLUTION = multilaterationv2.FINE_RESOLUTION
+
+
+def test_hierarchical_search_reaches_resolution():
+    """ Noise-free ranges on the square layout give the target to within the
+    search resolution anywhere in most of the search area. """
+    tx_coords = rx.TX_START_COORDS
+    rx_coords = rx.RX_START_COORDS
+    for x in np.linspace(-45, 45, 13):
+        for y in np.linspace(-45, 45, 13):
+            target_coords = tx_coords.add_x_offset(x).add_y_offset(y)
+            ranges = [
+                rx.emulate_range(coords, tx_coords, target_coords)
+                for coords in rx_coords
+            ]
+            estimate = multilaterationv2.estimate_target_position_hierarchical(
+                tx_coords, rx_coords, ranges)
+            assert estimate.distance(target_coords) <= RESOLUTION, (x, y)
+
+
+def test_hierarchical_search_prefers_nearest_mirror():
+    """ With the Tx and every Rx on a line, the target and its reflection fit
+    equally well, and prefer picks between them. """
+    tx = (0, 0)
+    receivers = [(5, 0), (-10, 0), (15, 0)]
+    for target in [(3, 7), (-12, -4), (8, 20)]:
+        ranges = [
+            np.hypot(*np.subtract(target, tx)) +
+            np.hypot(*np.subtract(target, receiver)) for receiver in receivers
+        ]
+        for side in (1, -1):
+            expected = (target[0], side * target[1])
+            result, residual = hierarchical_search(tx, receivers, ranges, tx,
+                                                   100, RESOLUTION,
+                                                   prefer=expected)
+            assert np.hypot(*np.subtract(result, expected)) <= RESOLUTION
+
+
+def test_distinct_best_skips_points_near_one_chosen():
+    """ Matches checking each point in order of residual against every point
+    already chosen. """
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-20, 20, (500, 2))
+    residuals = rng.uniform(0, 1, 500)
+    expected = []
+    for index in np.argsort(residuals):
+        if all(np.hypot(*(points[index] - points[other])) >= 3
+               for other in expected):
+            expected.append(index)
+    assert list(distinct_best(points, residuals, 10, 3)) == expected[:10]
+    assert list(distinct_best(points, residuals, 1000, 3)) == expected
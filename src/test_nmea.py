@@ -0,0 +1,78 @@
+import math
+
+from nmea import (GGARecord, NMEAParser, RMCRecord, checksum, parse_log)
+
+GGA_BODY = b"GPGGA,142115.00,4331.23049,S,17234.98533,E,1,08,0.9,10.0,M,,M,,"
+RMC_BODY = b"GNRMC,142115.00,A,4331.23049,S,17234.98533,E,0.5,90.0,030819,,"
+
+
+def sentence(body, checksum_value=None):
+    """ Returns a complete sentence for body, with its checksum unless another
+    is given. """
+    if checksum_value is None:
+        checksum_value = checksum(body)
+    return b"$" + body + b"*" + "{:02X}".format(checksum_value).encode() + \
+        b"\r\n"
+
+
+def test_checksum_is_xor_of_bytes():
+    for body in [b"", b"A", GGA_BODY, RMC_BODY, bytes(range(1, 200))]:
+        expected = 0
+        for byte in body:
+            expected ^= byte
+        assert checksum(body) == expected
+
+
+def test_gga_is_decoded():
+    parser = NMEAParser()
+    record, = parser.feed(sentence(GGA_BODY))
+    assert isinstance(record, GGARecord)
+    assert record.time == 14 * 3600 + 21 * 60 + 15
+    assert math.isclose(record.lat, -(43 + 31.23049 / 60))
+    assert math.isclose(record.long, 172 + 34.98533 / 60)
+    assert record.fix_quality == 1
+    assert record.num_satellites == 8
+    assert record.hdop == 0.9
+    assert parser.decoded == 1
+
+
+def test_sentences_are_framed_across_chunks():
+    """ Sentences split at every possible byte are still decoded once, and a
+    partial sentence is kept until its line ending arrives. """
+    stream = b"noise" + sentence(GGA_BODY) + sentence(RMC_BODY)
+    for split in range(len(stream)):
+        parser = NMEAParser()
+        records = parser.feed(stream[:split]) + parser.feed(stream[split:])
+        assert [type(record) for record in records] == [GGARecord, RMCRecord]
+
+
+def test_bad_sentences_are_counted_and_skipped():
+    parser = NMEAParser()
+    stream = (sentence(GGA_BODY, checksum(GGA_BODY) ^ 1) +
+              b"$" + GGA_BODY + b"\r\n" +
+              sentence(b"GPGSV,3,1,12") +
+              sentence(b"GPGGA,1421") +
+              sentence(GGA_BODY))
+    records = parser.feed(stream)
+    assert len(records) == 1
+    assert parser.checksum_errors == 2
+    assert parser.unsupported == 1
+    assert parser.malformed == 1
+    assert parser.decoded == 1
+
+
+def test_missing_fields_are_none():
+    parser = NMEAParser(types=["GGA"])
+    record, = parser.feed(sentence(b"GPGGA,,,,,,0,00,,,M,,M,,"))
+    assert record.time is None
+    assert record.lat is None
+    assert record.fix_quality == 0
+
+
+def test_parse_log(tmp_path):
+    path = tmp_path / "log.nmea"
+    path.write_bytes(sentence(GGA_BODY) * 3 + sentence(RMC_BODY) +
+                     sentence(GGA_BODY).rstrip(b"\r\n"))
+    arrays, parser = parse_log(str(path), chunk_size=7)
+    assert len(arrays["lat"]) == 4
+    assert parser.decoded == 4
@@ -0,0 +1,251 @@
+import numpy as np
+import pytest
+
+from gps import GPSCoord
+from packets import (FLAG_KEYFRAME, HEADER, KEYFRAME_INTERVAL, MICRODEGREES,
+                     PACKET_VERSION, RX_DTYPE, RX_RECORD, RX_TARGET_RECORD,
+                     RX_UPDATE, TX_UPDATE, CompactRxEncoder, CompactTxEncoder,
+                     KeyframeRequest, PacketError, RxUpdate, RxUpdateDecoder,
+                     TxUpdate, TxUpdateDecoder, decode_rx_array,
+                     decode_rx_updates, encode_rx_array, encode_rx_updates)
+
+TX_COORDS = GPSCoord(-43.520508, 172.583089)
+
+
+def make_updates(count, target=True):
+    return [
+        RxUpdate(rx_id % 4 + 1, 1565000000.0 + 0.1 * rx_id, 1000 + rx_id,
+                 TX_COORDS.add_x_offset(rx_id).add_y_offset(-rx_id),
+                 20.0 + 0.25 * rx_id,
+                 TX_COORDS.add_x_offset(5) if target else None)
+        for rx_id in range(count)
+    ]
+
+
+def assert_same_update(decoded, update):
+    assert decoded.rx_id == update.rx_id
+    assert decoded.seq_no == update.seq_no
+    assert decoded.timestamp == update.timestamp
+    assert decoded.rx_coords.lat == update.rx_coords.lat
+    assert decoded.rx_coords.long == update.rx_coords.long
+    assert decoded.range == update.range
+    if update.target_coords is None:
+        assert decoded.target_coords is None
+    else:
+        assert decoded.target_coords.lat == update.target_coords.lat
+        assert decoded.target_coords.long == update.target_coords.long
+
+
+@pytest.mark.parametrize("target", [True, False])
+def test_rx_update_batch_round_trip(target):
+    updates = make_updates(5, target)
+    frame = encode_rx_updates(updates)
+    record = RX_TARGET_RECORD if target else RX_RECORD
+    assert len(frame) == HEADER.size + 5 * record.size
+    decoded = decode_rx_updates(frame)
+    assert len(decoded) == 5
+    for decoded_update, update in zip(decoded, updates):
+        assert_same_update(decoded_update, update)
+
+
+def test_target_is_left_out_unless_every_update_has_it():
+    updates = make_updates(2)
+    updates[1].target_coords = None
+    assert decode_rx_updates(encode_rx_updates(updates))[0].target_coords is None
+    assert decode_rx_updates(encode_rx_updates(
+        make_updates(2), include_target=False))[0].target_coords is None
+
+
+def test_single_update_round_trip():
+    update = make_updates(1)[0]
+    assert_same_update(RxUpdate.from_bytes(update.to_bytes()), update)
+    with pytest.raises(PacketError):
+        RxUpdate.from_bytes(encode_rx_updates(make_updates(2)))
+
+
+def test_rx_array_views_the_buffer():
+    updates = make_updates(3, target=False)
+    frame = encode_rx_updates(updates)
+    readings = decode_rx_array(frame)
+    assert readings.dtype == RX_DTYPE
+    assert not readings.flags.writeable
+    np.testing.assert_array_equal(readings["seq_no"],
+                                  [update.seq_no for update in updates])
+    np.testing.assert_array_equal(readings["range"],
+                                  [update.range for update in updates])
+
+    # Changes to a buffer show through, since nothing was copied.
+    buffer = bytearray(frame)
+    readings = decode_rx_array(buffer)
+    buffer[HEADER.size] = 9
+    assert readings["rx_id"][0] == 9
+
+
+def test_rx_array_round_trip():
+    frame = encode_rx_updates(make_updates(4))
+    readings = decode_rx_array(frame)
+    assert encode_rx_array(readings) == frame
+    native = readings.astype(readings.dtype.newbyteorder("="))
+    assert encode_rx_array(native) == frame
+
+
+def test_tx_update_round_trip():
+    update = TxUpdate(TX_COORDS.add_x_offset(3), TX_COORDS)
+    decoded = TxUpdate.from_bytes(update.to_bytes())
+    assert decoded.target_coords.lat == update.target_coords.lat
+    assert decoded.tx_coords.long == update.tx_coords.long
+
+
+def test_invalid_frames_are_rejected():
+    frame = encode_rx_updates(make_updates(2))
+    bad_frames = [
+        frame[:HEADER.size - 1],
+        frame[:-1],
+        frame + b"\0",
+        HEADER.pack(PACKET_VERSION + 1, RX_UPDATE, 0, 0),
+        HEADER.pack(PACKET_VERSION, TX_UPDATE, 0, 0),
+    ]
+    for bad_frame in bad_frames:
+        with pytest.raises(PacketError):
+            decode_rx_updates(bad_frame)
+        with pytest.raises(PacketError):
+            decode_rx_array(bad_frame)
+
+
+def moving_updates(count, rx_id=1, step=0.1):
+    """ Updates from an Rx moving step metres east every 0.1 s. """
+    return [
+        RxUpdate(rx_id, 1565000000.0 + 0.1 * i, i,
+                 TX_COORDS.add_x_offset(step * i), 20.0 + 0.01 * i,
+                 TX_COORDS.add_y_offset(step * i)) for i in range(count)
+    ]
+
+
+def is_keyframe(frame):
+    return bool(frame[2] & FLAG_KEYFRAME)
+
+
+def assert_close_update(decoded, update):
+    """ Checks a decoded compact update is within the quantisation of the
+    original. """
+    assert decoded.rx_id == update.rx_id
+    assert decoded.seq_no == update.seq_no
+    assert decoded.timestamp == pytest.approx(update.timestamp, abs=1e-6)
+    assert decoded.rx_coords.lat == pytest.approx(update.rx_coords.lat,
+                                                  abs=0.5 / MICRODEGREES)
+    assert decoded.rx_coords.long == pytest.approx(update.rx_coords.long,
+                                                   abs=0.5 / MICRODEGREES)
+    assert decoded.range == pytest.approx(update.range, abs=0.0005)
+    assert decoded.target_coords.lat == pytest.approx(
+        update.target_coords.lat, abs=0.5 / MICRODEGREES)
+
+
+def test_compact_rx_round_trip():
+    encoder = CompactRxEncoder()
+    decoder = RxUpdateDecoder()
+    updates = moving_updates(3 * KEYFRAME_INTERVAL)
+    frames = [encoder.encode(update) for update in updates]
+    assert [i for i, frame in enumerate(frames) if is_keyframe(frame)] == [
+        0, KEYFRAME_INTERVAL, 2 * KEYFRAME_INTERVAL
+    ]
+    assert len(frames[1]) < len(frames[0]) < len(encode_rx_updates(updates[:1]))
+    for frame, update in zip(frames, updates):
+        decoded, = decoder.decode(frame)
+        assert_close_update(decoded, update)
+
+
+def test_large_change_sends_a_keyframe():
+    encoder = CompactRxEncoder()
+    update, moved = moving_updates(2, step=5000)
+    encoder.encode(update)
+    assert is_keyframe(encoder.encode(moved))
+
+
+def test_rx_decoder_keeps_a_keyframe_per_rx():
+    decoder = RxUpdateDecoder()
+    encoders = [CompactRxEncoder() for rx_id in range(2)]
+    streams = [moving_updates(5, rx_id) for rx_id in [1, 2]]
+    for updates in zip(*streams):
+        for encoder, update in zip(encoders, updates):
+            decoded, = decoder.decode(encoder.encode(update))
+            assert_close_update(decoded, update)
+
+    # Plain frames are decoded too.
+    decoded, = decoder.decode(encode_rx_updates(streams[0][:1]))
+    assert_same_update(decoded, streams[0][0])
+
+
+def test_deltas_from_a_lost_keyframe_are_dropped():
+    encoder = CompactRxEncoder()
+    decoder = RxUpdateDecoder()
+    updates = moving_updates(2 * KEYFRAME_INTERVAL)
+    frames = [encoder.encode(update) for update in updates]
+    decoder.decode(frames[0])
+
+    # Lose the second keyframe.
+    for frame in frames[KEYFRAME_INTERVAL + 1:]:
+        assert decoder.decode(frame) == []
+    assert decoder.missing_keyframes == KEYFRAME_INTERVAL - 1
+
+
+def test_lost_rx_keyframe_is_requested_once_and_resent():
+    encoder = CompactRxEncoder()
+    decoder = RxUpdateDecoder()
+    updates = moving_updates(KEYFRAME_INTERVAL, rx_id=3)
+
+    # Lose the first keyframe. The deltas after it are dropped, and a new
+    # keyframe is requested from the Rx once.
+    encoder.encode(updates[0])
+    for update in updates[1:3]:
+        assert decoder.decode(encoder.encode(update)) == []
+    assert decoder.take_keyframe_requests() == [3]
+    assert decoder.take_keyframe_requests() == []
+
+    request = KeyframeRequest.from_bytes(KeyframeRequest(3).to_bytes())
+    assert request.rx_id == 3
+    encoder.request_keyframe()
+    frames = [encoder.encode(update) for update in updates[3:]]
+    assert is_keyframe(frames[0])
+    assert not any(is_keyframe(frame) for frame in frames[1:])
+    for frame, update in zip(frames, updates[3:]):
+        decoded, = decoder.decode(frame)
+        assert_close_update(decoded, update)
+    assert decoder.missing_keyframes == 2
+
+
+def test_lost_tx_keyframe_is_requested_once_and_resent():
+    encoder = CompactTxEncoder()
+    decoder = TxUpdateDecoder()
+    updates = [
+        TxUpdate(TX_COORDS.add_x_offset(0.5 * i), TX_COORDS)
+        for i in range(KEYFRAME_INTERVAL)
+    ]
+    encoder.encode(updates[0])
+    for update in updates[1:3]:
+        assert decoder.decode(encoder.encode(update)) is None
+    assert decoder.take_keyframe_request()
+    assert not decoder.take_keyframe_request()
+
+    encoder.request_keyframe()
+    frames = [encoder.encode(update) for update in updates[3:]]
+    assert is_keyframe(frames[0])
+    for frame, update in zip(frames, updates[3:]):
+        decoded = decoder.decode(frame)
+        assert decoded.target_coords.long == pytest.approx(
+            update.target_coords.long, abs=0.5 / MICRODEGREES)
+    assert decoder.missing_keyframes == 2
+
+
+def test_compact_tx_round_trip():
+    encoder = CompactTxEncoder()
+    decoder = TxUpdateDecoder()
+    for i in range(2 * KEYFRAME_INTERVAL):
+        update = TxUpdate(TX_COORDS.add_x_offset(0.5 * i), TX_COORDS)
+        frame = encoder.encode(update)
+        assert is_keyframe(frame) == (i % KEYFRAME_INTERVAL == 0)
+        decoded = decoder.decode(frame)
+        assert decoded.target_coords.long == pytest.approx(
+            update.target_coords.long, abs=0.5 / MICRODEGREES)
+
+    # A delta from a keyframe the decoder never saw is dropped.
+    assert TxUpdateDecoder().decode(frame) is None
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from particle_filter import ParticleFilter
+
+TX = (0.0, 0.0)
+RECEIVERS = [(5.0, 5.0), (-5.0, 5.0), (-5.0, -5.0), (5.0, -5.0)]
+
+
+def ranges(target):
+    target = np.asarray(target)
+    return [
+        np.hypot(*target) + np.hypot(*(target - receiver))
+        for receiver in RECEIVERS
+    ]
+
+
+def test_filter_follows_a_moving_target():
+    rng = np.random.default_rng(1)
+    particle_filter = ParticleFilter(num_particles=2000, seed=0)
+    particle_filter.initialise((9.0, -3.0), 0.0)
+    initial_spread = particle_filter.estimate()[1]
+
+    velocity = np.array([-1.0, 0.5])
+    for step in range(1, 31):
+        timestamp = 0.1 * step
+        target = np.array([10.0, -4.0]) + velocity * timestamp
+        particle_filter.predict(timestamp)
+        particle_filter.update(TX, RECEIVERS,
+                               np.array(ranges(target)) +
+                               rng.normal(0, 0.1, len(RECEIVERS)))
+
+    (x, y), spread = particle_filter.estimate()
+    assert np.hypot(x - target[0], y - target[1]) < 0.5
+    assert spread < initial_spread
+
+
+def test_resampling_keeps_particle_count_and_resets_weights():
+    particle_filter = ParticleFilter(num_particles=500, seed=0)
+    particle_filter.initialise((0.0, 0.0), 0.0)
+    particle_filter.weights = np.zeros(500)
+    particle_filter.weights[7] = 1.0
+    particle_filter.resample()
+    assert particle_filter.particles.shape == (500, 4)
+    assert np.all(particle_filter.particles == particle_filter.particles[0])
+    assert particle_filter.weights == pytest.approx(np.full(500, 1 / 500))
+
+
+def test_seed_makes_filter_reproducible():
+    estimates = []
+    for i in range(2):
+        particle_filter = ParticleFilter(num_particles=200, seed=3)
+        particle_filter.initialise((5.0, 5.0), 0.0)
+        particle_filter.predict(0.1)
+        particle_filter.update(TX, RECEIVERS, ranges((5.0, 5.0)))
+        estimates.append(particle_filter.estimate())
+    assert estimates[0] == estimates[1]
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+import rx
+from solver_pool import MAX_RXS, SLOTS_PER_WORKER, SolverPool
+
+TARGET_OFFSETS = [(10, -4), (-7, 12), (3, 3), (-15, -9), (20, 5)]
+
+
+def group(x, y):
+    """ Noise-free ranges for a target at (x, y) metres from the Tx, with the
+    Rxs at their start positions. """
+    target_coords = rx.TX_START_COORDS.add_x_offset(x).add_y_offset(y)
+    ranges = [
+        rx.emulate_range(coords, rx.TX_START_COORDS, target_coords)
+        for coords in rx.RX_START_COORDS
+    ]
+    return rx.RX_START_COORDS, ranges, target_coords
+
+
+@pytest.fixture
+def pool():
+    pool = SolverPool(["lsq"], rx.TX_START_COORDS, num_workers=2)
+    yield pool
+    pool.close()
+
+
+def test_results_are_returned_in_submission_order(pool):
+    targets = []
+    results = []
+    for seq_no, (x, y) in enumerate(TARGET_OFFSETS):
+        rx_positions, ranges, target_coords = group(x, y)
+        targets.append(target_coords)
+        while pool.full():
+            results += pool.ordered_results(block=True)
+        pool.submit(seq_no, rx.TX_START_COORDS, rx_positions, ranges, None,
+                    0.1 * seq_no)
+    while pool.pending:
+        results += pool.ordered_results(block=True)
+
+    assert [seq_no for seq_no, result in results] == list(
+        range(len(TARGET_OFFSETS)))
+    for (seq_no, result), target_coords in zip(results, targets):
+        assert result.solver == "lsq"
+        assert result.spread is None
+        assert result.target_coords.distance(target_coords) < 0.05
+    assert pool.solver_counts["lsq"] == len(TARGET_OFFSETS)
+
+
+def test_submit_fails_when_every_slot_is_in_use(pool):
+    rx_positions, ranges, target_coords = group(5, 5)
+
+    # Keep the workers busy, so no group finishes while the slots fill up.
+    for i in range(pool.num_workers):
+        pool.executor.submit(time.sleep, 0.2)
+    futures = [
+        pool.submit(seq_no, rx.TX_START_COORDS, rx_positions, ranges, None, 0)
+        for seq_no in range(2 * SLOTS_PER_WORKER)
+    ]
+    assert pool.full()
+    with pytest.raises(RuntimeError):
+        pool.submit(99, rx.TX_START_COORDS, rx_positions, ranges, None, 0)
+
+    for future in futures:
+        future.result()
+    assert not pool.full()
+
+
+def test_too_many_rxs_are_rejected(pool):
+    rx_positions, ranges, target_coords = group(5, 5)
+    with pytest.raises(ValueError):
+        pool.submit(0, rx.TX_START_COORDS, rx_positions * MAX_RXS,
+                    ranges * MAX_RXS, None, 0)
+
+
+def test_slot_is_free_when_result_is_ready(pool):
+    """ A caller woken by a result can submit another group straight away. """
+    rx_positions, ranges, target_coords = group(5, 5)
+    for i in range(pool.num_workers):
+        pool.executor.submit(time.sleep, 0.2)
+    futures = [
+        pool.submit(seq_no, rx.TX_START_COORDS, rx_positions, ranges, None, 0)
+        for seq_no in range(pool.capacity)
+    ]
+    full_when_ready = []
+    for future in futures:
+        future.add_done_callback(
+            lambda future: full_when_ready.append(pool.full()))
+    for future in futures:
+        future.result()
+    assert full_when_ready == [False] * pool.capacity
+
+
+def test_stateful_solvers_need_a_single_worker():
+    with pytest.raises(ValueError):
+        SolverPool(["tracked", "lsq"], rx.TX_START_COORDS, num_workers=2)
+
+    pool = SolverPool(["tracked", "lsq"], rx.TX_START_COORDS, num_workers=1)
+    try:
+        rx_positions, ranges, target_coords = group(5, 5)
+        result = pool.submit(0, rx.TX_START_COORDS, rx_positions, ranges,
+                             None, 0).result()
+        assert result.solver == "tracked"
+    finally:
+        pool.close()
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import rx
+import solver_registry
+
+
+def emulated_ranges(target_coords):
+    return [
+        rx.emulate_range(coords, rx.TX_START_COORDS, target_coords)
+        for coords in rx.RX_START_COORDS
+    ]
+
+
+def test_chain_out_of_formation_falls_back():
+    """ A chain of only formation solvers still gives an estimate when the
+    drones are out of formation. """
+    chain = solver_registry.SolverChain(
+        [solver_registry.LookupSolver(lookup_table=None)])
+    target_coords = rx.TX_START_COORDS.add_x_offset(6).add_y_offset(-9)
+    estimate = chain.solve(rx.TX_START_COORDS, rx.RX_START_COORDS,
+                           emulated_ranges(target_coords), None, 0.0,
+                           in_formation=False)
+    assert estimate.distance(target_coords) < 0.05
+    assert chain.last_solver.name == solver_registry.LeastSquaresSolver.name
+    assert chain.last_solver.spread is None
+
+
+def test_chain_fallback_shares_the_frame():
+    solver = solver_registry.create_solver("lookup", rx.TX_START_COORDS,
+                                           lookup_table=object())
+    chain = solver_registry.SolverChain([solver])
+    assert chain.solvers[-1].frame is solver.frame
+
+
+class SlowSolver(solver_registry.LeastSquaresSolver):
+    """ Least squares solver which overruns its budget while slow is set. """
+    name = "slow"
+    slow = True
+
+    def solve(self, *args):
+        if self.slow:
+            time.sleep(0.01)
+        return super().solve(*args)
+
+
+def test_chain_demotes_and_retries_a_slow_solver():
+    slow = SlowSolver()
+    chain = solver_registry.SolverChain(
+        [slow, solver_registry.LinearSolver()], budget_s=0.005)
+    ranges = emulated_ranges(rx.TX_START_COORDS.add_x_offset(5))
+
+    def solve(calls):
+        for call in range(calls):
+            chain.solve(rx.TX_START_COORDS, rx.RX_START_COORDS, ranges, None,
+                        0.0)
+
+    solve(solver_registry.MAX_CONSECUTIVE_OVERRUNS)
+    assert chain.active == 1
+
+    # Still slow when retried, so it's demoted after a single overrun.
+    solve(solver_registry.RETRY_AFTER_CALLS + 1)
+    assert chain.last_solver is slow
+    assert chain.active == 1
+
+    slow.slow = False
+    solve(solver_registry.RETRY_AFTER_CALLS + 2)
+    assert chain.active == 0
+    assert chain.last_solver is slow
+
+
+def test_default_fallbacks_are_stateless():
+    fallbacks = solver_registry.cheaper_solvers("particle")
+    assert "tracked" not in fallbacks
+    assert "lsq" in fallbacks
+
+
+def test_solver_base_is_abstract():
+    with pytest.raises(TypeError):
+        solver_registry.Solver()
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import multilaterationv2
+import rx
+from gps import LocalFrame
+from tracker import MIN_WINDOW, KalmanTracker
+
+
+def test_track_converges_on_constant_velocity():
+    rng = np.random.default_rng(0)
+    tracker = KalmanTracker()
+    velocity = np.array([1.5, -0.5])
+    windows = []
+    for step in range(100):
+        timestamp = 0.1 * step
+        position = np.array([3.0, 4.0]) + velocity * timestamp
+        if tracker.initialised():
+            windows.append(tracker.predict(timestamp)[1])
+        assert tracker.update(position + rng.normal(0, 0.2, 2), timestamp)
+
+    assert tracker.state[2:] == pytest.approx(velocity, abs=0.5)
+    (x, y), window = tracker.predict(10.0)
+    assert (x, y) == pytest.approx(np.array([3.0, 4.0]) + velocity * 10.0,
+                                   abs=0.5)
+    assert MIN_WINDOW <= window < windows[0]
+
+
+def test_outliers_are_rejected_and_track_coasts():
+    tracker = KalmanTracker()
+    for step in range(20):
+        tracker.update((1.0 * 0.1 * step, 0.0), 0.1 * step)
+    state = tracker.state.copy()
+
+    assert not tracker.update((50.0, 50.0), 2.0)
+    assert tracker.rejected == 1
+    np.testing.assert_array_equal(tracker.state, state)
+    assert tracker.predict(2.0)[0] == pytest.approx((2.0, 0.0), abs=0.1)
+
+
+def test_window_grows_while_coasting():
+    tracker = KalmanTracker()
+    tracker.update((0.0, 0.0), 0.0)
+    tracker.update((0.1, 0.0), 0.1)
+    assert tracker.predict(0.2)[1] < tracker.predict(2.0)[1]
+
+
+def test_tracked_estimate_follows_moving_target():
+    """ Noise-free ranges for a target moving across the search area are
+    solved accurately from the prediction, and a reading far outside the gate
+    is replaced with the prediction. """
+    tx_coords = rx.TX_START_COORDS
+    frame = LocalFrame(tx_coords)
+    tracker = KalmanTracker()
+    for step in range(60):
+        timestamp = 0.1 * step
+        target_coords = tx_coords.add_x_offset(-30 + 1.0 * step).add_y_offset(
+            10 - 0.5 * step)
+        ranges = [
+            rx.emulate_range(coords, tx_coords, target_coords)
+            for coords in rx.RX_START_COORDS
+        ]
+        estimate = multilaterationv2.estimate_target_position_tracked(
+            tx_coords, rx.RX_START_COORDS, ranges, tracker, frame, timestamp)
+        assert estimate.distance(target_coords) < 0.01, step
+
+    outlier = tx_coords.add_x_offset(-40).add_y_offset(40)
+    ranges = [
+        rx.emulate_range(coords, tx_coords, outlier)
+        for coords in rx.RX_START_COORDS
+    ]
+    estimate = multilaterationv2.estimate_target_position_tracked(
+        tx_coords, rx.RX_START_COORDS, ranges, tracker, frame, 6.0)
+    assert tracker.rejected == 1
+    assert estimate.distance(tx_coords.add_x_offset(30).add_y_offset(-20)) < 1
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+
+from trajectory import (Trajectory, TrajectoryFormatError,
+                        convert_text_trajectory, is_stale,
+                        read_text_trajectory, write_trajectory)
+
+TEXT = ("Sat Aug  3 14:21:15 2019,4331.23049S,17234.98533E\n"
+        "Sat Aug  3 14:21:16 2019,4331.23100S,17234.98600E\n"
+        "\n"
+        "Sat Aug  3 14:21:17 2019,4331.23150S,17234.98650E\n")
+
+
+def test_text_conversion_round_trip(tmp_path):
+    text_path = tmp_path / "path.txt"
+    text_path.write_text(TEXT)
+    path = str(tmp_path / "path.traj")
+    convert_text_trajectory(str(text_path), path)
+
+    times, latitudes, longitudes = read_text_trajectory(str(text_path))
+    trajectory = Trajectory(path)
+    assert len(trajectory) == 3
+    assert trajectory.period == 1.0
+    assert trajectory.start_time == times[0]
+    np.testing.assert_array_equal(trajectory.times, times)
+    np.testing.assert_array_equal(trajectory[:].lat, latitudes)
+    assert trajectory[2].long == longitudes[2]
+    assert trajectory[0].lat == pytest.approx(-(43 + 31.23049 / 60))
+
+
+def test_lookup_by_time(tmp_path):
+    regular = str(tmp_path / "regular.traj")
+    write_trajectory(regular, [10.0, 10.5, 11.0, 11.5], np.arange(4),
+                     np.arange(4))
+    irregular = str(tmp_path / "irregular.traj")
+    write_trajectory(irregular, [10.0, 10.5, 11.2, 11.5], np.arange(4),
+                     np.arange(4))
+    assert Trajectory(regular).period == 0.5
+    assert Trajectory(irregular).period == 0.0
+
+    for path in [regular, irregular]:
+        trajectory = Trajectory(path)
+        assert trajectory.index_at(0) == 0
+        assert trajectory.index_at(10.5) == 1
+        assert trajectory.index_at(10.9) == 1
+        assert trajectory.index_at(11.5) == 3
+        assert trajectory.index_at(100) == 3
+        assert trajectory.coord_at(10.7).lat == 1
+
+
+def test_invalid_files_are_rejected(tmp_path):
+    path = tmp_path / "bad.traj"
+    path.write_bytes(b"TRAJ")
+    with pytest.raises(TrajectoryFormatError):
+        Trajectory(str(path))
+    path.write_bytes(b"JUNK" + bytes(36))
+    with pytest.raises(TrajectoryFormatError):
+        Trajectory(str(path))
+
+
+def test_stale_trajectory_is_detected(tmp_path):
+    text_path = str(tmp_path / "path.txt")
+    path = str(tmp_path / "path.traj")
+    with open(text_path, "w") as text:
+        text.write(TEXT)
+    assert is_stale(text_path, path)
+
+    convert_text_trajectory(text_path, path)
+    assert not is_stale(text_path, path)
+
+    # Editing the text path makes the trajectory stale until it's rebuilt.
+    converted = os.path.getmtime(path)
+    os.utime(text_path, (converted + 10, converted + 10))
+    assert is_stale(text_path, path)
+    convert_text_trajectory(text_path, path)
+    os.utime(path, (converted + 20, converted + 20))
+    assert not is_stale(text_path, path)
@@ -0,0 +1,200 @@
+import pytest
+
+pytest.importorskip("matplotlib")
+pytest.importorskip("rospy")
+
+from clock_sync import ClockSync
+from packets import RxUpdate, SyncReply
+from tx import NUM_RXS, TX_START_COORDS, UpdateStore
+
+RX_IDS = range(1, NUM_RXS + 1)
+
+
+def update(rx_id, seq_no, timestamp=None):
+    """ An update from an Rx, taken at 0.1 s intervals by default. """
+    if timestamp is None:
+        timestamp = 0.1 * seq_no
+    return RxUpdate(rx_id, timestamp, seq_no,
+                    TX_START_COORDS.add_x_offset(rx_id), 10.0 + rx_id,
+                    TX_START_COORDS)
+
+
+def test_full_group_is_released():
+    store = UpdateStore()
+    results = [store.store(update(rx_id, 0)) for rx_id in RX_IDS]
+    assert results == [False] * (NUM_RXS - 1) + [True]
+    assert store.get_ranges() == [10.0 + rx_id for rx_id in RX_IDS]
+    assert store.get_group_time() == 0
+    assert store.completed_groups == 1
+
+
+def test_groups_behind_the_horizon_are_evicted():
+    store = UpdateStore(capacity=8, horizon=4)
+    store.store(update(1, 0))
+    store.store(update(1, 3))
+    assert store.evicted_groups == 0
+
+    store.store(update(1, 4))
+    assert store.evicted_groups == 1
+    assert store.incomplete_groups == 1
+
+    # The rest of the evicted group is dropped rather than completing it.
+    for rx_id in RX_IDS[1:]:
+        assert not store.store(update(rx_id, 0))
+    assert store.late_updates == NUM_RXS - 1
+    assert store.completed_groups == 0
+
+
+def test_full_group_supersedes_older_groups():
+    store = UpdateStore()
+    store.store(update(1, 1))
+    for rx_id in RX_IDS:
+        store.store(update(rx_id, 2))
+    assert store.current_seq_no == 2
+    assert store.incomplete_groups == 1
+    assert not store.store(update(2, 1))
+    assert store.late_updates == 1
+
+
+def test_memory_is_bounded():
+    """ A long run of groups which never complete occupies no more than the
+    capacity of the store, and full groups still get through. """
+    store = UpdateStore(capacity=16, horizon=8)
+    for seq_no in range(1000):
+        store.store(update(1, seq_no))
+        store.store(update(2, seq_no))
+    assert len(store.slots) == 16
+    assert sum(seq_no >= 0 for seq_no in store.slot_seq_nos) <= 8
+    assert store.evicted_groups == 1000 - 8
+
+    assert [store.store(update(rx_id, 1000))
+            for rx_id in RX_IDS][-1]
+    assert store.current_seq_no == 1000
+
+
+def test_horizon_larger_than_capacity_is_rejected():
+    with pytest.raises(ValueError):
+        UpdateStore(capacity=8, horizon=9)
+
+
+def store_group(store, seq_no, rx_ids=RX_IDS, now=0.0):
+    """ Stores updates for a group from the given Rxs, returning the result of
+    the last store. """
+    return [store.store(update(rx_id, seq_no), now) for rx_id in rx_ids][-1]
+
+
+def test_partial_group_is_released_after_grace_period():
+    store = UpdateStore(min_group_size=3, grace_s=0.05)
+    assert store_group(store, 0)
+    assert not store_group(store, 1, RX_IDS[:3], now=10.0)
+    assert store.next_deadline() == pytest.approx(10.05)
+
+    assert not store.release_due(10.04)
+    assert store.release_due(10.06)
+    assert store.current_seq_no == 1
+    assert store.is_partial()
+    assert store.partial_groups == 1
+    assert store.get_ranges() == [10.0 + rx_id for rx_id in RX_IDS[:3]]
+
+    # The missing Rx's position comes from its newest update.
+    positions = store.get_rx_positions()
+    assert len(positions) == NUM_RXS
+    expected = update(NUM_RXS, 0).rx_coords
+    assert (positions[-1].lat, positions[-1].long) == (expected.lat,
+                                                       expected.long)
+
+    # Its reading is dropped if it arrives after the group was released.
+    assert not store.store(update(NUM_RXS, 1), 10.07)
+    assert store.late_updates == 1
+
+
+def test_newest_due_partial_group_is_released():
+    store = UpdateStore(min_group_size=3, grace_s=0.05)
+    store_group(store, 0)
+    store_group(store, 1, RX_IDS[:3], now=1.0)
+    store_group(store, 2, RX_IDS[1:], now=1.01)
+    assert store.release_due(2.0)
+    assert store.current_seq_no == 2
+    assert not store.release_due(2.0)
+    assert store.incomplete_groups == 1
+
+
+def test_no_partial_group_until_every_rx_has_sent_an_update():
+    store = UpdateStore(min_group_size=3, grace_s=0.05)
+    store_group(store, 0, RX_IDS[:3])
+    assert store.next_deadline() == float("inf")
+    assert not store.release_due(100.0)
+    assert store.current_group() is None
+
+
+def test_group_too_small_to_wait_for_is_not_released():
+    store = UpdateStore(min_group_size=3, grace_s=0.05)
+    store_group(store, 0)
+    store_group(store, 1, RX_IDS[:2])
+    assert not store.release_due(100.0)
+    assert store.current_seq_no == 0
+
+
+def test_invalid_minimum_group_size_is_rejected():
+    for min_group_size in [0, NUM_RXS + 1]:
+        with pytest.raises(ValueError):
+            UpdateStore(min_group_size=min_group_size)
+
+
+def test_timestamps_are_converted_to_the_tx_clock():
+    clock_sync = ClockSync()
+    for rx_id in RX_IDS:
+        # Rx clocks 2 s ahead of the Tx.
+        clock_sync.handle_reply(SyncReply(rx_id, 10.0, 12.001, 12.002), 10.003)
+    store = UpdateStore(clock_sync=clock_sync)
+    for rx_id in RX_IDS:
+        store.store(update(rx_id, 1, 12.1), 0.0)
+    assert store.current_seq_no == 1
+    assert store.get_group_time() == pytest.approx(10.1)
+
+
+def moving_update(rx_id, seq_no, phase):
+    """ An update from an Rx sampling phase seconds after the others, with
+    its position and range changing linearly in time. """
+    timestamp = 0.1 * seq_no + phase
+    return RxUpdate(rx_id, timestamp, seq_no,
+                    TX_START_COORDS.add_x_offset(rx_id + 2 * timestamp),
+                    10.0 + rx_id + 5 * timestamp, TX_START_COORDS)
+
+
+def test_unsynchronised_readings_are_interpolated_to_median_time():
+    phases = [0.0, 0.0, 0.04, 0.04]
+    store = UpdateStore()
+    for seq_no in range(2):
+        for rx_id, phase in zip(RX_IDS, phases):
+            store.store(moving_update(rx_id, seq_no, phase), 0.0)
+
+    # The first group can't be aligned, with only one update from each Rx.
+    assert store.discarded_groups == 1
+    assert store.current_seq_no == 1
+    assert store.aligned_groups == 2
+    assert not store.is_partial()
+    assert store.get_group_time() == pytest.approx(0.12)
+    assert store.get_ranges() == pytest.approx(
+        [10.0 + rx_id + 5 * 0.12 for rx_id in RX_IDS])
+    for rx_id, position in zip(RX_IDS, store.get_rx_positions()):
+        expected = TX_START_COORDS.add_x_offset(rx_id + 2 * 0.12)
+        assert position.distance(expected) < 1e-3
+
+
+def test_readings_far_from_the_group_are_dropped():
+    store = UpdateStore(min_group_size=3)
+    for rx_id in RX_IDS[:3]:
+        store.store(update(rx_id, 0, 0.0), 0.0)
+    assert store.store(update(NUM_RXS, 0, 1.0), 0.0)
+    assert store.unaligned_readings == 1
+    assert store.is_partial()
+    assert len(store.get_ranges()) == 3
+
+
+def test_group_with_too_few_aligned_readings_is_discarded():
+    store = UpdateStore(min_group_size=3)
+    for rx_id, timestamp in zip(RX_IDS, [0.0, 0.0, 1.0, 1.0]):
+        assert not store.store(update(rx_id, 0, timestamp), 0.0)
+    assert store.discarded_groups == 1
+    assert store.current_group() is None
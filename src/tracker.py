@@ -0,0 +1,107 @@
+import numpy as np
+
+# Standard deviation of the target's acceleration in m/s^2, used as the process
+# noise of the constant velocity model. Insects change direction quickly, so
+# this is fairly large.
+ACCELERATION_STD = 2.0
+
+# Standard deviation of the multilateration position error in metres.
+MEASUREMENT_STD = 0.5
+
+# Standard deviation in m/s of the target's velocity when the track starts.
+INITIAL_VELOCITY_STD = 5.0
+
+# Squared Mahalanobis distance beyond which a measurement is rejected as an
+# outlier (99% point of the chi-squared distribution with 2 degrees of freedom).
+GATE_THRESHOLD = 9.21
+
+# Limits on the side length in metres of the search window around the
+# predicted position.
+MIN_WINDOW = 2.0
+MAX_WINDOW = 100.0
+
+
+class KalmanTracker:
+    """ Constant velocity Kalman filter tracking the target position in metres
+    (x east, y north) relative to a fixed origin.
+
+    Before each multilateration, predict() gives the expected target position
+    and the size of the window which should contain the measurement. The
+    solver only needs to search that window, and its result is passed to
+    update(), which rejects it if it's too far from the prediction.
+    """
+    def __init__(self,
+                 acceleration_std=ACCELERATION_STD,
+                 measurement_std=MEASUREMENT_STD,
+                 gate_threshold=GATE_THRESHOLD):
+        self.acceleration_std = acceleration_std
+        self.gate_threshold = gate_threshold
+        self.measurement_noise = np.eye(2) * measurement_std**2
+
+        # State [x, y, vx, vy] and covariance, None until the first update.
+        self.state = None
+        self.covariance = None
+        self.last_time = None
+
+        # Number of measurements rejected by the gate.
+        self.rejected = 0
+
+    def initialised(self):
+        return self.state is not None
+
+    def _predicted(self, timestamp):
+        """ Returns the state and covariance predicted forward to timestamp. """
+        dt = max(0.0, timestamp - self.last_time)
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+
+        # Process noise from white acceleration noise on each axis.
+        q = self.acceleration_std**2
+        noise = np.zeros((4, 4))
+        noise[0, 0] = noise[1, 1] = q * dt**4 / 4
+        noise[0, 2] = noise[2, 0] = noise[1, 3] = noise[3, 1] = q * dt**3 / 2
+        noise[2, 2] = noise[3, 3] = q * dt**2
+
+        state = transition @ self.state
+        covariance = transition @ self.covariance @ transition.T + noise
+        return state, covariance
+
+    def predict(self, timestamp):
+        """ Returns the predicted (x, y) position at timestamp, and the side
+        length of the square search window which should contain the next
+        measurement. """
+        state, covariance = self._predicted(timestamp)
+        innovation = covariance[:2, :2] + self.measurement_noise
+        half_width = np.sqrt(self.gate_threshold *
+                             max(innovation[0, 0], innovation[1, 1]))
+        window = min(max(2 * half_width, MIN_WINDOW), MAX_WINDOW)
+        return (float(state[0]), float(state[1])), float(window)
+
+    def update(self, position, timestamp):
+        """ Corrects the track with a measured (x, y) position taken at
+        timestamp. Returns False (leaving the track coasting on its prediction)
+        if the measurement falls outside the gate, True otherwise. """
+        measurement = np.asarray(position, dtype=np.float64)
+        if self.state is None:
+            self.state = np.array([measurement[0], measurement[1], 0.0, 0.0])
+            self.covariance = np.diag([
+                self.measurement_noise[0, 0], self.measurement_noise[1, 1],
+                INITIAL_VELOCITY_STD**2, INITIAL_VELOCITY_STD**2
+            ])
+            self.last_time = timestamp
+            return True
+
+        state, covariance = self._predicted(timestamp)
+        innovation = measurement - state[:2]
+        innovation_covariance = covariance[:2, :2] + self.measurement_noise
+        inverse = np.linalg.inv(innovation_covariance)
+
+        if innovation @ inverse @ innovation > self.gate_threshold:
+            self.rejected += 1
+            return False
+
+        gain = covariance[:, :2] @ inverse
+        self.state = state + gain @ innovation
+        self.covariance = covariance - gain @ covariance[:2, :]
+        self.last_time = timestamp
+        return True
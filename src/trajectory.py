@@ -0,0 +1,180 @@
+""" Binary trajectory files for replaying emulated target paths.
+
+A trajectory file is a fixed size header followed by an array of records, each
+a timestamp and a latitude and longitude in DD, all little-endian float64:
+
+    magic      4s   b"TRAJ"
+    version    u2   FORMAT_VERSION
+    reserved   u2
+    count      u8   number of records
+    start_time f8   timestamp of the first record (UNIX time)
+    period     f8   time between records in seconds, or 0 if irregular
+    records    count * (time f8, lat f8, long f8)
+
+Trajectory memory-maps the records, so opening a file costs nothing however
+long it is, processes replaying the same file share its pages, and any record
+can be read by index, or by timestamp in O(1) when the period is regular.
+
+Convert an existing NMEA text path with:
+    python trajectory.py target_positions_gps.txt target_positions_gps.traj
+"""
+import argparse
+import calendar
+import os
+import struct
+import time
+
+import numpy as np
+
+from gps import GPSCoord, GPSCoordArray
+
+MAGIC = b"TRAJ"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHQdd")
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("lat", "<f8"), ("long", "<f8")])
+
+# Relative variation in the time between records below which the period is
+# treated as regular.
+PERIOD_TOLERANCE = 1e-6
+
+# Format of the times in the NMEA text files, e.g. "Sat Aug  3 14:21:15 2019".
+TEXT_TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+
+class TrajectoryFormatError(Exception):
+    pass
+
+
+def write_trajectory(path, times, latitudes, longitudes):
+    """ Writes a trajectory file from arrays of timestamps, latitudes and
+    longitudes. The file is written to a temporary path and renamed, so
+    readers never see a partial file. """
+    times = np.asarray(times, dtype=np.float64)
+    records = np.empty(len(times), dtype=RECORD_DTYPE)
+    records["time"] = times
+    records["lat"] = latitudes
+    records["long"] = longitudes
+
+    start_time = float(times[0]) if len(times) else 0.0
+    period = 0.0
+    if len(times) > 1:
+        steps = np.diff(times)
+        if np.all(np.abs(steps - steps[0]) <= PERIOD_TOLERANCE *
+                  max(abs(steps[0]), 1.0)) and steps[0] > 0:
+            period = float(steps[0])
+
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as output:
+        output.write(
+            HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(records), start_time,
+                        period))
+        output.write(records.tobytes())
+    os.replace(temp_path, path)
+
+
+def read_text_trajectory(path):
+    """ Reads a text target path, where each line contains a time, latitude
+    and longitude in NMEA format, e.g.
+    "Sat Aug  3 14:21:15 2019,4331.23049S,17234.98533E". Returns arrays of
+    timestamps, latitudes and longitudes. """
+    times = []
+    nmea_lats = []
+    nmea_longs = []
+    with open(path) as text:
+        for line in text:
+            if not line.strip():
+                continue
+            time_string, latitude, longitude = line.split(",")
+            times.append(
+                calendar.timegm(time.strptime(time_string.strip(),
+                                              TEXT_TIME_FORMAT)))
+            nmea_lats.append(latitude.strip())
+            nmea_longs.append(longitude.strip())
+    coords = GPSCoordArray.from_nmea(nmea_lats, nmea_longs)
+    return np.array(times, dtype=np.float64), coords.lat, coords.long
+
+
+def convert_text_trajectory(text_path, path):
+    """ Converts a text target path to a trajectory file. """
+    write_trajectory(path, *read_text_trajectory(text_path))
+
+
+def is_stale(text_path, path):
+    """ Returns True if the trajectory file is missing or older than the text
+    target path it was converted from. """
+    return (not os.path.exists(path)
+            or os.path.getmtime(path) < os.path.getmtime(text_path))
+
+
+class Trajectory:
+    """ A memory-mapped trajectory file. Indexing gives a GPSCoord for an
+    integer, or a GPSCoordArray for a slice. """
+    def __init__(self, path):
+        with open(path, "rb") as trajectory_file:
+            header = trajectory_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise TrajectoryFormatError(
+                "{} is too short to be a trajectory file.".format(path))
+        (magic, version, reserved, count, self.start_time,
+         self.period) = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise TrajectoryFormatError(
+                "{} is not a trajectory file.".format(path))
+        if version != FORMAT_VERSION:
+            raise TrajectoryFormatError(
+                "{} has unsupported format version {}.".format(path, version))
+
+        if count:
+            self.records = np.memmap(path,
+                                     dtype=RECORD_DTYPE,
+                                     mode="r",
+                                     offset=HEADER.size,
+                                     shape=(count, ))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        records = self.records[index]
+        if np.ndim(records) == 0:
+            return GPSCoord(float(records["lat"]), float(records["long"]))
+        return GPSCoordArray(records["lat"], records["long"])
+
+    @property
+    def times(self):
+        return self.records["time"]
+
+    def index_at(self, timestamp):
+        """ Returns the index of the last record at or before timestamp,
+        clamped to the range of the file. """
+        if self.period > 0:
+            index = int(np.floor((timestamp - self.start_time) / self.period +
+                                 PERIOD_TOLERANCE))
+        else:
+            index = int(np.searchsorted(self.times, timestamp,
+                                        side="right")) - 1
+        return min(max(index, 0), len(self) - 1)
+
+    def coord_at(self, timestamp):
+        """ Returns the position at timestamp, as a GPSCoord. """
+        return self[self.index_at(timestamp)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert an NMEA text target path to a trajectory file.")
+    parser.add_argument('input', help='text file to convert')
+    parser.add_argument('output', help='trajectory file to write')
+    args = parser.parse_args()
+
+    convert_text_trajectory(args.input, args.output)
+    trajectory = Trajectory(args.output)
+    print("Wrote {} records to {} (period {} s)".format(
+        len(trajectory), args.output, trajectory.period))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
+import asyncio
+import collections
+import concurrent.futures
+import math
 import time
 import zmq
+import zmq.asyncio
 import sys
 import matplotlib.pyplot as plt
 import argparse
 
-import multilaterationv2
+import solver_registry
+from clock_sync import ClockSync
 import swarming_logic
-from gps import GPSCoord
-from packets import RxUpdate, TxUpdate
+from gps import GPSCoord, LocalFrame
+from lookup_table import RangeLookupTable
+from packets import (KEYFRAME_REQUEST, SYNC_REPLY, CompactTxEncoder,
+                     KeyframeRequest, PacketError, RxUpdate, RxUpdateDecoder,
+                     SyncReply, TxUpdate, packet_type)
+from schedule import PeriodicSchedule, TickStats
+from solver_pool import SolverPool
 from mavros_offboard_posctl import MavrosOffboardPosctl
 
 # Must match the port numbers in rx.py
@@ -15,8 +26,8 @@ TX_STARTUP_PORT = 5554
 TX_RECEIVE_PORT = 5555
 TX_SEND_PORT = 5556
 
-# This must match the value in rx.py, and be compatible with the swarming logic
-# and the multilateration.
+# This must match the value in rx.py, and be compatible with the swarming logic.
+# The multilateration uses every Rx in a group, and needs at least 3.
 NUM_RXS = 4
 
 # Tx starting position. This value must match the one in rx.py
@@ -32,95 +43,407 @@ MAX_LONG = 172.583167
 # The drone ID of the transmitter drone.
 TX_ID = 0
 
-# How often the Tx should perform multilateration and send an update.
-# TODO: not currently used, instead the Tx just performs multilateration
-# whenever a new full group of readings has been received.
-# UPDATE_PERIOD_S = 1
+# How often the Tx should perform multilateration and send an update in fixed
+# rate mode (see --rate). Otherwise the Tx performs multilateration whenever a
+# new group of readings is ready.
+UPDATE_PERIOD_S = 0.1
 
 # Timeout period for receiving updates from Rxs.
 TIMEOUT_S = 3
 
-# The maximum allowed time difference in milliseconds between the timestamps of
-# range readings belonging to the same group.
+# The maximum time difference in seconds between the timestamps of range
+# readings belonging to the same group, after correcting for the offset of each
+# Rx's clock, for them to be used as they are. Otherwise each reading is
+# interpolated to a common time from the recent history of its Rx.
 # TODO: once real SDR readings are used, this should be very small (e.g. 1 ms?)
 SYNC_ACCURACY_S = 0.01
 
-
-class TimeoutException(Exception):
-    pass
+# Number of recent updates kept from each Rx for interpolating readings, and
+# how far in seconds a reading can be extrapolated beyond the oldest or newest
+# update in the history.
+HISTORY_LENGTH = 16
+MAX_EXTRAPOLATION_S = 0.2
+
+# Whether to send updates to the Rxs in the compact delta encoding (see
+# packets.py) for low bandwidth links. The Rxs decode either encoding.
+COMPACT_ENCODING = False
+
+# Number of groups of updates the UpdateStore has room for, and how many
+# sequence numbers behind the newest one a group can fall before it's evicted.
+UPDATE_STORE_CAPACITY = 64
+GROUP_HORIZON = 32
+
+# Number of readings after which a group can be used without waiting for the
+# rest (multilateration needs at least 3), and how long to wait for the rest
+# once that many have arrived.
+MIN_GROUP_SIZE = 3
+GROUP_GRACE_S = 0.05
+
+
+# Capacities of the queues between the stages of the asyncio runtime: groups
+# waiting to be solved, updates waiting to be sent to the Rxs, and side outputs
+# (logging, plotting and the Tx position setpoints for the simulation). When a
+# queue is full the oldest item is dropped, so a slow stage never holds up the
+# stages before it.
+GROUP_QUEUE_SIZE = 4
+SEND_QUEUE_SIZE = 4
+OUTPUT_QUEUE_SIZE = 16
+
+# A snapshot of a group of updates, which stays valid while the UpdateStore
+# moves on to later groups.
+Group = collections.namedtuple("Group", [
+    "seq_no", "rx_positions", "reading_positions", "ranges", "time", "partial",
+    "actual_target_coords"
+])
+
+# The results of processing a group, for plotting and logging.
+Output = collections.namedtuple("Output", [
+    "group", "target_coords", "target_spread", "desired_centre_position",
+    "tx_coords"
+])
 
 
-class TimingException(Exception):
+class TimeoutException(Exception):
     pass
 
 
 class UpdateStore:
-    """ Stores all the updates received from the Rx's, grouping them by the
+    """ Stores the recent updates received from the Rx's, grouping them by the
     sequence number of the reading they correspond to. Allows data from the most
     recent group of readings to be accessed for multilateration, swarming, etc.
 
-    TODO: only store updates for some period of time then write them to a log file?
+    Groups are kept in a fixed size ring of capacity slots, indexed by
+    seq_no % capacity, so memory use is constant however long the mission runs.
+    Incomplete groups are evicted once they fall more than horizon sequence
+    numbers behind the newest one seen, or behind the most recent full group,
+    and updates arriving for an evicted or superseded group are dropped.
+
+    A group is ready as soon as it's full, or grace_s seconds after
+    min_group_size of its readings arrived (see release_due), so one lagging Rx
+    doesn't hold up the others. Partial groups are only released once every Rx
+    has sent at least one update, so every Rx has a known position.
+
+    If the readings in a released group weren't taken within SYNC_ACCURACY_S
+    of each other, each is replaced by its Rx's reading interpolated to the
+    median time of the group (see align_readings), so the Rxs don't need to
+    sample in phase.
     """
-    def __init__(self):
-        # A list of lists, where updates[i][j] is the update with sequence
-        # number i from the Rx with ID j + 1. The list is expanded every time an
-        # update with a new sequence number is received.
-        self.updates = []
-
-        # The sequence number of the most recent full group of updates.
+    def __init__(self,
+                 capacity=UPDATE_STORE_CAPACITY,
+                 horizon=GROUP_HORIZON,
+                 min_group_size=MIN_GROUP_SIZE,
+                 grace_s=GROUP_GRACE_S,
+                 clock_sync=None):
+        if not 0 < horizon <= capacity:
+            raise ValueError("The group horizon must be between 1 and the "
+                             "capacity of the store.")
+        if not 0 < min_group_size <= NUM_RXS:
+            raise ValueError("The minimum group size must be between 1 and the "
+                             "number of Rxs.")
+        self.capacity = capacity
+        self.horizon = horizon
+        self.min_group_size = min_group_size
+        self.grace_s = grace_s
+
+        # If set, a ClockSync used to convert the timestamps of updates to the
+        # Tx clock as they're stored.
+        self.clock_sync = clock_sync
+
+        # A ring of groups, where slots[i][j] is the update from the Rx with ID
+        # j + 1 for the sequence number slot_seq_nos[i] (-1 if the slot is free),
+        # with i = seq_no % capacity.
+        self.slots = [[None] * NUM_RXS for i in range(capacity)]
+        self.slot_seq_nos = [-1] * capacity
+
+        # Number of readings in each slot, and the time at which each slot can
+        # be released as a partial group (infinite until it has enough).
+        self.slot_sizes = [0] * capacity
+        self.slot_deadlines = [math.inf] * capacity
+
+        # The newest update received from each Rx, which gives the positions of
+        # the Rxs missing from a partial group.
+        self.latest_updates = [None] * NUM_RXS
+
+        # The most recent updates from each Rx, including late ones, in order
+        # of timestamp, for interpolating readings to a common time.
+        self.histories = [
+            collections.deque(maxlen=HISTORY_LENGTH) for i in range(NUM_RXS)
+        ]
+
+        # The newest sequence number an update has been received for.
+        self.newest_seq_no = -1
+
+        # The sequence number of the most recent group of updates ready for
+        # use, and a copy of that group (with None for any missing readings),
+        # which stays valid after its slot is evicted.
         self.current_seq_no = -1
+        self.current = None
 
         # The last time an update was received from each Rx, useful for
         # determining the cause of a timeout.
         self.last_update_times = [time.time()] * NUM_RXS
 
-    def store(self, update):
-        """ Store a new RxUpdate. Returns True if a new full group of readings
-        is ready after storing this update, False otherwise.
+        # Counts of the groups completed, the groups released without every
+        # reading, the groups evicted, the groups evicted (or skipped by a newer
+        # group) before they were complete, and the updates dropped because
+        # their group was already released, evicted or superseded.
+        self.completed_groups = 0
+        self.partial_groups = 0
+        self.evicted_groups = 0
+        self.incomplete_groups = 0
+        self.late_updates = 0
+
+        # Counts of the groups whose readings were interpolated to a common
+        # time, the readings dropped because they couldn't be, and the groups
+        # discarded because too few readings were left.
+        self.aligned_groups = 0
+        self.unaligned_readings = 0
+        self.discarded_groups = 0
+
+    def store(self, update, now=None):
+        """ Store a new RxUpdate, received at time now (defaulting to the
+        current time). Returns True if a new full group of readings is ready
+        after storing this update, False otherwise.
         """
-        # Increase the size of the updates list if needed.
-        while update.seq_no >= len(self.updates):
-            self.updates.append([None] * NUM_RXS)
-
-        self.updates[update.seq_no][update.rx_id - 1] = update
+        if now is None:
+            now = time.time()
+        if self.clock_sync is not None:
+            update.timestamp = self.clock_sync.to_tx_time(
+                update.rx_id, update.timestamp)
         self.last_update_times[update.rx_id - 1] = update.timestamp
 
+        latest = self.latest_updates[update.rx_id - 1]
+        if latest is None or update.seq_no > latest.seq_no:
+            self.latest_updates[update.rx_id - 1] = update
+        self.add_to_history(update)
+
+        seq_no = update.seq_no
+        if (seq_no <= self.current_seq_no
+                or seq_no <= self.newest_seq_no - self.horizon):
+            self.late_updates += 1
+            return False
+
+        if seq_no > self.newest_seq_no:
+            self.newest_seq_no = seq_no
+            self.evict_stale()
+
+        # Any older group in this slot was evicted when it fell behind the
+        # horizon, since the horizon is no larger than the capacity.
+        slot = seq_no % self.capacity
+        self.slot_seq_nos[slot] = seq_no
+        group = self.slots[slot]
+        if group[update.rx_id - 1] is None:
+            self.slot_sizes[slot] += 1
+        group[update.rx_id - 1] = update
+
         # Check if we have a new full group of updates.
-        if all([update is not None for update in self.updates[update.seq_no]]):
-            assert (update.seq_no > self.current_seq_no)
-            self.current_seq_no = update.seq_no
-            self.check_timestamps()
+        if self.slot_sizes[slot] == NUM_RXS:
+            if not self.release(slot):
+                return False
+            self.completed_groups += 1
             return True
-        else:
+
+        # Start the grace period once the group is big enough to be used.
+        if self.slot_sizes[slot] == self.min_group_size:
+            self.slot_deadlines[slot] = now + self.grace_s
+        return False
+
+    def next_deadline(self):
+        """ Returns the time at which the next partial group can be released,
+        or infinity if there are no partial groups big enough (or some Rxs
+        haven't sent an update yet). """
+        if None in self.latest_updates:
+            return math.inf
+        return min(self.slot_deadlines)
+
+    def release_due(self, now=None):
+        """ Releases the newest partial group whose grace period has ended by
+        time now (defaulting to the current time). Returns True if a group was
+        released, False otherwise.
+        """
+        if now is None:
+            now = time.time()
+        if self.next_deadline() > now:
             return False
 
-    def current_group(self):
-        """ Return the list corresponding to the most recent full group of updates.
+        due = [
+            slot for slot in range(self.capacity)
+            if self.slot_deadlines[slot] <= now
+        ]
+        slot = max(due, key=lambda slot: self.slot_seq_nos[slot])
+        if not self.release(slot):
+            return False
+        self.partial_groups += 1
+        return True
+
+    def release(self, slot):
+        """ Makes the group in the given slot the current group, and evicts it
+        along with any older groups. Returns False if the group had to be
+        discarded instead, since too few of its readings could be aligned.
         """
-        return self.updates[self.current_seq_no]
+        group = self.align_readings(self.slots[slot])
+        if sum(update is not None for update in group) < self.min_group_size:
+            self.discarded_groups += 1
+            self.evict(slot)
+            return False
+        self.current_seq_no = self.slot_seq_nos[slot]
+        self.current = group
+        self.evict_stale()
+        return True
+
+    def evict(self, slot):
+        """ Frees the given slot of the ring. """
+        group = self.slots[slot]
+        if self.slot_seq_nos[slot] != self.current_seq_no:
+            self.evicted_groups += 1
+            if any(update is not None for update in group):
+                self.incomplete_groups += 1
+        for i in range(NUM_RXS):
+            group[i] = None
+        self.slot_seq_nos[slot] = -1
+        self.slot_sizes[slot] = 0
+        self.slot_deadlines[slot] = math.inf
+
+    def evict_stale(self):
+        """ Evicts every group which is older than the horizon, or no newer
+        than the current group (so can never be used). """
+        oldest = max(self.newest_seq_no - self.horizon, self.current_seq_no)
+        for slot in range(self.capacity):
+            if 0 <= self.slot_seq_nos[slot] <= oldest:
+                self.evict(slot)
 
-    def check_timestamps(self):
-        """ Check that all the readings in the current group of updates were
-        taken within a time interval less than SYNC_ACCURACY_S.
+    def current_group(self):
+        """ Return the list corresponding to the most recent group of updates,
+        ordered by Rx ID, with None for any readings missing from the group.
+        """
+        return self.current
+
+    def current_readings(self):
+        """ Return the updates in the most recent group, ordered by Rx ID and
+        leaving out any missing readings. """
+        return [update for update in self.current if update is not None]
+
+    def is_partial(self):
+        """ Return True if the most recent group is missing any readings. """
+        return None in self.current
+
+    def summary(self):
+        """ Returns a summary of the group counts. """
+        return ("{} groups completed, {} partial, {} evicted ({} incomplete), "
+                "{} late updates dropped, {} aligned ({} readings dropped, {} "
+                "groups discarded)".format(self.completed_groups,
+                                           self.partial_groups,
+                                           self.evicted_groups,
+                                           self.incomplete_groups,
+                                           self.late_updates,
+                                           self.aligned_groups,
+                                           self.unaligned_readings,
+                                           self.discarded_groups))
+
+    def add_to_history(self, update):
+        """ Adds an update to the history of its Rx, keeping the history in
+        order of timestamp. """
+        history = self.histories[update.rx_id - 1]
+        index = len(history)
+        while index > 0 and history[index - 1].timestamp > update.timestamp:
+            index -= 1
+        if len(history) == history.maxlen:
+            if index == 0:
+                # Older than everything in a full history.
+                return
+            history.popleft()
+            index -= 1
+        history.insert(index, update)
+
+    def align_readings(self, group):
+        """ Returns a copy of a group (with None for any missing readings).
+        If its readings weren't taken within SYNC_ACCURACY_S of each other,
+        each is replaced by its Rx's reading interpolated to the median time of
+        the group, or None if that's too far from the Rx's history. If the clock
+        offsets are being estimated, the readings are used as they are until
+        every Rx in the group has an estimate, since any difference could just
+        be clock skew.
         """
-        times = [update.timestamp for update in self.current_group()]
-        time_range = max(times) - min(times)
-        if time_range >= SYNC_ACCURACY_S:
-            raise TimingException(
-                "ERROR: timestamps of readings in group #{} differed by {:.4f} s."
-                .format(self.current_seq_no, time_range))
+        group = list(group)
+        readings = [update for update in group if update is not None]
+        if self.clock_sync is not None and not all(
+                self.clock_sync.has_estimate(update.rx_id)
+                for update in readings):
+            return group
+        times = sorted(update.timestamp for update in readings)
+        if times[-1] - times[0] < SYNC_ACCURACY_S:
+            return group
+
+        middle = len(times) // 2
+        epoch = (times[middle] + times[~middle]) / 2
+        for i, update in enumerate(group):
+            if update is not None:
+                group[i] = self.interpolate(update, epoch)
+                self.unaligned_readings += group[i] is None
+        self.aligned_groups += 1
+        return group
+
+    def interpolate(self, update, epoch):
+        """ Returns an RxUpdate with the position and range of the Rx which
+        sent update at time epoch, interpolated linearly between the updates in
+        its history on either side, or extrapolated from the two nearest, or
+        None if epoch is more than MAX_EXTRAPOLATION_S beyond the history.
+        """
+        history = self.histories[update.rx_id - 1]
+        if len(history) < 2:
+            # Nothing to interpolate with, so use the update as it is if it's
+            # close enough.
+            if abs(update.timestamp - epoch) >= SYNC_ACCURACY_S:
+                return None
+            before = after = update
+        elif (epoch < history[0].timestamp - MAX_EXTRAPOLATION_S
+              or epoch > history[-1].timestamp + MAX_EXTRAPOLATION_S):
+            return None
+        else:
+            index = 1
+            while (index < len(history) - 1
+                   and history[index].timestamp < epoch):
+                index += 1
+            before, after = history[index - 1], history[index]
+
+        interval = after.timestamp - before.timestamp
+        fraction = (epoch - before.timestamp) / interval if interval > 0 else 0
+
+        def lerp(start, end):
+            return start + fraction * (end - start)
+
+        rx_coords = GPSCoord(lerp(before.rx_coords.lat, after.rx_coords.lat),
+                             lerp(before.rx_coords.long, after.rx_coords.long))
+        return RxUpdate(update.rx_id, epoch, update.seq_no, rx_coords,
+                        lerp(before.range, after.range), update.target_coords)
 
     def get_rx_positions(self):
         """ Return a list of the current positions of each Rx, ordered by Rx ID.
-        The positions are taken from the most recent full group of Rx updates.
+        The positions are taken from the most recent group of Rx updates, or
+        the newest update from each Rx missing from that group.
+        """
+        return [(update or latest).rx_coords for update, latest in zip(
+            self.current_group(), self.latest_updates)]
+
+    def get_reading_positions(self):
+        """ Return a list of the positions of the Rxs which took the readings
+        in the most recent group, matching get_ranges().
         """
-        return [update.rx_coords for update in self.current_group()]
+        return [update.rx_coords for update in self.current_readings()]
 
     def get_ranges(self):
         """ Return a list of the most recent range readings, ordered by Rx ID.
-        The ranges are taken from the most recent full group of Rx updates.
+        The ranges are taken from the most recent group of Rx updates, and
+        only include the Rxs in that group.
+        """
+        return [update.range for update in self.current_readings()]
+
+    def get_group_time(self):
+        """ Return the mean timestamp of the readings in the most recent group
+        of Rx updates.
         """
-        return [update.range for update in self.current_group()]
+        times = [update.timestamp for update in self.current_readings()]
+        return sum(times) / len(times)
 
     def get_actual_target_coords(self):
         """ Return the actual target coordinates corresponding to the most
@@ -128,14 +451,55 @@ class UpdateStore:
         """
         # Assume that all updates in the group have the same actual target
         # position, so just return the first one.
-        return self.current_group()[0].target_coords
+        return self.current_readings()[0].target_coords
 
     def get_last_update_times(self):
         return self.last_update_times
 
+    def released_groups(self):
+        """ Return the number of groups which have become the current group. """
+        return self.completed_groups + self.partial_groups
+
+    def snapshot(self):
+        """ Return a Group holding the data from the most recent group. """
+        return Group(self.current_seq_no, self.get_rx_positions(),
+                     self.get_reading_positions(), self.get_ranges(),
+                     self.get_group_time(), self.is_partial(),
+                     self.get_actual_target_coords())
+
+
+class BacklogStats:
+    """ Counts of the messages drained from the receive socket before each
+    solve in latest wins mode, and the groups skipped as a result. """
+    def __init__(self):
+        self.drains = 0
+        self.total_depth = 0
+        self.max_depth = 0
+        self.skipped_groups = 0
+
+    def record(self, depth, skipped):
+        self.drains += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+        self.skipped_groups += skipped
+
+    def __str__(self):
+        if self.drains == 0:
+            return "no groups"
+        return ("{} groups solved, {} skipped, queue depth mean {:.1f} max {} "
+                "messages".format(self.drains, self.skipped_groups,
+                                  self.total_depth / self.drains,
+                                  self.max_depth))
+
 
 class TransmitterUAV:
-    def __init__(self, context, should_plot, mavros_controller=None):
+    def __init__(self,
+                 context,
+                 should_plot,
+                 mavros_controller=None,
+                 solver=None,
+                 latest_wins=False,
+                 update_period_s=None):
         # PULL socket for receiving updates from the Rxs.
         self.receiver = context.socket(zmq.PULL)
         self.receiver.bind("tcp://*:{}".format(TX_RECEIVE_PORT))
@@ -149,8 +513,17 @@ class TransmitterUAV:
         # TODO: Eventually this will be the real position read from a GPS module.
         self.tx_coords = TX_START_COORDS
 
-        # Store all the updates received from the Rxs.
-        self.updates = UpdateStore()
+        # Local frame at the Tx start position, used by the swarming logic for
+        # the whole session.
+        self.frame = LocalFrame(TX_START_COORDS)
+
+        # Estimates of the offset of each Rx's clock, from the sync requests
+        # sent while waiting for updates.
+        self.clock_sync = ClockSync()
+
+        # Store the recent updates received from the Rxs, with their timestamps
+        # converted to the Tx clock.
+        self.updates = UpdateStore(clock_sync=self.clock_sync)
 
         # Store all the estimated target positions.
         # TODO: only store positions temporarily then write them to a log file?
@@ -160,6 +533,12 @@ class TransmitterUAV:
         self.poller = zmq.Poller()
         self.poller.register(self.receiver, zmq.POLLIN)
 
+        # Decoder for the updates from the Rxs, which keeps the keyframes of
+        # any Rxs using the compact encoding, and the encoder for sending
+        # compact updates if enabled.
+        self.decoder = RxUpdateDecoder()
+        self.encoder = CompactTxEncoder() if COMPACT_ENCODING else None
+
         # Create a graph to plot the drone and target positions, if necessary.
         self.should_plot = should_plot
         if self.should_plot:
@@ -172,54 +551,230 @@ class TransmitterUAV:
         # State machine for drone swarming 0 = normal, 1 = reset, 2 = stop
         self.swarming_state = 0
 
+        # SolverChain used for multilateration, defaulting to the least squares
+        # solver with the closed form solver as a fallback.
+        if solver is None:
+            solver = solver_registry.SolverChain([
+                solver_registry.LeastSquaresSolver(self.frame),
+                solver_registry.LinearSolver(self.frame)
+            ])
+        self.solver = solver
+
+        # Spread in metres of the most recent target estimate, if the solver
+        # gives one.
+        self.target_spread = None
+
+        # In latest wins mode, the backlog of messages is drained before each
+        # solve and only the newest group is solved, so the Tx lowers its update
+        # rate rather than falling behind when solving is slow.
+        self.latest_wins = latest_wins
+        self.backlog = BacklogStats()
+
+        # If set, the Tx solves and sends an update every update_period_s on
+        # the newest group available, rather than whenever a group is ready.
+        self.update_period_s = update_period_s
+        self.tick_stats = TickStats()
+
+        # Number of ticks with no new group since the previous tick, which
+        # resend the previous estimate.
+        self.stale_ticks = 0
+
+    def print_solver_statistics(self):
+        print("Solver statistics:\n{}".format(self.solver.summary()))
+
     def tear_down(self):
+        self.print_solver_statistics()
+        print("Update store: {}".format(self.updates.summary()))
+        print("Clock offsets: {}".format(self.clock_sync.summary()))
+        if self.backlog.drains:
+            print("Backlog: {}".format(self.backlog))
+        if self.tick_stats.ticks:
+            print("Fixed rate loop: {}, {} stale ticks".format(
+                self.tick_stats, self.stale_ticks))
         if self.sim_running:
             self.mavros_controller.tearDown()
 
+        # Close the sockets without waiting to send queued messages (e.g. to
+        # Rxs which have already stopped), so the context can be terminated
+        # straight away and the ports are released.
+        self.receiver.close(linger=0)
+        self.sender.close(linger=0)
+
     def receive_updates(self, timeout_time):
         """ Repeatedly receive and store updates from the Rxs, returning once
-        a new full group of readings is ready. Raises a TimeoutException if
-        this doesn't happen before the timeout_time
+        a new group of readings is ready, either full or partial once its grace
+        period has ended. Raises a TimeoutException if this doesn't happen
+        before the timeout_time
         """
         while True:
-            # Time interval until timeout_time in ms.
-            timeout_interval = max(0, 1000 * (timeout_time - time.time()))
+            if self.updates.release_due():
+                return
+            self.send_sync_request()
+
+            # Time interval until timeout_time, or the end of the next grace
+            # period or sync request if that's sooner, in ms.
+            wait_time = min(timeout_time, self.updates.next_deadline(),
+                            self.clock_sync.next_request_time())
+            timeout_interval = max(0, 1000 * (wait_time - time.time()))
             sockets = dict(self.poller.poll(timeout=timeout_interval))
             if self.receiver in sockets:
-                message = self.receiver.recv(flags=zmq.NOBLOCK)
-                update = RxUpdate.from_bytes(message)
-                print("Received update: {}".format(update))
-                if self.updates.store(update):
+                if self.receive_message():
+                    if self.latest_wins:
+                        self.drain_backlog()
                     return
+            elif time.time() < timeout_time:
+                # A grace period ended, so release the partial group, or a sync
+                # request is due.
+                continue
             else:
-                # Print error message including the the time since an update
-                # was received from each Rx, to help diagnose the timeout.
-                message = "ERROR: Timeout occurred. Times since last update:\n"
-                times_since_update = [
-                    time.time() - last_time
-                    for last_time in self.updates.get_last_update_times()
-                ]
-                for rx_id in range(1, NUM_RXS + 1):
-                    message += "Rx {}: {:.3f} s\n".format(
-                        rx_id, times_since_update[rx_id - 1])
-                raise TimeoutException(message)
+                self.raise_timeout()
+
+    def raise_timeout(self):
+        # Print error message including the the time since an update
+        # was received from each Rx, to help diagnose the timeout.
+        message = "ERROR: Timeout occurred. Times since last update:\n"
+        times_since_update = [
+            time.time() - last_time
+            for last_time in self.updates.get_last_update_times()
+        ]
+        for rx_id in range(1, NUM_RXS + 1):
+            message += "Rx {}: {:.3f} s\n".format(rx_id,
+                                                  times_since_update[rx_id - 1])
+        raise TimeoutException(message)
+
+    def receive_message(self):
+        """ Receives and stores a message from the Rxs, which must be ready to
+        be received. Returns True if it completed a group of readings. """
+        # Each message holds a batch of one or more updates, which may
+        # complete several groups.
+        message = self.receiver.recv(flags=zmq.NOBLOCK, copy=False)
+        updates = self.decode_message(message.buffer)
+        for request in self.keyframe_requests():
+            self.sender.send(request)
+        group_ready = False
+        for update in updates:
+            print("Received update: {}".format(update))
+            group_ready |= self.updates.store(update)
+        return group_ready
+
+    def decode_message(self, buffer):
+        """ Decodes a message from the Rxs, returning a list of the RxUpdates
+        it holds. A sync reply is passed to the ClockSync instead, and a
+        keyframe request makes the next compact update a keyframe. """
+        receive_time = time.time()
+        try:
+            if packet_type(buffer) == SYNC_REPLY:
+                self.clock_sync.handle_reply(SyncReply.from_bytes(buffer),
+                                             receive_time)
+                return []
+            if packet_type(buffer) == KEYFRAME_REQUEST:
+                KeyframeRequest.from_bytes(buffer)
+                if self.encoder is not None:
+                    self.encoder.request_keyframe()
+                return []
+            return self.decoder.decode(buffer)
+        except PacketError as e:
+            print("ERROR: dropped bad update: {}".format(e))
+            return []
+
+    def keyframe_requests(self):
+        """ Returns the keyframe requests to send to the Rxs whose compact
+        updates were dropped for a missing keyframe. """
+        return [
+            KeyframeRequest(rx_id).to_bytes()
+            for rx_id in self.decoder.take_keyframe_requests()
+        ]
+
+    def send_sync_request(self):
+        """ Sends a sync request to the Rxs if one is due. """
+        request = self.clock_sync.request(time.time())
+        if request is not None:
+            self.sender.send(request.to_bytes())
+
+    def receive_until(self, deadline, timeout_time):
+        """ Receives and stores updates from the Rxs until the given
+        time.monotonic() deadline. Raises a TimeoutException if no new group is
+        ready by timeout_time (also on the monotonic clock), and returns it
+        otherwise, updated if a new group became ready. """
+        released = self.updates.released_groups()
+        while True:
+            self.updates.release_due()
+            if self.updates.released_groups() > released:
+                timeout_time = time.monotonic() + TIMEOUT_S
+                released = self.updates.released_groups()
+
+            now = time.monotonic()
+            if now >= timeout_time:
+                self.raise_timeout()
+            if now >= deadline:
+                return timeout_time
+            self.send_sync_request()
+
+            # Wake up for the deadline, the timeout, or the end of the next
+            # grace period or sync request (on the wall clock), whichever is
+            # first.
+            wait_time = min(deadline, timeout_time) - now
+            wait_time = min(
+                wait_time,
+                min(self.updates.next_deadline(),
+                    self.clock_sync.next_request_time()) - time.time())
+            if self.poller.poll(timeout=max(0, 1000 * wait_time)):
+                self.receive_message()
+
+    def drain_backlog(self):
+        """ Receives every message already waiting on the socket, so the newest
+        group of readings becomes the current group, skipping any older groups
+        completed in the meantime. """
+        released = self.updates.released_groups()
+        depth = 0
+        while self.poller.poll(timeout=0):
+            self.receive_message()
+            depth += 1
+        self.updates.release_due()
+
+        # Every group released while draining supersedes the one before it,
+        # starting with the group which ended receive_updates.
+        skipped = self.updates.released_groups() - released
+        self.backlog.record(depth, skipped)
+        if depth > 0:
+            print("Backlog: drained {} messages, skipped {} groups".format(
+                depth, skipped))
 
     def perform_multilateration(self):
         """ Returns the target position estimated by the multilateration module.
         """
-        rx_positions = self.updates.get_rx_positions()
-        ranges = self.updates.get_ranges()
-
-        # TODO: remove once multilateration is fixed.
-        assert NUM_RXS == 4, "Current multilateration version assumes 4 Rx's."
-        return multilaterationv2.estimate_target_position(
-            self.tx_coords, *rx_positions, *ranges)
-
-    def swarming_checks(self):
+        # Only the Rxs in the group are used if some readings are missing.
+        return self.multilaterate(self.updates.get_reading_positions(),
+                                  self.updates.get_ranges(),
+                                  self.updates.get_group_time(),
+                                  self.updates.is_partial())
+
+    def multilaterate(self, rx_positions, ranges, group_time, partial):
+        """ Returns the target position estimated from the given Rx positions
+        and range readings, taken at group_time. partial is True if some Rxs
+        are missing from the group.
+        """
+        # Warm start the solver from the previous estimate, if there is one.
+        previous_target = (self.target_positions[-1]
+                           if self.target_positions else None)
+
+        # Solvers which rely on the formation (e.g. the lookup table) are only
+        # used in the normal swarming state with a full group.
+        in_formation = self.swarming_state == 0 and not partial
+        target_coords = self.solver.solve(self.tx_coords, rx_positions, ranges,
+                                          previous_target, group_time,
+                                          in_formation)
+        self.target_spread = self.solver.last_solver.spread
+        return target_coords
+
+    def swarming_checks(self, rx_positions=None):
         """ Returns the desired centre position of the formation. 
         If formation is fine, output the target position, 
-        otherwise outputs the averaged centre of the formation. """
-        drone_positions = [self.tx_coords] + self.updates.get_rx_positions()
+        otherwise outputs the averaged centre of the formation.
+        rx_positions defaults to the positions from the most recent group. """
+        if rx_positions is None:
+            rx_positions = self.updates.get_rx_positions()
+        drone_positions = [self.tx_coords] + rx_positions
         target_coords = self.target_positions[-1]
         previous_target_coords = self.target_positions[-2]
 
@@ -234,23 +789,30 @@ class TransmitterUAV:
 
         # Update swarming formation fsm state
         self.swarming_state, est_centre = swarming_logic.update_fsm(
-            drone_positions, self.swarming_state)
+            drone_positions, self.swarming_state, self.frame)
         # Update drones next destination from the fsm state
         output_dest = swarming_logic.destination(self.swarming_state,
                                                  target_coords, est_centre)
         return output_dest
 
-    def plot_positions(self):
+    def plot_positions(self, tx_coords=None, rx_positions=None,
+                       actual_target_coords=None):
         """ Plot the current positions of the Tx and the Rxs, and the actual
-        target position. """
+        target position. The positions default to the current Tx position and
+        those from the most recent group. """
+        if tx_coords is None:
+            tx_coords = self.tx_coords
+            rx_positions = self.updates.get_rx_positions()
+            # Get the actual target coords (sent from the Rxs for plotting).
+            actual_target_coords = self.updates.get_actual_target_coords()
+
         colors = ['k', 'b', 'g', 'r', 'm']
-        positions = [self.tx_coords] + self.updates.get_rx_positions()
+        positions = [tx_coords] + rx_positions
         for i in range(len(positions)):
             plt.plot(positions[i].long, positions[i].lat, 'x' + colors[i])
 
-        # Get the actual target coords (sent from the Rxs for plotting).
-        actual_target_coords = self.updates.get_actual_target_coords()
-        plt.plot(actual_target_coords.long, actual_target_coords.lat, 'oc')
+        if actual_target_coords is not None:
+            plt.plot(actual_target_coords.long, actual_target_coords.lat, 'oc')
 
         # Call pause to render the changes.
         plt.pause(0.0000001)
@@ -262,6 +824,10 @@ class TransmitterUAV:
         Then performs multilateration and swarming checks to determine the
         desired target location, and sends this to each Rx.
         """
+        if self.update_period_s is not None:
+            self.run_fixed_rate()
+            return
+
         # Wait until at least one update is received from each Rx.
         self.receive_updates(time.time() + TIMEOUT_S)
         last_updates_received_time = time.time()
@@ -271,39 +837,341 @@ class TransmitterUAV:
         self.target_positions.append(self.perform_multilateration())
 
         while True:
-            loop_start_time = time.time()
-
             self.receive_updates(last_updates_received_time + TIMEOUT_S)
             last_updates_received_time = time.time()
 
-            target_coords = self.perform_multilateration()
-            self.target_positions.append(target_coords)
+            self.update_setpoints(self.perform_multilateration())
 
-            desired_centre_position = self.swarming_checks()
-
-            print("Estimated target position:", target_coords)
-            print("Desired formation centre:", desired_centre_position)
+    def run_fixed_rate(self):
+        """ Tx main loop in fixed rate mode.
+        Receives updates from the Rxs between ticks, which happen every
+        update_period_s. At each tick, performs multilateration on the newest
+        group of readings (or reuses the previous estimate if there's no new
+        group), then performs the swarming checks and sends the result to each
+        Rx. Raises a TimeoutException if no new group is ready for TIMEOUT_S.
+        """
+        # Wait until at least one update is received from each Rx, and perform
+        # an initial multilateration, so that the swarming checks have a
+        # previous target position to compare against.
+        self.receive_updates(time.time() + TIMEOUT_S)
+        self.target_positions.append(self.perform_multilateration())
+        solved_seq_no = self.updates.current_seq_no
 
-            # Update the Tx's own position.
-            self.tx_coords = swarming_logic.update_loc(desired_centre_position,
-                                                       TX_ID, self.tx_coords)
+        timeout_time = time.monotonic() + TIMEOUT_S
+        schedule = PeriodicSchedule(self.update_period_s, aligned=False)
+        while True:
+            timeout_time = self.receive_until(schedule.next_time, timeout_time)
 
-            # Plot the current Tx, Rx and actual target positions if needed.
-            if self.should_plot:
-                self.plot_positions()
+            scheduled_time = schedule.next_time
+            start_time = time.monotonic()
+            schedule.advance(start_time)
 
-            # Send the Tx position setpoint for the simulation if it's running.
-            if self.sim_running:
-                self.mavros_controller.reach_position(self.tx_coords.lat,
-                                                      self.tx_coords.long)
+            if self.updates.current_seq_no != solved_seq_no:
+                target_coords = self.perform_multilateration()
+                solved_seq_no = self.updates.current_seq_no
+            else:
+                target_coords = self.target_positions[-1]
+                self.stale_ticks += 1
+            self.update_setpoints(target_coords)
+
+            self.tick_stats.record(scheduled_time, start_time,
+                                   time.monotonic(), schedule.next_time)
+
+    def update_setpoints(self, target_coords):
+        """ Performs the swarming checks for a new target position estimate,
+        then moves the Tx, and sends the desired centre position of the
+        formation to each Rx. """
+        self.target_positions.append(target_coords)
+        desired_centre_position = self.swarming_checks()
+
+        print("Estimated target position:", target_coords)
+        if self.target_spread is not None:
+            print("Estimate spread: {:.2f} m".format(self.target_spread))
+        print("Desired formation centre:", desired_centre_position)
+
+        # Update the Tx's own position.
+        self.tx_coords = swarming_logic.update_loc(desired_centre_position,
+                                                   TX_ID, self.tx_coords,
+                                                   self.frame)
+
+        # Plot the current Tx, Rx and actual target positions if needed.
+        if self.should_plot:
+            self.plot_positions()
 
-            # Send the desired centre position and the Tx position to the Rxs.
-            update = TxUpdate(desired_centre_position, self.tx_coords)
-            print("Sending update: {}".format(update))
+        # Send the Tx position setpoint for the simulation if it's running.
+        if self.sim_running:
+            self.mavros_controller.reach_position(self.tx_coords.lat,
+                                                  self.tx_coords.long)
+
+        # Send the desired centre position and the Tx position to the Rxs.
+        update = TxUpdate(desired_centre_position, self.tx_coords)
+        print("Sending update: {}".format(update))
+        if self.encoder is not None:
+            self.sender.send(self.encoder.encode(update))
+        else:
             self.sender.send(update.to_bytes())
 
+        print()
+
+
+def put_dropping_oldest(queue, item):
+    """ Puts an item on an asyncio queue without waiting, dropping the oldest
+    item if it's full. Returns True if an item was dropped. """
+    dropped = False
+    if queue.full():
+        queue.get_nowait()
+        dropped = True
+    queue.put_nowait(item)
+    return dropped
+
+
+class AsyncTransmitterUAV(TransmitterUAV):
+    """ Runs the Tx pipeline as separate asyncio coroutines connected by
+    bounded queues, so receiving never waits for the solver and sending never
+    waits for plotting:
+
+        receive -> solve -> send
+                        -> output (plotting and logging)
+
+    The solver and swarming checks run in a single worker thread, so they keep
+    their state between groups without blocking the event loop. Plotting and
+    the Tx position setpoints for the simulation run in a separate output
+    thread, fed by the output queue, for the same reason. If a
+    SolverPool is given, multilateration instead runs in its worker processes
+    with several groups in flight, and the results are handled in order of
+    sequence number. The context must be a zmq.asyncio.Context.
+    """
+    def __init__(self,
+                 context,
+                 should_plot,
+                 mavros_controller=None,
+                 solver=None,
+                 latest_wins=False,
+                 solver_pool=None):
+        super().__init__(context, should_plot, mavros_controller, solver,
+                         latest_wins)
+        self.solver_pool = solver_pool
+
+        # In latest wins mode only the newest group waits to be solved, and
+        # each group it replaces is counted as skipped.
+        self.groups = asyncio.Queue(1 if latest_wins else GROUP_QUEUE_SIZE)
+        self.outgoing = asyncio.Queue(SEND_QUEUE_SIZE)
+        self.outputs = asyncio.Queue(OUTPUT_QUEUE_SIZE)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.output_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1)
+
+        # Number of items dropped from each queue because it was full.
+        self.dropped_groups = 0
+        self.dropped_sends = 0
+        self.dropped_outputs = 0
+
+        # Number of groups whose solve failed in the solver pool.
+        self.failed_groups = 0
+
+    def print_solver_statistics(self):
+        # In pool mode every solve runs in the workers, so the Tx's own chain
+        # is never called.
+        if self.solver_pool is None:
+            super().print_solver_statistics()
+        else:
+            print("Solver pool: {}, {} failed".format(
+                self.solver_pool.summary(), self.failed_groups))
+
+    def tear_down(self):
+        print("Dropped {} groups, {} updates to send and {} outputs".format(
+            self.dropped_groups, self.dropped_sends, self.dropped_outputs))
+        self.executor.shutdown(wait=False)
+        self.output_executor.shutdown(wait=False)
+        super().tear_down()
+        if self.solver_pool is not None:
+            self.solver_pool.close()
+
+    async def receive_loop(self):
+        """ Receives and stores updates from the Rxs, queueing a snapshot of
+        each group when it's ready. Raises a TimeoutException if no group is
+        ready within TIMEOUT_S of the last one. """
+        timeout_time = time.time() + TIMEOUT_S
+        while True:
+            if self.updates.release_due():
+                self.dropped_groups += put_dropping_oldest(
+                    self.groups, self.updates.snapshot())
+                timeout_time = time.time() + TIMEOUT_S
+
+            request = self.clock_sync.request(time.time())
+            if request is not None:
+                await self.sender.send(request.to_bytes())
+
+            wait_time = min(timeout_time, self.updates.next_deadline(),
+                            self.clock_sync.next_request_time())
+            timeout_interval = max(0, 1000 * (wait_time - time.time()))
+            if await self.receiver.poll(timeout=timeout_interval):
+                message = await self.receiver.recv(copy=False)
+                for update in self.decode_message(message.buffer):
+                    if self.updates.store(update):
+                        self.dropped_groups += put_dropping_oldest(
+                            self.groups, self.updates.snapshot())
+                        timeout_time = time.time() + TIMEOUT_S
+                for request in self.keyframe_requests():
+                    await self.sender.send(request)
+            elif time.time() >= timeout_time:
+                raise TimeoutException(
+                    "ERROR: Timeout occurred. No group of updates in {} s."
+                    .format(TIMEOUT_S))
+
+    def process_group(self, group):
+        """ Performs multilateration and swarming checks for a group. Runs in
+        the worker thread. """
+        target_coords = self.multilaterate(group.reading_positions,
+                                           group.ranges, group.time,
+                                           group.partial)
+        return self.finish_group(group, target_coords, self.target_spread)
+
+    def finish_group(self, group, target_coords, target_spread):
+        """ Performs the swarming checks for a group given its estimated target
+        position, and updates the Tx position. Returns an Output, or None for
+        the first group, which only gives the swarming checks a previous target
+        position. """
+        self.target_positions.append(target_coords)
+        if len(self.target_positions) < 2:
+            return None
+
+        desired_centre_position = self.swarming_checks(group.rx_positions)
+        self.tx_coords = swarming_logic.update_loc(desired_centre_position,
+                                                   TX_ID, self.tx_coords,
+                                                   self.frame)
+        return Output(group, self.target_positions[-1], target_spread,
+                      desired_centre_position, self.tx_coords)
+
+    def publish(self, output):
+        """ Queues the update for the Rxs and the side outputs of a group. """
+        update = TxUpdate(output.desired_centre_position, output.tx_coords)
+        self.dropped_sends += put_dropping_oldest(self.outgoing, update)
+        self.dropped_outputs += put_dropping_oldest(self.outputs, output)
+
+    async def solve_loop(self):
+        """ Processes each queued group in the worker thread, then queues the
+        update for the Rxs and the side outputs. """
+        if self.solver_pool is not None:
+            await self.pooled_solve_loop()
+            return
+
+        loop = asyncio.get_running_loop()
+        while True:
+            group = await self.groups.get()
+            output = await loop.run_in_executor(self.executor,
+                                                self.process_group, group)
+            if output is not None:
+                self.publish(output)
+
+    async def pooled_solve_loop(self):
+        """ Submits each queued group to the solver pool, waiting only when
+        every slot is in use, while finish_pooled_groups handles the results.
+        """
+        in_flight = asyncio.Queue()
+        slots = asyncio.Semaphore(self.solver_pool.capacity)
+        finisher = asyncio.ensure_future(
+            self.finish_pooled_groups(in_flight, slots))
+        try:
+            while True:
+                group = await self.groups.get()
+                await slots.acquire()
+                if finisher.done():
+                    finisher.result()
+
+                # Warm start from the newest finished estimate. The swarming
+                # state may lag by the number of groups in flight.
+                previous_target = (self.target_positions[-1]
+                                   if self.target_positions else None)
+                self.solver_pool.submit(
+                    group.seq_no, self.tx_coords, group.reading_positions,
+                    group.ranges, previous_target, group.time,
+                    self.swarming_state == 0 and not group.partial)
+                in_flight.put_nowait(group)
+        finally:
+            finisher.cancel()
+
+    async def finish_pooled_groups(self, in_flight, slots):
+        """ Finishes each group in flight in order of sequence number, as its
+        result becomes ready. A group whose solve failed in the pool is logged
+        and skipped. """
+        while True:
+            group = await in_flight.get()
+            try:
+                result = await asyncio.wrap_future(
+                    self.solver_pool.pending.pop(group.seq_no))
+            except Exception as e:
+                self.failed_groups += 1
+                print("ERROR: Multilateration failed for group #{}: {!r}".
+                      format(group.seq_no, e))
+                continue
+            finally:
+                # Always free the slot, so the solve loop can't block forever
+                # waiting for one.
+                slots.release()
+
+            output = self.finish_group(group, result.target_coords,
+                                       result.spread)
+            if output is not None:
+                self.publish(output)
+
+    async def send_loop(self):
+        """ Sends queued updates to the Rxs. """
+        while True:
+            update = await self.outgoing.get()
+            if self.encoder is not None:
+                await self.sender.send(self.encoder.encode(update))
+            else:
+                await self.sender.send(update.to_bytes())
+
+    async def output_loop(self):
+        """ Logs the results of each group, then plots them and sends the Tx
+        position setpoint in the output thread. """
+        loop = asyncio.get_running_loop()
+        while True:
+            output = await self.outputs.get()
+            print("Group #{}{}".format(output.group.seq_no,
+                                        " (partial)" if output.group.partial
+                                        else ""))
+            print("Estimated target position:", output.target_coords)
+            if output.target_spread is not None:
+                print("Estimate spread: {:.2f} m".format(output.target_spread))
+            print("Desired formation centre:", output.desired_centre_position)
             print()
 
+            await loop.run_in_executor(self.output_executor,
+                                       self.handle_output, output)
+
+    def handle_output(self, output):
+        """ Sends the Tx position setpoint for the simulation if it's running,
+        and plots the positions. Runs in the output thread. """
+        if self.sim_running:
+            self.mavros_controller.reach_position(output.tx_coords.lat,
+                                                  output.tx_coords.long)
+        if self.should_plot:
+            self.plot_positions(output.tx_coords, output.group.rx_positions,
+                                output.group.actual_target_coords)
+
+    async def run_async(self):
+        """ Runs every stage until one of them fails (e.g. with a timeout),
+        then cancels the others and raises its exception. """
+        tasks = [
+            asyncio.ensure_future(coroutine)
+            for coroutine in (self.receive_loop(), self.solve_loop(),
+                              self.send_loop(), self.output_loop())
+        ]
+        try:
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def run(self):
+        asyncio.run(self.run_async())
+
 
 def wait_for_rxs(context):
     """ Wait for a ready message to be received from each Rx, then send a
@@ -348,18 +1216,131 @@ def main():
         action='store_true',
         help='simulates the Tx drone in Gazebo (requires Gazebo to be running)'
     )
+    parser.add_argument(
+        '-m',
+        '--solver',
+        choices=list(solver_registry.SOLVERS),
+        default='lsq',
+        help='preferred multilateration solver (default: lsq)')
+    parser.add_argument(
+        '-f',
+        '--fallback',
+        metavar='SOLVERS',
+        help='comma separated solvers to fall back to, in order (default: '
+        'the solvers cheaper than the preferred one)')
+    parser.add_argument(
+        '-b',
+        '--budget',
+        type=float,
+        default=1000 * solver_registry.DEFAULT_BUDGET_S,
+        metavar='MS',
+        help='latency budget for each multilateration in ms')
+    parser.add_argument(
+        '-l',
+        '--lookup-table',
+        metavar='PATH',
+        help='path prefix of a formation lookup table built by lookup_table.py'
+    )
+    parser.add_argument(
+        '--particles',
+        type=int,
+        default=solver_registry.NUM_PARTICLES,
+        metavar='N',
+        help='number of particles used by the particle solver')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        metavar='N',
+        help='run multilateration in a pool of N worker processes, with '
+        'several groups in flight (implies --async). The stateful solvers '
+        '(tracked, particle) need N = 1')
+    parser.add_argument(
+        '-r',
+        '--rate',
+        type=float,
+        nargs='?',
+        const=1 / UPDATE_PERIOD_S,
+        metavar='HZ',
+        help='solve and send updates at a fixed rate, on the newest group '
+        'available at each tick (default rate: {:g} Hz)'.format(
+            1 / UPDATE_PERIOD_S))
+    parser.add_argument(
+        '--latest-wins',
+        action='store_true',
+        help='drain queued updates before each solve and only solve the '
+        'newest group, skipping older ones when solving falls behind')
+    parser.add_argument(
+        '-a',
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='run the receiving, solving, sending and plotting stages as '
+        'separate asyncio coroutines')
     args = parser.parse_args()
+    if args.rate is not None and (args.use_async or args.workers is not None):
+        parser.error('--rate is not supported with --async or --workers')
 
     # When running simulation, perform setup first so the drone is ready to fly.
+    mavros_controller = None
     if args.sim:
         mavros_controller = MavrosOffboardPosctl()
         mavros_controller.setUp()
 
+    # Memory-map the formation lookup table, if one was given.
+    lookup_table = None
+    if args.lookup_table is not None:
+        lookup_table = RangeLookupTable.load(args.lookup_table)
+
+    # Create the preferred solver followed by its fallbacks. The lookup solver
+    # is left out of the fallbacks if no table was given.
+    if args.fallback is not None:
+        fallbacks = [name for name in args.fallback.split(",") if name]
+        unknown = [
+            name for name in fallbacks if name not in solver_registry.SOLVERS
+        ]
+        if unknown:
+            parser.error('unknown fallback solvers: {} (choose from {})'.format(
+                ', '.join(unknown), ', '.join(solver_registry.SOLVERS)))
+    else:
+        fallbacks = solver_registry.cheaper_solvers(args.solver)
+        if lookup_table is None and 'lookup' in fallbacks:
+            fallbacks.remove('lookup')
+    if args.workers is not None and args.workers > 1:
+        stateful = [
+            name for name in [args.solver] + fallbacks
+            if solver_registry.SOLVERS[name].stateful
+        ]
+        if stateful:
+            parser.error('stateful solvers ({}) need --workers 1, since each '
+                         'worker only sees some of the groups'.format(
+                             ', '.join(stateful)))
+    solvers = [
+        solver_registry.create_solver(name, TX_START_COORDS, lookup_table,
+                                      args.particles)
+        for name in [args.solver] + fallbacks
+    ]
+    solver = solver_registry.SolverChain(solvers, args.budget / 1000)
+
+    # Start the solver pool, whose workers each create the same solvers.
+    pool = None
+    if args.workers is not None:
+        pool = SolverPool([args.solver] + fallbacks, TX_START_COORDS,
+                          args.budget / 1000, args.workers,
+                          args.lookup_table, args.particles)
+
     # Wait until all Rxs have sent a ready message.
     context = zmq.Context()
     wait_for_rxs(context)
 
-    tx = TransmitterUAV(context, args.plot, mavros_controller)
+    if args.use_async or pool is not None:
+        tx = AsyncTransmitterUAV(
+            zmq.asyncio.Context.shadow(context.underlying), args.plot,
+            mavros_controller, solver, args.latest_wins, pool)
+    else:
+        tx = TransmitterUAV(context, args.plot, mavros_controller, solver,
+                            args.latest_wins,
+                            None if args.rate is None else 1 / args.rate)
 
     try:
         tx.run()
@@ -371,6 +1352,8 @@ def main():
     finally:
         print("Performing tear down...")
         tx.tear_down()
+        # This also terminates the asyncio context, which shadows it.
+        context.destroy(linger=0)
         sys.exit(0)
 
 